@@ -1,41 +1,107 @@
-from flask import Flask, request, jsonify, send_from_directory
+import eventlet
+eventlet.monkey_patch()
+
+from flask import Flask, request, jsonify, session
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask_jwt_extended import JWTManager, decode_token
+from flask_socketio import join_room
 from models import db, User, Post, Message, PublicService, Advertisement
-from socket_instance import socketio
+from socket_instance import socketio, emit_batcher, user_room, ADMIN_ROOM
 from routes.auth import auth_bp
 from routes.posts import posts_bp
 from routes.admin import admin_bp
 from routes.messages import messages_bp
 from routes.public_services import public_services_bp
 from routes.advertisements import advertisements_bp
+from routes.search import search_bp
+from routes.changes import changes_bp
 from datetime import timedelta
 import os
+import time
+import click
 from dotenv import load_dotenv
-import eventlet
-eventlet.monkey_patch()
+from socket_bus import socketio_options
+from db_engine import configure_sqlite, install_pragmas
+from static_uploads import UploadsMiddleware
+from compression import init_compression
+from json_provider import FastJSONProvider
+from rate_limits import write_limiter
+from user_cache import user_cache
+import change_log
+import migrations
+from seed import seed_database
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(_name_)
+app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Trust X-Forwarded-For from the front proxy so per-IP limits see the real client
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('PROXY_FIX_X_FOR', 1)))
 
 # Configure CORS (تسمح للفرونت بالتواصل مع الباك)
-CORS(app, supports_credentials=True)
+CORS(app, supports_credentials=True, expose_headers=['X-Next-Before', 'X-Next-After', 'X-Next-Offset', 'X-Total-Count'])
 
 # إعدادات قاعدة البيانات وغيرها
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///forum.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///forum.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite engine profile, see db_engine.py
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'production')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # ms
+app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))  # negative = KiB
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_READ_POOL_SIZE'] = int(os.environ.get('SQLITE_READ_POOL_SIZE', 8))
+app.config['SQLITE_WRITER_TIMEOUT'] = int(os.environ.get('SQLITE_WRITER_TIMEOUT', 30))  # s
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'dev-secret-key')
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=1)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 app.config['BASE_URL'] = os.environ.get('BASE_URL', 'https://your-backend.onrender.com')
+# Serving /uploads/, see static_uploads.py: set UPLOADS_SENDFILE_HEADER to X-Accel-Redirect
+# or X-Sendfile to let the front proxy send the files
+app.config['UPLOADS_SENDFILE_HEADER'] = os.environ.get('UPLOADS_SENDFILE_HEADER') or None
+app.config['UPLOADS_ACCEL_PREFIX'] = os.environ.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+# JSON response compression, see compression.py
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # bytes
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_LEVEL'] = int(os.environ.get('COMPRESS_BROTLI_LEVEL', 4))
+# Per-user write limits as 'count/period' token buckets, see rate_limits.py; every limited
+# endpoint also draws from 'writes'. RATE_LIMIT_STORAGE=sqlite:///<path> shares them between workers
+app.config['RATE_LIMITS'] = {
+    'posts': os.environ.get('RATE_LIMIT_POSTS', '10/60'),
+    'messages': os.environ.get('RATE_LIMIT_MESSAGES', '20/60'),
+    'advertisements': os.environ.get('RATE_LIMIT_ADVERTISEMENTS', '5/300'),
+    'writes': os.environ.get('RATE_LIMIT_WRITES', '30/60'),
+}
+app.config['RATE_LIMIT_STORAGE'] = os.environ.get('RATE_LIMIT_STORAGE') or None
+app.config['RATE_LIMIT_MAX_KEYS'] = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+# Multi-worker serving (see serve.py): worker count and the Socket.IO relay between them
+app.config['WEB_CONCURRENCY'] = int(os.environ.get('WEB_CONCURRENCY', 1))
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# Batching of change events, see emit_batcher.py: window in ms (0 = off) and most events per frame
+app.config['SOCKETIO_BATCH_WINDOW'] = int(os.environ.get('SOCKETIO_BATCH_WINDOW', 0))
+app.config['SOCKETIO_BATCH_MAX_SIZE'] = int(os.environ.get('SOCKETIO_BATCH_MAX_SIZE', 100))
+
+# Uploaded files are answered before the request reaches Flask
+app.wsgi_app = UploadsMiddleware(
+    app.wsgi_app, app.config['UPLOAD_FOLDER'],
+    sendfile_header=app.config['UPLOADS_SENDFILE_HEADER'],
+    accel_prefix=app.config['UPLOADS_ACCEL_PREFIX']
+)
 
 # تهيئة الإضافات
 jwt = JWTManager(app)
+configure_sqlite(app)
 db.init_app(app)
-socketio.init_app(app, cors_allowed_origins="*")
+install_pragmas(app, db)
+init_compression(app)
+write_limiter.init_app(app)
+socketio.init_app(app, cors_allowed_origins="*",
+                  **socketio_options(app.config['SOCKETIO_MESSAGE_QUEUE'], app.config['WEB_CONCURRENCY']))
+emit_batcher.init_app(app)
 
 # تسجيل الـ Blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -44,27 +110,98 @@ app.register_blueprint(admin_bp, url_prefix='/api/admin')
 app.register_blueprint(messages_bp, url_prefix='/api/messages')
 app.register_blueprint(public_services_bp, url_prefix='/api/public-services')
 app.register_blueprint(advertisements_bp, url_prefix='/api/advertisements')
+app.register_blueprint(search_bp, url_prefix='/api/search')
+app.register_blueprint(changes_bp, url_prefix='/api/changes')
 
+# Search, unread counters, cache versions and the change log live in triggers
+# and tables only the migrations create, so create_all() is not enough
 with app.app_context():
-    db.create_all()
+    migrations.upgrade()
 
 @app.cli.command('init-db')
 def init_db_command():
-    db.create_all()
+    migrations.upgrade()
     print('Database tables created.')
 
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    applied = migrations.upgrade()
+    print(f'Applied migrations: {applied}' if applied else 'Database is up to date.')
+
+@app.cli.command('db-status')
+def db_status_command():
+    for version, description, applied in migrations.status():
+        print(f"{version:>4}  {'applied' if applied else 'pending':<8} {description}")
+
+@app.cli.command('db-check-plans')
+def db_check_plans_command():
+    failed = False
+    for name, ok, plan in migrations.check_plans():
+        print(f"{'ok' if ok else 'FAIL':<5} {name}")
+        for line in plan:
+            print(f'      {line}')
+        failed = failed or not ok
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('seed')
+@click.option('--users', default=20000, show_default=True, help='Users to add, across buildings and apartments')
+@click.option('--buildings', default=40, show_default=True)
+@click.option('--apartments', default=30, show_default=True, help='Apartments per building')
+@click.option('--pending-fraction', default=0.02, show_default=True, help='Share of users awaiting approval')
+@click.option('--banned-fraction', default=0.01, show_default=True, help='Share of users banned')
+@click.option('--posts-per-user', default=40.0, show_default=True)
+@click.option('--author-skew', default=1.0, show_default=True,
+              help='Zipf exponent of posts, messages and ads per resident; 0 spreads them evenly')
+@click.option('--messages-per-user', default=8.0, show_default=True)
+@click.option('--read-fraction', default=0.8, show_default=True, help='Share of messages already read')
+@click.option('--ads-per-user', default=0.5, show_default=True)
+@click.option('--max-images', default=3, show_default=True, help='Images per advertisement, from 0 up to this')
+@click.option('--services-per-category', default=10, show_default=True)
+@click.option('--deleted-fraction', default=0.02, show_default=True,
+              help='Share of posts, messages and ads soft-deleted')
+@click.option('--days', default=365, show_default=True, help='Days of history the rows are spread over')
+@click.option('--password', default='password123', show_default=True, help='Password of every seeded user')
+@click.option('--random-seed', default=42, show_default=True)
+def seed_command(**options):
+    """Bulk-insert synthetic users, posts, messages, ads and services for load testing"""
+    migrations.upgrade()
+    started = time.perf_counter()
+    counts = seed_database(**options)
+    elapsed = time.perf_counter() - started
+    for table, count in counts.items():
+        print(f'{count:>10}  {table}')
+    print(f'{sum(counts.values()):>10}  rows in {elapsed:.1f} s')
+
 
 @app.route('/')
 def index():
     return jsonify({"message": "Welcome to Neighborhood Forum API"})
 
-@app.route('/uploads/<path:filename>')
-def uploaded_file(filename):
-    return send_from_directory('uploads', filename)
-
 # Socket.IO event handlers
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth):
+    # Sockets authenticate with the same JWT as the REST API, passed as
+    # auth={"token": ...} or ?token=; unauthenticated connections are refused
+    token = (auth or {}).get('token') or request.args.get('token')
+    if not token:
+        return False
+    try:
+        claims = decode_token(token)
+    except Exception:
+        return False
+    
+    session['user_id'] = int(claims['sub'])
+    join_room(user_room(session['user_id']))
+    if claims.get('is_admin', False):
+        join_room(ADMIN_ROOM)
+    
+    # A reconnecting client passes the last seq it applied to get what it missed
+    since = (auth or {}).get('since')
+    if isinstance(since, int):
+        user = user_cache.get(session['user_id'])
+        if user:
+            change_log.replay(since, change_log.visible_rooms(user), request.sid)
     print('Client connected')
 
 @socketio.on('disconnect')
@@ -77,8 +214,13 @@ def handle_new_post(data):
 
 @socketio.on('new_message')
 def handle_new_message(data):
-    socketio.emit('message_update', data)
-
-if _name_ == '_main_':
+    # Relay only to the sender and the addressed recipient
+    rooms = [user_room(session['user_id'])]
+    recipient_id = ((data or {}).get('recipient') or {}).get('id')
+    if recipient_id is not None:
+        rooms.append(user_room(recipient_id))
+    socketio.emit('message_update', data, to=rooms)
+
+if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     socketio.run(app, host='0.0.0.0', port=port)
\ No newline at end of file
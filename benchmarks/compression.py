@@ -0,0 +1,126 @@
+"""CPU cost against bytes saved when compressing typical list responses.
+
+    python benchmarks/compression.py [--repeat 200]
+
+Payloads are shaped like the real responses: pages of 20 and 100 posts,
+a page of advertisements with image variants, and the public services
+catalog. Each is compressed with gzip and, when installed, brotli at a few
+levels; the table shows the compressed size, the share of bytes saved and
+the time per response.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import brotli
+
+WORDS = (
+    'the building water meter parking elevator gate keys lost found cat dog sale '
+    'apartment floor maintenance tomorrow morning evening please contact neighbors '
+    'صيانة المصعد العمارة الدور شقة للبيع مفتاح مياه كهرباء بكرة الصبح جيران'
+).split()
+
+LEVELS = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+if brotli is not None:
+    LEVELS += [('br', 1), ('br', 4), ('br', 11)]
+
+
+def sentence(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def posts_page(rng, count):
+    start = datetime(2025, 1, 1)
+    return [{
+        "id": 10000 - i,
+        "content": sentence(rng, 8, 60),
+        "created_at": (start + timedelta(minutes=rng.randint(0, 500000))).isoformat(),
+        "is_deleted": False,
+        "deletion_type": None,
+        "author": {"id": rng.randint(1, 400), "username": f'resident{rng.randint(1, 400)}', "is_banned": False},
+    } for i in range(count)]
+
+
+def advertisements_page(rng, count):
+    base = 'https://your-backend.onrender.com/uploads/'
+    ads = []
+    for i in range(count):
+        stems = [f'{rng.getrandbits(128):032x}_picture' for _ in range(rng.randint(0, 4))]
+        ads.append({
+            "id": 5000 - i,
+            "title": sentence(rng, 2, 6),
+            "content": sentence(rng, 10, 50),
+            "created_at": datetime(2025, 6, 1).isoformat(),
+            "images": [f'{base}{stem}.png' for stem in stems],
+            "image_variants": [{
+                "original": f'{base}{stem}.png',
+                "display": f'{base}{stem}.display.webp',
+                "thumbnail": f'{base}{stem}.thumbnail.webp',
+            } for stem in stems],
+            "price": round(rng.uniform(10, 5000), 2),
+            "phone_number": f'01{rng.randint(100000000, 299999999)}',
+            "author": {"id": rng.randint(1, 400), "username": f'resident{rng.randint(1, 400)}'},
+        })
+    return ads
+
+
+def catalog(rng, categories, services):
+    return [{
+        "id": c,
+        "name": sentence(rng, 1, 3),
+        "description": sentence(rng, 5, 15),
+        "services": [{
+            "id": c * 100 + s,
+            "name": sentence(rng, 1, 3),
+            "category": c,
+            "phone_number": f'01{rng.randint(100000000, 299999999)}',
+            "status": rng.choice(['Active', 'Unavailable']),
+            "created_at": datetime(2025, 1, 1).isoformat(),
+            "updated_at": datetime(2025, 1, 1).isoformat(),
+        } for s in range(services)],
+    } for c in range(1, categories + 1)]
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    payloads = [
+        ('posts x20', posts_page(rng, 20)),
+        ('posts x100', posts_page(rng, 100)),
+        ('ads x20', advertisements_page(rng, 20)),
+        ('catalog 10x12', catalog(rng, 10, 12)),
+    ]
+    if brotli is None:
+        print('Brotli is not installed, showing gzip only\n')
+
+    print(f'{"payload":<15}{"bytes":>8}  {"codec":<8}{"bytes":>8}{"saved":>8}{"us/op":>10}')
+    for name, data in payloads:
+        body = json.dumps(data, separators=(',', ':'), ensure_ascii=True).encode('utf-8')
+        for encoding, level in LEVELS:
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                compressed = compress(body, encoding, level)
+            elapsed = (time.perf_counter() - started) / args.repeat
+            saved = 1 - len(compressed) / len(body)
+            print(f'{name:<15}{len(body):>8}  {encoding + "-" + str(level):<8}{len(compressed):>8}'
+                  f'{saved:>8.0%}{elapsed * 1e6:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,513 @@
+"""Latency, throughput, response size and SQL statements for every API route.
+
+    python benchmarks/endpoints.py [--scale 1k] [--requests 200] [--mode both]
+                                   [--concurrency 16] [--output results.json]
+                                   [--baseline previous.json] [--tolerance 0.25]
+
+A fresh database, with every migration applied, is seeded by seed.py with
+--scale posts (1k, 100k, 1m, ...) and users, messages, advertisements and
+services in proportion. Each route is then driven --requests times, after a short warm-up:
+
+    client  through Flask's test client, one request at a time, counting the
+            SQL statements each request runs
+    server  over HTTP against serve.py (one eventlet worker) from
+            --concurrency green threads with keep-alive connections
+
+Routes that delete or change state work through pools of ids: seeded rows,
+or the rows created by the route measured just before (POST /api/posts
+feeds DELETE /api/posts/<id>), so every request does real work.
+
+For each route the table and the JSON output hold p50/p95/p99 latency,
+requests per second, mean response bytes (as sent, compressed when the
+route compresses) and statements per request. Each route has a budget of
+statements and p95 latency, checked in the client run (in the server run
+latency is mostly time spent queued); with --baseline, a route whose p95 or
+statement count grew by more than --tolerance over the earlier run is also
+reported. The exit status is 1 when a budget is exceeded, a regression is
+found, or a route answers with errors.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+workdir = tempfile.mkdtemp(prefix='forum-endpoints-')
+DATABASE_URL = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+# The app reads its settings on import; limits are lifted so they don't answer 429
+BENCH_ENV = {
+    'DATABASE_URL': DATABASE_URL,
+    'SQLITE_PROFILE': 'production',
+    'RATE_LIMIT_POSTS': '1000000/1',
+    'RATE_LIMIT_MESSAGES': '1000000/1',
+    'RATE_LIMIT_ADVERTISEMENTS': '1000000/1',
+    'RATE_LIMIT_WRITES': '1000000/1',
+    'LOGIN_IP_LIMIT': '1000000',
+    'LOGIN_USERNAME_LIMIT': '1000000',
+}
+os.environ.update(BENCH_ENV)
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, insert, text
+from app import app
+from compression import brotli
+from models import db, User
+from seed import seed_database
+import migrations
+
+WARMUP = 10
+# Growth below these is noise, whatever the tolerance
+REGRESSION_NOISE = {'p95_ms': 2.0, 'statements_mean': 0.5}
+PASSWORD = 'benchmark'
+
+
+def parse_scale(value):
+    """Number of posts from '1k', '100k', '1m' or a plain number"""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+class Pools:
+    """The users the routes act as, and ids handed out to the routes that consume them, each id once"""
+
+    def __init__(self, admin, resident, resident_name, feed_cursor, pools):
+        self.admin = admin
+        self.resident = resident
+        self.resident_name = resident_name
+        self.feed_cursor = feed_cursor  # a post halfway down the feed
+        self.pools = pools
+
+    def take(self, name):
+        return self.pools[name].pop(0)
+
+    def peek(self, name):
+        return self.pools[name][0]
+
+    def add(self, name, value):
+        self.pools[name].append(value)
+
+    def move(self, name, to):
+        value = self.take(name)
+        self.add(to, value)
+        return value
+
+
+def seed(scale, reserve, random_seed):
+    """Seed the database with seed.py; returns the rows added per table and the Pools.
+
+    Beyond --scale posts and the rest in proportion, `reserve` rows of each
+    kind the routes consume (pending and approved users, live posts and
+    advertisements) are added.
+    """
+    users = max(scale // 20, 50) + 2 * reserve
+    counts = seed_database(users=users, posts_per_user=(scale + reserve) / users,
+                           messages_per_user=scale / 2 / users, ads_per_user=(scale // 10 + 2 * reserve) / users,
+                           password=PASSWORD, random_seed=random_seed)
+    # Users awaiting approval, for the approve and reject routes
+    first = db.session.execute(text('SELECT max(id) FROM user')).scalar() + 1
+    db.session.execute(insert(User), [
+        {'username': f'pending{user_id}', 'password': 'x', 'full_name': 'Pending Resident',
+         'building_number': '7', 'apartment_number': str(user_id % 30 + 1), 'is_approved': False}
+        for user_id in range(first, first + 2 * reserve)
+    ])
+    db.session.commit()
+    counts['user'] += 2 * reserve
+
+    def ids(sql, **params):
+        return db.session.execute(text(sql), params).scalars().all()
+
+    admin = ids('SELECT id FROM user WHERE is_admin = 1 ORDER BY id LIMIT 1')[0]
+    # The resident with the most posts, and with them messages and ads
+    resident = ids('SELECT post.user_id FROM post JOIN user ON user.id = post.user_id '
+                   'WHERE user.is_approved = 1 AND user.is_banned = 0 AND user.is_admin = 0 '
+                   'GROUP BY post.user_id ORDER BY count(*) DESC LIMIT 1')[0]
+    resident_name = ids('SELECT username FROM user WHERE id = :id', id=resident)[0]
+    feed_cursor = ids('SELECT id FROM post ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET :n',
+                      n=(scale + reserve) // 2)[0]
+    return counts, Pools(admin, resident, resident_name, feed_cursor, {
+        'pending': list(range(first, first + 2 * reserve)),
+        'residents': ids('SELECT id FROM user WHERE is_approved = 1 AND is_banned = 0 AND is_admin = 0 '
+                         'AND id != :resident ORDER BY id DESC LIMIT :n', resident=resident, n=reserve),
+        'banned': [],
+        'live_posts': ids('SELECT id FROM post WHERE is_deleted = 0 AND user_id != :resident '
+                          'ORDER BY id DESC LIMIT :n', resident=resident, n=reserve),
+        'live_ads': ids('SELECT id FROM advertisement WHERE is_deleted = 0 ORDER BY id DESC LIMIT :n', n=reserve),
+        'own_posts': [], 'own_ads': [], 'own_messages': [], 'categories': [], 'services': [],
+    })
+
+
+def decode(data, encoding):
+    """JSON body of a response, decompressed"""
+    if encoding == 'gzip':
+        data = gzip.decompress(data)
+    elif encoding == 'br':
+        data = brotli.decompress(data)
+    return json.loads(data)
+
+
+def created(pool, key):
+    """Response hook adding the id at `key` (a path into the JSON body) to a pool"""
+    def hook(pools, body):
+        value = body
+        for part in key:
+            value = value[part]
+        pools.add(pool, value)
+    return hook
+
+
+def routes():
+    """(name, role, request factory, budget, options) for every route.
+
+    A request factory takes the Pools and returns (method, path, JSON body).
+    The budget is (statements per request, p95 ms); options may hold
+    'requests' (a lower count for slow routes) and 'after' (a hook given
+    the pools and the JSON response).
+    """
+    return [
+        ('GET /', None, lambda p: ('GET', '/', None), (0, 10), {}),
+        ('POST /api/auth/login', None,
+         lambda p: ('POST', '/api/auth/login', {'username': p.resident_name, 'password': PASSWORD}), (1, 1000),
+         {'requests': 20}),
+        ('POST /api/auth/register', None, lambda p: ('POST', '/api/auth/register', {
+            'username': f'new{random.getrandbits(48):x}', 'password': PASSWORD, 'full_name': 'New Resident',
+            'building_number': '7', 'apartment_number': '12'}), (5, 1000), {'requests': 20}),
+        ('GET /api/auth/profile', 'resident', lambda p: ('GET', '/api/auth/profile', None), (1, 20), {}),
+        ('GET /api/posts', 'resident', lambda p: ('GET', '/api/posts', None), (1, 20), {}),
+        ('GET /api/posts?before=', 'resident', lambda p: ('GET', f'/api/posts?before={p.feed_cursor}', None),
+         (1, 20), {}),
+        ('POST /api/posts', 'resident', lambda p: ('POST', '/api/posts', {'content': 'Benchmark post'}), (3, 30),
+         {'after': created('own_posts', ('post', 'id'))}),
+        ('DELETE /api/posts/<id>', 'resident', lambda p: ('DELETE', f'/api/posts/{p.take("own_posts")}', None),
+         (4, 30), {}),
+        ('GET /api/messages', 'resident', lambda p: ('GET', '/api/messages', None), (2, 30), {}),
+        ('GET /api/messages/conversations', 'admin', lambda p: ('GET', '/api/messages/conversations', None),
+         (4, 50), {}),
+        ('GET /api/messages/conversations/<id>', 'resident',
+         lambda p: ('GET', f'/api/messages/conversations/{p.admin}', None), (2, 30), {}),
+        ('GET /api/messages/unread', 'admin', lambda p: ('GET', '/api/messages/unread', None), (1, 20), {}),
+        ('POST /api/messages/admin', 'resident',
+         lambda p: ('POST', '/api/messages/admin', {'content': 'Benchmark message'}), (4, 30),
+         {'after': created('own_messages', ('message_id',))}),
+        ('POST /api/messages/reply/<id>', 'admin',
+         lambda p: ('POST', f'/api/messages/reply/{p.resident}', {'content': 'Benchmark reply'}), (4, 30), {}),
+        ('POST /api/messages/<id>/read', 'admin',
+         lambda p: ('POST', f'/api/messages/{p.peek("own_messages")}/read', None), (1, 20), {}),
+        ('POST /api/messages/conversations/<id>/read', 'resident',
+         lambda p: ('POST', f'/api/messages/conversations/{p.admin}/read', {}), (4, 30), {}),
+        ('DELETE /api/messages/<sender>/<recipient>/<id>', 'resident',
+         lambda p: ('DELETE', f'/api/messages/{p.resident}/{p.admin}/{p.take("own_messages")}', None), (5, 30), {}),
+        ('GET /api/advertisements', 'resident', lambda p: ('GET', '/api/advertisements', None), (1, 20), {}),
+        ('POST /api/advertisements', 'resident', lambda p: ('POST', '/api/advertisements', {
+            'title': 'Benchmark ad', 'content': 'For sale', 'price': 100, 'phone_number': '0100000000'}),
+         (1, 30), {'after': created('own_ads', ('advertisement', 'id'))}),
+        ('PUT /api/advertisements/<id>', 'resident',
+         lambda p: ('PUT', f'/api/advertisements/{p.peek("own_ads")}', {'price': 120}), (4, 30), {}),
+        ('DELETE /api/advertisements/<id>', 'resident',
+         lambda p: ('DELETE', f'/api/advertisements/{p.take("own_ads")}', None), (3, 30), {}),
+        # The catalog's one statement is its cache_version lookup, shared with the other workers
+        ('GET /api/public-services', 'resident', lambda p: ('GET', '/api/public-services', None), (1, 10), {}),
+        ('GET /api/public-services/categories', 'resident',
+         lambda p: ('GET', '/api/public-services/categories', None), (1, 20), {}),
+        ('POST /api/public-services/categories', 'admin', lambda p: ('POST', '/api/public-services/categories', {
+            'name': 'Benchmark category', 'description': 'Created by the benchmark'}), (2, 30),
+         {'after': created('categories', ('category', 'id'))}),
+        ('PUT /api/public-services/categories/<id>', 'admin',
+         lambda p: ('PUT', f'/api/public-services/categories/{p.peek("categories")}', {'description': 'Edited'}),
+         (2, 30), {}),
+        ('POST /api/public-services', 'admin', lambda p: ('POST', '/api/public-services', {
+            'name': 'Benchmark service', 'category': 1, 'phone_number': '0100000000', 'status': 'Active'}),
+         (3, 30), {'after': created('services', ('service', 'id'))}),
+        ('PUT /api/public-services/<id>', 'admin',
+         lambda p: ('PUT', f'/api/public-services/{p.peek("services")}', {'status': 'Unavailable'}), (2, 30), {}),
+        ('DELETE /api/public-services/<id>', 'admin',
+         lambda p: ('DELETE', f'/api/public-services/{p.take("services")}', None), (2, 30), {}),
+        ('DELETE /api/public-services/categories/<id>', 'admin',
+         lambda p: ('DELETE', f'/api/public-services/categories/{p.take("categories")}', None), (2, 30), {}),
+        ('GET /api/search', 'resident', lambda p: ('GET', '/api/search?q=elevator%20main', None), (1, 50), {}),
+        ('GET /api/changes', 'resident', lambda p: ('GET', '/api/changes?since=1', None), (2, 30), {}),
+        ('GET /api/admin/pending-users', 'admin', lambda p: ('GET', '/api/admin/pending-users', None), (1, 30), {}),
+        ('GET /api/admin/users', 'admin', lambda p: ('GET', '/api/admin/users?building_number=7', None), (2, 30),
+         {}),
+        ('GET /api/admin/metrics', 'admin', lambda p: ('GET', '/api/admin/metrics', None), (0, 10), {}),
+        ('POST /api/admin/users/<id>/approve', 'admin',
+         lambda p: ('POST', f'/api/admin/users/{p.take("pending")}/approve', None), (5, 30), {}),
+        ('POST /api/admin/users/<id>/reject', 'admin',
+         lambda p: ('POST', f'/api/admin/users/{p.take("pending")}/reject', None), (8, 50), {}),
+        ('POST /api/admin/users/<id>/ban', 'admin',
+         lambda p: ('POST', f'/api/admin/users/{p.move("residents", "banned")}/ban', None), (5, 30), {}),
+        ('POST /api/admin/users/<id>/unban', 'admin',
+         lambda p: ('POST', f'/api/admin/users/{p.take("banned")}/unban', None), (5, 30), {}),
+        ('POST /api/admin/users/bulk', 'admin', lambda p: ('POST', '/api/admin/users/bulk', {
+            'action': 'unban', 'building_number': '7'}), (1, 30), {}),
+        ('POST /api/admin/posts/<id>/delete', 'admin',
+         lambda p: ('POST', f'/api/admin/posts/{p.take("live_posts")}/delete', None), (5, 30), {}),
+        ('POST /api/admin/advertisements/<id>/delete', 'admin',
+         lambda p: ('POST', f'/api/admin/advertisements/{p.take("live_ads")}/delete', None), (2, 30), {}),
+        ('GET /api/admin/export/users', 'admin', lambda p: ('GET', '/api/admin/export/users', None), (1, None),
+         {'requests': 3}),
+        ('GET /api/admin/export/posts', 'admin', lambda p: ('GET', '/api/admin/export/posts', None), (1, None),
+         {'requests': 3}),
+        ('GET /api/admin/export/advertisements', 'admin',
+         lambda p: ('GET', '/api/admin/export/advertisements', None), (1, None), {'requests': 3}),
+    ]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(latencies, sizes, statements, errors, elapsed, budget):
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0,
+        'bytes_mean': statistics.fmean(sizes),
+        'statements_mean': statistics.fmean(statements) if statements else None,
+        'statements_max': max(statements) if statements else None,
+        'budget': {'statements': budget[0], 'p95_ms': budget[1]},
+    }
+    over = []
+    # The typical request: the odd one that also compacts the change log is not held to the budget
+    if budget[0] is not None and statements and statistics.median_low(statements) > budget[0]:
+        over.append('statements')
+    if budget[1] is not None and result['p95_ms'] > budget[1]:
+        over.append('p95_ms')
+    result['over_budget'] = over
+    return result
+
+
+class TestClientDriver:
+    """Requests through Flask's test client, one at a time, counting statements"""
+
+    name = 'client'
+
+    def __init__(self, headers):
+        self.client = app.test_client()
+        self.headers = headers
+        self.statements = 0
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+    def run(self, role, requests, count, after):
+        latencies, sizes, statements, errors = [], [], [], 0
+        started = time.perf_counter()
+        for _ in range(count):
+            method, path, body = requests()
+            self.statements = 0
+            sent = time.perf_counter()
+            response = self.client.open(path, method=method, json=body, headers=self.headers[role])
+            data = response.get_data()
+            latencies.append(time.perf_counter() - sent)
+            statements.append(self.statements)
+            sizes.append(len(data))
+            if response.status_code >= 400:
+                errors += 1
+            elif after:
+                after(decode(data, response.content_encoding))
+        return latencies, sizes, statements, errors, time.perf_counter() - started
+
+
+class ServerDriver:
+    """Requests over HTTP to serve.py from `concurrency` green threads with keep-alive connections"""
+
+    name = 'server'
+
+    def __init__(self, headers, concurrency):
+        self.headers = headers
+        self.concurrency = concurrency
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        env = dict(os.environ, PORT=str(self.port), WEB_CONCURRENCY='1')
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py')], cwd=ROOT, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                eventlet.sleep(0.1)
+        raise RuntimeError('serve.py did not start')
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def run(self, role, requests, count, after):
+        latencies, sizes, errors = [], [], [0]
+        remaining = [count]
+
+        def worker():
+            conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                method, path, body = requests()
+                headers = dict(self.headers[role])
+                payload = None
+                if body is not None:
+                    payload = json.dumps(body).encode('utf-8')
+                    headers['Content-Type'] = 'application/json'
+                sent = time.perf_counter()
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                latencies.append(time.perf_counter() - sent)
+                sizes.append(len(data))
+                if response.status >= 400:
+                    errors[0] += 1
+                elif after:
+                    after(decode(data, response.getheader('Content-Encoding')))
+            conn.close()
+
+        started = time.perf_counter()
+        pool = eventlet.GreenPool(self.concurrency)
+        for _ in range(min(self.concurrency, count)):
+            pool.spawn(worker)
+        pool.waitall()
+        return latencies, sizes, [], errors[0], time.perf_counter() - started
+
+
+def measure(driver, pools, requests_per_route):
+    results = {}
+    for name, role, factory, budget, options in routes():
+        count = options.get('requests', requests_per_route)
+        hook = options.get('after')
+        after = (lambda body, hook=hook: hook(pools, body)) if hook else None
+        make = lambda factory=factory: factory(pools)
+        # Warm-up requests are not measured
+        driver.run(role, make, min(WARMUP, count), after)
+        latencies, sizes, statements, errors, elapsed = driver.run(role, make, count, after)
+        # Latency under concurrency is mostly queueing: budgets apply to the sequential run
+        if driver.name != 'client':
+            budget = (None, None)
+        results[name] = summarize(latencies, sizes, statements, errors, elapsed, budget)
+        print_row(name, results[name])
+    return results
+
+
+def print_row(name, result):
+    statements = '' if result['statements_mean'] is None else f'{result["statements_mean"]:.1f}'
+    flags = ' '.join(result['over_budget'] + ([f'{result["errors"]} errors'] if result['errors'] else []))
+    print(f'{name:<48}{result["p50_ms"]:>8.1f}{result["p95_ms"]:>8.1f}{result["p99_ms"]:>8.1f}'
+          f'{result["throughput_rps"]:>9.0f}{result["bytes_mean"]:>11.0f}{statements:>7}  {flags}')
+
+
+def regressions(results, baseline, tolerance):
+    """(mode, route, metric, before, after) for each metric that grew by more than `tolerance`"""
+    found = []
+    for mode, routes_results in results.items():
+        for name, result in routes_results.items():
+            before = baseline.get('results', {}).get(mode, {}).get(name)
+            if not before:
+                continue
+            for metric, noise in REGRESSION_NOISE.items():
+                old, new = before.get(metric), result.get(metric)
+                if old is not None and new is not None and new > old * (1 + tolerance) and new - old > noise:
+                    found.append((mode, name, metric, old, new))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='1k', help='posts to seed: 1k, 100k, 1m, ...')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--mode', choices=['client', 'server', 'both'], default='both')
+    parser.add_argument('--concurrency', type=int, default=16, help='green threads in server mode')
+    parser.add_argument('--seed', type=int, default=42, help='random seed of the dataset')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='growth over the baseline to report')
+    args = parser.parse_args()
+
+    modes = ['client', 'server'] if args.mode == 'both' else [args.mode]
+    scale = parse_scale(args.scale)
+    reserve = (args.requests + WARMUP) * len(modes)
+
+    with app.app_context():
+        migrations.upgrade()
+    started = time.perf_counter()
+    with app.app_context():
+        counts, pools = seed(scale, reserve, args.seed)
+    print(f'Seeded {", ".join(f"{n} {t}" for t, n in counts.items())} in {time.perf_counter() - started:.1f} s')
+
+    with app.app_context():
+        tokens = {role: create_access_token(identity=str(user_id), additional_claims={'is_admin': role == 'admin'})
+                  for role, user_id in (('admin', pools.admin), ('resident', pools.resident))}
+    encoding = {'Accept-Encoding': 'br, gzip'}
+    headers = {role: dict(encoding, Authorization=f'Bearer {token}') for role, token in tokens.items()}
+    headers[None] = encoding
+
+    results = {}
+    for mode in modes:
+        print(f'\n{mode}: {args.requests} requests per route'
+              + (f', {args.concurrency} concurrent' if mode == 'server' else ', sequential'))
+        print(f'{"route":<48}{"p50":>8}{"p95":>8}{"p99":>8}{"req/s":>9}{"bytes":>11}{"stmts":>7}')
+        driver = TestClientDriver(headers) if mode == 'client' else ServerDriver(headers, args.concurrency)
+        try:
+            results[mode] = measure(driver, pools, args.requests)
+        finally:
+            if mode == 'server':
+                driver.close()
+
+    report = {
+        'meta': {
+            'scale': scale,
+            'rows': counts,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'revision': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                       text=True).stdout.strip() or None,
+            'python': platform.python_version(),
+            'started_at': datetime.utcnow().isoformat(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    failed = False
+    over = [(mode, name, result['over_budget']) for mode, routes_results in results.items()
+            for name, result in routes_results.items() if result['over_budget'] or result['errors']]
+    for mode, name, metrics in over:
+        print(f'OVER BUDGET  {mode:<7}{name} {" ".join(metrics) or "errors"}')
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for mode, name, metric, old, new in regressions(results, baseline, args.tolerance):
+            print(f'REGRESSION   {mode:<7}{name} {metric} {old:.1f} -> {new:.1f}')
+            failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
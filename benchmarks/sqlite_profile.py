@@ -0,0 +1,126 @@
+"""Read throughput during concurrent writes, default vs production SQLite profile.
+
+    python benchmarks/sqlite_profile.py [--readers 4] [--writers 2] [--seconds 5] [--rows 20000]
+
+Reader threads page the post feed while writer threads insert posts one
+commit at a time, first with SQLAlchemy's defaults and then with the
+production profile from db_engine.py (WAL, pragmas, read-only pool and a
+single writer connection).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from db_engine import reader_url, set_pragmas
+from models import db
+
+PRAGMAS = {
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_CACHE_SIZE': -64000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+}
+
+FEED_QUERY = text(
+    'SELECT post.id, post.content, post.created_at, user.username FROM post '
+    'JOIN user ON user.id = post.user_id '
+    'ORDER BY post.created_at DESC, post.id DESC LIMIT 20'
+)
+INSERT_POST = text(
+    'INSERT INTO post (content, user_id, created_at, is_deleted) VALUES (:content, 1, :created_at, 0)'
+)
+
+
+def seed(path, rows):
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    start = datetime.utcnow() - timedelta(days=365)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO user (id, username, password, full_name, building_number, apartment_number, "
+            "is_admin, is_approved, is_banned) VALUES (1, 'bench', 'x', 'Bench', '1', '1', 0, 1, 0)"
+        ))
+        conn.execute(INSERT_POST, [
+            {'content': f'post {i}', 'created_at': start + timedelta(minutes=i)} for i in range(rows)
+        ])
+    engine.dispose()
+
+
+def make_engines(path, profile, readers):
+    url = f'sqlite:///{path}'
+    if profile == 'default':
+        engine = create_engine(url)
+        return engine, engine
+    writer = create_engine(url, pool_size=1, max_overflow=0, pool_timeout=30)
+    set_pragmas(writer, PRAGMAS)
+    reader = create_engine(reader_url(url), pool_size=readers, max_overflow=0)
+    set_pragmas(reader, PRAGMAS, readonly=True)
+    return writer, reader
+
+
+def run(profile, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    seed(path, args.rows)
+    writer, reader = make_engines(path, profile, args.readers)
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def read_loop():
+        while time.monotonic() < deadline:
+            try:
+                with reader.connect() as conn:
+                    conn.execute(FEED_QUERY).fetchall()
+                count('reads')
+            except OperationalError:
+                count('errors')
+
+    def write_loop():
+        while time.monotonic() < deadline:
+            try:
+                with writer.begin() as conn:
+                    conn.execute(INSERT_POST, {'content': 'new', 'created_at': datetime.utcnow()})
+                count('writes')
+            except OperationalError:
+                count('errors')
+
+    threads = [threading.Thread(target=read_loop) for _ in range(args.readers)]
+    threads += [threading.Thread(target=write_loop) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.dispose()
+    reader.dispose()
+    return {key: value / args.seconds for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f'{"profile":<12}{"reads/s":>12}{"writes/s":>12}{"errors/s":>12}')
+    for profile in ('default', 'production'):
+        result = run(profile, args)
+        print(f'{profile:<12}{result["reads"]:>12.0f}{result["writes"]:>12.0f}{result["errors"]:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
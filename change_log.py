@@ -0,0 +1,152 @@
+"""Durable log of the changes pushed to clients over Socket.IO.
+
+record_change() writes a change to the change_log table in the caller's
+transaction, and emits it to its rooms once that transaction commits, with
+the change's sequence number added to the payload as "seq". A rolled-back
+write is neither logged nor emitted. Emits go through the EmitBatcher (see
+emit_batcher.py), which may merge them into `<event>_many` frames.
+
+Sequence numbers grow with commit order (SQLite has a single writer), so a
+client that remembers the last seq it applied can catch up on what it missed
+with GET /api/changes?since=<seq>, or by passing {"since": <seq>} in the
+Socket.IO auth payload when it reconnects. Either way it only sees changes
+sent to the rooms it would have been in. Deletions are logged as tombstones
+(deleted=True) so a client can drop the entity. Since a reconnecting socket
+may receive a change both live and replayed, clients should skip events whose
+seq is not above the last one they applied.
+
+Entries older than CHANGE_LOG_RETENTION seconds are compacted away, always
+keeping the newest. A client asking for changes from before the oldest kept
+entry is told to reload instead.
+"""
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, exists, func, insert, select
+from models import db, ChangeLog, ChangeLogRoom
+from socket_instance import emit_batcher, socketio, user_room, ADMIN_ROOM
+
+CHANGE_LOG_RETENTION = float(os.environ.get('CHANGE_LOG_RETENTION', 7 * 24 * 3600))
+# Compact after this many changes recorded by a process
+CHANGE_LOG_COMPACT_EVERY = int(os.environ.get('CHANGE_LOG_COMPACT_EVERY', 1000))
+# Most changes replayed to a reconnecting socket; beyond that it is told to reload
+CHANGE_LOG_REPLAY_LIMIT = int(os.environ.get('CHANGE_LOG_REPLAY_LIMIT', 500))
+
+# Room name logged for changes broadcast to every client
+EVERYONE = '*'
+
+_PENDING = 'pending_changes'
+_recorded = 0
+
+
+def record_change(event_name, data, entity, to=EVERYONE, entity_id=None, deleted=False):
+    """Log a change in the current transaction and emit it to `to` (a room or list of rooms) after commit"""
+    global _recorded
+    rooms = [to] if isinstance(to, str) else list(to)
+    change = ChangeLog(event=event_name, entity=entity, entity_id=entity_id, deleted=deleted, payload=data)
+    db.session.add(change)
+    db.session.flush()
+    db.session.execute(insert(ChangeLogRoom), [{'seq': change.seq, 'room': room} for room in rooms])
+    merge_key = None if entity_id is None else (entity, entity_id)
+    db.session.info.setdefault(_PENDING, []).append((change.seq, event_name, data, rooms, merge_key))
+
+    _recorded += 1
+    if _recorded % CHANGE_LOG_COMPACT_EVERY == 0:
+        compact()
+    return change.seq
+
+
+@event.listens_for(db.session, 'after_commit')
+def _emit_committed(session):
+    for seq, event_name, data, rooms, merge_key in session.info.pop(_PENDING, ()):
+        emit_batcher.emit(event_name, dict(data, seq=seq), to=None if rooms == [EVERYONE] else rooms,
+                          key=merge_key)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
+
+
+def compact(retention=None):
+    """Delete entries older than `retention` seconds, keeping the newest; returns the number deleted"""
+    cutoff = datetime.utcnow() - timedelta(seconds=CHANGE_LOG_RETENTION if retention is None else retention)
+    # seq follows created_at, so the first recent entry is found walking the primary key
+    keep_from = db.session.execute(
+        select(ChangeLog.seq).where(ChangeLog.created_at >= cutoff).order_by(ChangeLog.seq).limit(1)
+    ).scalar()
+    if keep_from is None:
+        keep_from = db.session.execute(select(func.max(ChangeLog.seq))).scalar()
+    if keep_from is None:
+        return 0
+    db.session.execute(delete(ChangeLogRoom).where(ChangeLogRoom.seq < keep_from))
+    return db.session.execute(delete(ChangeLog).where(ChangeLog.seq < keep_from)).rowcount
+
+
+def latest_seq():
+    return db.session.execute(select(func.max(ChangeLog.seq))).scalar() or 0
+
+
+def visible_rooms(user):
+    """The rooms whose changes a user (a UserState) may read"""
+    rooms = [user_room(user.id)]
+    if user.is_approved or user.is_admin:
+        rooms.append(EVERYONE)
+    if user.is_admin:
+        rooms.append(ADMIN_ROOM)
+    return rooms
+
+
+def is_gone(since, oldest, latest):
+    """Whether changes after `since` can no longer be told: compacted away, or from another database"""
+    return since > (latest or 0) or (oldest is not None and since < oldest - 1)
+
+
+def changes_query(since, rooms):
+    """Oldest-first query of the changes after `since` sent to any of `rooms`"""
+    # Walks the log from `since` by primary key, checking each entry's rooms by primary key
+    sent_to_rooms = exists().where(ChangeLogRoom.seq == ChangeLog.seq, ChangeLogRoom.room.in_(rooms))
+    return ChangeLog.query.filter(ChangeLog.seq > since, sent_to_rooms).order_by(ChangeLog.seq)
+
+
+def changes_since(since, rooms, limit):
+    """Up to `limit` changes after `since` sent to any of `rooms`, oldest first.
+
+    Returns (changes, next_since, has_more, gone); next_since is the seq to
+    ask from next time. When `gone` is true the client must reload its lists
+    and continue from next_since.
+    """
+    oldest, latest = db.session.execute(select(func.min(ChangeLog.seq), func.max(ChangeLog.seq))).one()
+    if is_gone(since, oldest, latest):
+        return [], latest or 0, False, True
+
+    changes = changes_query(since, rooms).limit(limit + 1).all()
+    has_more = len(changes) > limit
+    if has_more:
+        changes = changes[:limit]
+        return changes, changes[-1].seq, True, False
+    # Nothing visible follows the last change returned, up to the newest entry
+    return changes, latest or 0, False, False
+
+
+def serialize_change(change):
+    return {
+        "seq": change.seq,
+        "event": change.event,
+        "entity": change.entity,
+        "entity_id": change.entity_id,
+        "deleted": change.deleted,
+        "data": change.payload,
+        "created_at": change.created_at.isoformat()
+    }
+
+
+def replay(since, rooms, sid):
+    """Emit the changes after `since` to one socket, or `resync_required` if there are too many or they are gone"""
+    changes, next_since, has_more, gone = changes_since(since, rooms, CHANGE_LOG_REPLAY_LIMIT)
+    if has_more:
+        next_since = latest_seq()
+    if gone or has_more:
+        socketio.emit('resync_required', {'seq': next_since}, to=sid)
+        return
+    for change in changes:
+        socketio.emit(change.event, dict(change.payload, seq=change.seq), to=sid)
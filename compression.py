@@ -0,0 +1,85 @@
+"""gzip and brotli compression of JSON responses, negotiated from Accept-Encoding.
+
+Responses smaller than COMPRESS_MIN_SIZE bytes are sent as they are: below
+about a kilobyte the framing overhead eats most of the saving. A compressed
+response keeps a strong ETag with the encoding appended ("<etag>-br",
+"<etag>-gzip"): its bytes differ from the identity representation's, so it
+may not share that tag, and caches and range requests need it strong.
+
+brotli is used when the Brotli package is installed and the client accepts
+"br"; otherwise gzip.
+"""
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json'}
+
+
+def accepted_encodings(accept_encoding):
+    """The codings a client accepts, from an Accept-Encoding header, ignoring q=0"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for the given Accept-Encoding header"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def encoded_etag(etag, encoding):
+    """The ETag of the `encoding` (None for identity) representation of a body tagged `etag`"""
+    return etag if encoding is None else f'{etag}-{encoding}'
+
+
+def compress(body, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['COMPRESS_BROTLI_LEVEL'])
+    return gzip.compress(body, compresslevel=config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+
+def init_compression(app):
+    """Compress eligible responses of `app` after each request"""
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough
+                or response.is_streamed
+                or response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        body = response.get_data()
+        if len(body) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        response.set_data(compress(body, encoding, app.config))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding), weak=weak)
+        return response
+    return compress_response
@@ -0,0 +1,93 @@
+"""SQLite engine profiles.
+
+SQLITE_PROFILE selects how the database is opened:
+
+    default     SQLAlchemy defaults: rollback journal, no busy timeout
+    production  WAL journal and tuned pragmas on every connection, a pool of
+                read-only connections for reads and a single writer
+                connection that serializes writes (see RoutingSession)
+
+The pragma values come from the SQLITE_* settings in app.config.
+"""
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+READER_BIND = 'reader'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def reader_url(database_uri):
+    """The read-only (mode=ro) URI of the same SQLite file"""
+    url = make_url(database_uri)
+    return url.set(database=f'file:{url.database}', query={'mode': 'ro', 'uri': 'true'})
+
+
+def configure_sqlite(app):
+    """Fill in engine options and binds for the configured profile; call before db.init_app()"""
+    if app.config['SQLITE_PROFILE'] != 'production':
+        return
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 1,
+        'max_overflow': 0,
+        'pool_timeout': app.config['SQLITE_WRITER_TIMEOUT'],
+    }
+    app.config['SQLALCHEMY_BINDS'] = {
+        READER_BIND: {
+            'url': reader_url(app.config['SQLALCHEMY_DATABASE_URI']),
+            'pool_size': app.config['SQLITE_READ_POOL_SIZE'],
+            'max_overflow': 0,
+        }
+    }
+
+
+def set_pragmas(engine, config, readonly=False):
+    """Apply the profile's pragmas to every new connection of `engine`"""
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not readonly:
+            cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}")
+        cursor.execute(f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+        cursor.close()
+
+
+def install_pragmas(app, db):
+    """Attach the pragma hooks to the app's engines; call after db.init_app()"""
+    if app.config['SQLITE_PROFILE'] != 'production':
+        return
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            set_pragmas(engine, app.config, readonly=bind_key == READER_BIND)
+
+
+class RoutingSession(Session):
+    """Send reads to the read-only pool, so only writes hold the single writer connection.
+
+    Every statement of a GET/HEAD request goes to the readers. Other requests
+    send their SELECTs there too until their transaction first writes: the
+    writer is checked out by the first flush or DML statement and kept until
+    commit or rollback, with later reads following it so they see the
+    transaction's own changes. A request that hashes a password or processes
+    images before it writes therefore doesn't hold the writer meanwhile.
+    Statements outside a request always go to the writer.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None
+                and not self._flushing
+                and not getattr(clause, 'is_dml', False)
+                and has_request_context()
+                and READER_BIND in self._db.engines
+                and (request.method in READ_METHODS
+                     or (getattr(clause, 'is_select', False) and not self._holds_writer()))):
+            return self._db.engines[READER_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _holds_writer(self):
+        transaction = self.get_transaction()
+        return transaction is not None and self._db.engines[None] in transaction._connections
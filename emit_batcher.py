@@ -0,0 +1,78 @@
+"""Coalesce bursts of Socket.IO events into batched frames.
+
+With SOCKETIO_BATCH_WINDOW set (in milliseconds), an event is held for up to
+that long, together with the others sent to the same rooms under the same
+name. Updates to the same entity within the window are merged, keeping the
+latest. The buffer is then sent as one `<event>_many` frame holding the
+list of payloads, oldest first; not `_batch`, which events such as
+user_status_changed_batch already use with payloads of their own. A buffer
+is flushed early once it holds SOCKETIO_BATCH_MAX_SIZE events. A buffer with
+a single event is sent as the plain event, so quiet periods look as they did
+without batching.
+
+Each room then gets at most one frame per event name per window, however
+busy the forum is. The window is 0 (off) by default; clients must handle
+the `_many` events before it is turned on.
+"""
+import threading
+from collections import OrderedDict
+
+
+class EmitBatcher:
+    def __init__(self, socketio, window=0, max_size=100):
+        self.socketio = socketio
+        self.window = window  # seconds
+        self.max_size = max_size
+        self._buffers = {}  # (event, rooms) -> OrderedDict of merge key -> payload
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.window = app.config['SOCKETIO_BATCH_WINDOW'] / 1000
+        self.max_size = app.config['SOCKETIO_BATCH_MAX_SIZE']
+
+    def emit(self, event, data, to=None, key=None):
+        """Send `data` as `event` to the room or rooms `to` (None for everyone).
+
+        Events with the same `key` (an entity identifier, or None for events
+        that never merge) within one window replace each other.
+        """
+        if self.window <= 0:
+            self.socketio.emit(event, data, to=to)
+            return
+
+        rooms = to if to is None or isinstance(to, str) else tuple(to)
+        buffer_key = (event, rooms)
+        with self._lock:
+            buffer = self._buffers.get(buffer_key)
+            first = buffer is None
+            if first:
+                buffer = self._buffers[buffer_key] = OrderedDict()
+            merge_key = object() if key is None else key
+            # The merged update moves to the end, keeping the batch in commit order
+            buffer.pop(merge_key, None)
+            buffer[merge_key] = data
+            full = len(buffer) >= self.max_size
+            if full:
+                del self._buffers[buffer_key]
+
+        if full:
+            self._send(event, rooms, buffer)
+        elif first:
+            self.socketio.start_background_task(self._flush_later, buffer_key, buffer)
+
+    def _flush_later(self, buffer_key, buffer):
+        self.socketio.sleep(self.window)
+        with self._lock:
+            # A buffer flushed early for being full has already been sent
+            if self._buffers.get(buffer_key) is not buffer:
+                return
+            del self._buffers[buffer_key]
+        self._send(*buffer_key, buffer)
+
+    def _send(self, event, rooms, buffer):
+        to = list(rooms) if isinstance(rooms, tuple) else rooms
+        payloads = list(buffer.values())
+        if len(payloads) == 1:
+            self.socketio.emit(event, payloads[0], to=to)
+        else:
+            self.socketio.emit(f'{event}_many', payloads, to=to)
@@ -0,0 +1,102 @@
+"""Metadata-free originals and resized copies of uploaded images.
+
+Each upload is decoded once. If the original carries EXIF (which can hold the
+camera's GPS position) it is rewritten without it, with the EXIF orientation
+applied to the pixels. A WebP copy is then written next to it for every entry
+of VARIANTS, so list views can fetch a thumbnail instead of the original.
+
+Decoding and encoding run in eventlet's native thread pool, at most
+IMAGE_MAX_CONCURRENCY at a time, so large uploads don't stall the hub.
+"""
+import os
+from eventlet import tpool
+from eventlet.semaphore import Semaphore
+from PIL import ExifTags, Image, ImageOps
+
+# Variant name -> longest side in pixels; images are never upscaled
+VARIANTS = {'display': 1024, 'thumbnail': 200}
+VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+IMAGE_MAX_CONCURRENCY = int(os.environ.get('IMAGE_MAX_CONCURRENCY', 2))
+
+# Formats whose originals can be rewritten without EXIF, and how
+REWRITE_OPTIONS = {
+    'JPEG': {'quality': 95},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 90},
+}
+
+_slots = Semaphore(IMAGE_MAX_CONCURRENCY)
+
+
+def variant_path(path, name):
+    stem, _ = os.path.splitext(path)
+    return f'{stem}.{name}.webp'
+
+
+def _rewrite_without_metadata(image, path):
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    options = dict(REWRITE_OPTIONS[image.format])
+    if image.format == 'JPEG' and orientation == 1:
+        # Reuse the original quantization tables so the pixels are not degraded
+        options['quality'] = 'keep'
+    if image.format == 'WEBP' and image.info.get('lossless'):
+        options = {'lossless': True}
+    if 'icc_profile' in image.info:
+        options['icc_profile'] = image.info['icc_profile']
+    clean = image if orientation == 1 else ImageOps.exif_transpose(image)
+    tmp_path = f'{path}.tmp'
+    clean.save(tmp_path, image.format, **options)
+    os.replace(tmp_path, path)
+    return clean
+
+
+def _web_mode(image):
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def _process(path):
+    with Image.open(path) as image:
+        needs_rewrite = ('exif' in image.info and image.format in REWRITE_OPTIONS
+                         and not getattr(image, 'is_animated', False))
+        if needs_rewrite:
+            working = _rewrite_without_metadata(image, path)
+        else:
+            # Without a rewrite only the variants are needed, so JPEGs can be
+            # decoded at a reduced scale
+            image.draft('RGB', (max(VARIANTS.values()),) * 2)
+            working = ImageOps.exif_transpose(image)
+
+        working = _web_mode(working)
+        variants = []
+        # Largest first, each variant downscaled from the previous one
+        for name, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+            working = working.copy()
+            working.thumbnail((size, size), Image.LANCZOS)
+            out_path = variant_path(path, name)
+            working.save(out_path, 'WEBP', quality=VARIANT_QUALITY, method=4)
+            variants.append({
+                'name': name,
+                'path': out_path,
+                'width': working.width,
+                'height': working.height,
+                'byte_size': os.path.getsize(out_path),
+            })
+        return variants
+
+
+def process_image(path):
+    """Strip the original's metadata and write its variants.
+
+    Returns a dict per variant with name, path, width, height and byte_size,
+    or [] when the file is missing or is not an image Pillow can decode.
+    """
+    if not os.path.isfile(path):
+        return []
+    with _slots:
+        try:
+            return tpool.execute(_process, path)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return []
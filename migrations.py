@@ -0,0 +1,427 @@
+"""Versioned schema migrations for databases created before a model change.
+
+    flask db-upgrade        apply pending migrations
+    flask db-status         list migrations and whether they are applied
+    flask db-check-plans    assert the list endpoints' queries use their indexes
+
+Applied versions are recorded in the schema_migrations table. SQLite runs
+DDL outside of transactions, so every step must be safe to re-run.
+"""
+from datetime import datetime
+from sqlalchemy import text
+from models import db, AdvertisementImageVariant, ChangeLog, ChangeLogRoom, PublicService
+
+
+def create_tables():
+    # Tables added since the database was created, with the indexes declared on their models
+    db.metadata.create_all(bind=db.session.connection())
+
+
+def retype_public_service_category():
+    # Older databases declare public_service.category as TEXT. Comparing it with the
+    # INTEGER category id applies numeric affinity, so the join cannot use an index.
+    # The table is rebuilt through public_service_old, which an interrupted run leaves behind.
+    connection = db.session.connection()
+    tables = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'public_service_old' not in tables:
+        columns = {row[1]: row[2] for row in connection.exec_driver_sql('PRAGMA table_info(public_service)')}
+        if columns.get('category', '').upper() == 'INTEGER':
+            return
+        connection.exec_driver_sql('DROP INDEX IF EXISTS ix_public_service_category_id')
+        connection.exec_driver_sql('ALTER TABLE public_service RENAME TO public_service_old')
+    PublicService.__table__.create(bind=connection, checkfirst=True)
+    connection.exec_driver_sql(
+        'INSERT OR IGNORE INTO public_service (id, name, category, phone_number, status, created_at, updated_at) '
+        'SELECT id, name, CAST(category AS INTEGER), phone_number, status, created_at, updated_at '
+        'FROM public_service_old'
+    )
+    connection.exec_driver_sql('DROP TABLE public_service_old')
+
+
+def backfill_ad_images():
+    from routes.advertisements import backfill_ad_images as backfill
+    backfill()
+
+
+def create_image_variants():
+    AdvertisementImageVariant.__table__.create(bind=db.session.connection(), checkfirst=True)
+    from routes.advertisements import backfill_image_variants
+    backfill_image_variants()
+
+
+def create_change_log():
+    connection = db.session.connection()
+    ChangeLog.__table__.create(bind=connection, checkfirst=True)
+    ChangeLogRoom.__table__.create(bind=connection, checkfirst=True)
+
+
+# Search indexes hold only what search may return: live rows by authors who
+# aren't banned. Triggers keep them in step with every write, including bans.
+VISIBLE_ROW = "coalesce({row}.is_deleted, 0) = 0 AND NOT EXISTS (SELECT 1 FROM user WHERE user.id = {row}.user_id AND user.is_banned = 1)"
+FTS_TOKENIZER = "tokenize = 'unicode61 remove_diacritics 2'"
+
+SEARCH_INDEX = [
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(content, {FTS_TOKENIZER})',
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS advertisement_fts USING fts5(title, content, {FTS_TOKENIZER})',
+    f"""CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post
+        WHEN {VISIBLE_ROW.format(row='new')}
+        BEGIN
+            INSERT INTO post_fts (rowid, content) VALUES (new.id, new.content);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF content, is_deleted, user_id ON post
+        BEGIN
+            DELETE FROM post_fts WHERE rowid = old.id;
+            INSERT INTO post_fts (rowid, content) SELECT new.id, new.content WHERE {VISIBLE_ROW.format(row='new')};
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post
+        BEGIN
+            DELETE FROM post_fts WHERE rowid = old.id;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS advertisement_fts_insert AFTER INSERT ON advertisement
+        WHEN {VISIBLE_ROW.format(row='new')}
+        BEGIN
+            INSERT INTO advertisement_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS advertisement_fts_update
+        AFTER UPDATE OF title, content, is_deleted, user_id ON advertisement
+        BEGIN
+            DELETE FROM advertisement_fts WHERE rowid = old.id;
+            INSERT INTO advertisement_fts (rowid, title, content)
+                SELECT new.id, new.title, new.content WHERE {VISIBLE_ROW.format(row='new')};
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS advertisement_fts_delete AFTER DELETE ON advertisement
+        BEGIN
+            DELETE FROM advertisement_fts WHERE rowid = old.id;
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_ban AFTER UPDATE OF is_banned ON user
+        WHEN old.is_banned IS NOT new.is_banned
+        BEGIN
+            DELETE FROM post_fts WHERE rowid IN (SELECT id FROM post WHERE user_id = new.id);
+            DELETE FROM advertisement_fts WHERE rowid IN (SELECT id FROM advertisement WHERE user_id = new.id);
+            INSERT INTO post_fts (rowid, content)
+                SELECT id, content FROM post
+                WHERE user_id = new.id AND coalesce(is_deleted, 0) = 0 AND coalesce(new.is_banned, 0) = 0;
+            INSERT INTO advertisement_fts (rowid, title, content)
+                SELECT id, title, content FROM advertisement
+                WHERE user_id = new.id AND coalesce(is_deleted, 0) = 0 AND coalesce(new.is_banned, 0) = 0;
+        END""",
+    'DELETE FROM post_fts',
+    f"INSERT INTO post_fts (rowid, content) SELECT id, content FROM post WHERE {VISIBLE_ROW.format(row='post')}",
+    'DELETE FROM advertisement_fts',
+    'INSERT INTO advertisement_fts (rowid, title, content) SELECT id, title, content FROM advertisement '
+    f"WHERE {VISIBLE_ROW.format(row='advertisement')}",
+]
+
+
+# unread_count is adjusted in the same transaction as every write to message,
+# whichever code path (or bulk UPDATE) makes it
+UNREAD_MESSAGE = "coalesce({row}.is_read, 0) = 0 AND coalesce({row}.is_deleted, 0) = 0"
+COUNT_UNREAD = f"""INSERT INTO unread_count (user_id, sender_id, count)
+                SELECT new.recipient_id, new.sender_id, 1 WHERE {UNREAD_MESSAGE.format(row='new')}
+                ON CONFLICT (user_id, sender_id) DO UPDATE SET count = count + 1;"""
+UNCOUNT_UNREAD = f"""UPDATE unread_count SET count = count - 1
+                WHERE user_id = old.recipient_id AND sender_id = old.sender_id AND {UNREAD_MESSAGE.format(row='old')};"""
+
+UNREAD_COUNTERS = [
+    'CREATE TABLE IF NOT EXISTS unread_count ('
+    'user_id INTEGER NOT NULL REFERENCES user (id), sender_id INTEGER NOT NULL REFERENCES user (id), '
+    'count INTEGER NOT NULL, PRIMARY KEY (user_id, sender_id))',
+    'CREATE INDEX IF NOT EXISTS ix_message_unread ON message (recipient_id, sender_id, id) WHERE is_read = 0',
+    f"""CREATE TRIGGER IF NOT EXISTS message_unread_insert AFTER INSERT ON message
+        BEGIN
+            {COUNT_UNREAD}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS message_unread_update
+        AFTER UPDATE OF is_read, is_deleted, sender_id, recipient_id ON message
+        BEGIN
+            {UNCOUNT_UNREAD}
+            {COUNT_UNREAD}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS message_unread_delete AFTER DELETE ON message
+        BEGIN
+            {UNCOUNT_UNREAD}
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS user_unread_delete AFTER DELETE ON user
+        BEGIN
+            DELETE FROM unread_count WHERE user_id = old.id OR sender_id = old.id;
+        END""",
+    'DELETE FROM unread_count',
+    'INSERT INTO unread_count (user_id, sender_id, count) '
+    f"SELECT recipient_id, sender_id, count(*) FROM message WHERE {UNREAD_MESSAGE.format(row='message')} "
+    'GROUP BY recipient_id, sender_id',
+]
+
+
+# user_status_count has at most eight rows, one per combination of flags, so the
+# admin directory can total any status filter without counting users
+USER_FLAGS = "coalesce({row}.is_admin, 0), coalesce({row}.is_approved, 0), coalesce({row}.is_banned, 0)"
+COUNT_USER = f"""INSERT INTO user_status_count (is_admin, is_approved, is_banned, count)
+                SELECT {USER_FLAGS.format(row='new')}, 1 WHERE true
+                ON CONFLICT (is_admin, is_approved, is_banned) DO UPDATE SET count = count + 1;"""
+UNCOUNT_USER = f"""UPDATE user_status_count SET count = count - 1
+                WHERE (is_admin, is_approved, is_banned) = ({USER_FLAGS.format(row='old')});"""
+
+USER_DIRECTORY = [
+    'CREATE INDEX IF NOT EXISTS ix_user_building_number_apartment_number ON user (building_number, apartment_number)',
+    'CREATE INDEX IF NOT EXISTS ix_user_username_lower ON user (lower(username))',
+    'CREATE INDEX IF NOT EXISTS ix_user_full_name_lower ON user (lower(full_name))',
+    'CREATE TABLE IF NOT EXISTS user_status_count ('
+    'is_admin BOOLEAN NOT NULL, is_approved BOOLEAN NOT NULL, is_banned BOOLEAN NOT NULL, '
+    'count INTEGER NOT NULL, PRIMARY KEY (is_admin, is_approved, is_banned))',
+    f"""CREATE TRIGGER IF NOT EXISTS user_status_insert AFTER INSERT ON user
+        BEGIN
+            {COUNT_USER}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_status_update AFTER UPDATE OF is_admin, is_approved, is_banned ON user
+        BEGIN
+            {UNCOUNT_USER}
+            {COUNT_USER}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_status_delete AFTER DELETE ON user
+        BEGIN
+            {UNCOUNT_USER}
+        END""",
+    'DELETE FROM user_status_count',
+    'INSERT INTO user_status_count (is_admin, is_approved, is_banned, count) '
+    f"SELECT {USER_FLAGS.format(row='user')}, count(*) FROM user GROUP BY 1, 2, 3",
+]
+
+
+# Writes that change what a cached resource renders, as (table, trigger event);
+# each bumps the resource's row in cache_version
+CACHE_VERSION_SOURCES = {
+    'posts': [
+        ('post', 'INSERT'), ('post', 'UPDATE'), ('post', 'DELETE'),
+        ('user', 'UPDATE OF username, is_banned'), ('user', 'DELETE'),
+    ],
+    'advertisements': [
+        ('advertisement', 'INSERT'), ('advertisement', 'UPDATE'), ('advertisement', 'DELETE'),
+        ('advertisement_image', 'INSERT'), ('advertisement_image', 'UPDATE'), ('advertisement_image', 'DELETE'),
+        ('advertisement_image_variant', 'INSERT'), ('advertisement_image_variant', 'DELETE'),
+        ('user', 'UPDATE OF username, is_banned'), ('user', 'DELETE'),
+    ],
+}
+
+def cache_versions(sources):
+    """Statements creating the cache_version rows of `sources` and the triggers bumping them"""
+    return [
+        'CREATE TABLE IF NOT EXISTS cache_version (name VARCHAR(50) NOT NULL PRIMARY KEY, version INTEGER NOT NULL)',
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_{event.split()[0].lower()}_bumps_{name} AFTER {event} ON {table}
+            BEGIN
+                UPDATE cache_version SET version = version + 1 WHERE name = '{name}';
+            END"""
+        for name, versioned in sources.items() for table, event in versioned
+    ] + [
+        # Rows last: caching only starts once every trigger is in place
+        f"INSERT OR IGNORE INTO cache_version (name, version) VALUES ('{name}', 0)" for name in sources
+    ]
+
+
+CATALOG_VERSION_SOURCES = {
+    'public_services': [
+        ('public_service', 'INSERT'), ('public_service', 'UPDATE'), ('public_service', 'DELETE'),
+        ('public_service_category', 'INSERT'), ('public_service_category', 'UPDATE'),
+        ('public_service_category', 'DELETE'),
+    ],
+}
+
+# Bumped whenever any user's cached auth state (user_cache.UserState) changes
+USER_STATE_VERSION_SOURCES = {
+    'users': [('user', 'UPDATE OF username, is_admin, is_approved, is_banned'), ('user', 'DELETE')],
+}
+
+# Users whose cached auth state (user_cache.UserState) changed, newest
+# USER_STATE_CHANGES_KEPT of them; replaces the single 'users' version, which
+# dropped every worker's whole cache on any change
+USER_STATE_CHANGES_KEPT = 10000
+LOG_USER_STATE_CHANGE = f"""INSERT INTO user_state_change (user_id) VALUES (old.id);
+                DELETE FROM user_state_change WHERE seq <= last_insert_rowid() - {USER_STATE_CHANGES_KEPT};"""
+
+USER_STATE_CHANGES = [
+    'DROP TRIGGER IF EXISTS user_update_bumps_users',
+    'DROP TRIGGER IF EXISTS user_delete_bumps_users',
+    "DELETE FROM cache_version WHERE name = 'users'",
+    'CREATE TABLE IF NOT EXISTS user_state_change (seq INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL)',
+    f"""CREATE TRIGGER IF NOT EXISTS user_state_update
+        AFTER UPDATE OF username, is_admin, is_approved, is_banned ON user
+        BEGIN
+            {LOG_USER_STATE_CHANGE}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_state_delete AFTER DELETE ON user
+        BEGIN
+            {LOG_USER_STATE_CHANGE}
+        END""",
+]
+
+
+# conversation holds the newest message of every pair of users, once from each
+# side, so a user's conversation list is read newest first from an index rather
+# than grouped from all of their messages
+SAME_PAIR = ('((sender_id = old.sender_id AND recipient_id = old.recipient_id) '
+             'OR (sender_id = old.recipient_id AND recipient_id = old.sender_id))')
+# The conversation rows whose newest message was just deleted
+PAIR_LAST = 'user_id IN (old.sender_id, old.recipient_id) AND last_message_id = old.id'
+MESSAGE_SIDES = ('SELECT sender_id AS user_id, recipient_id AS other_id, id FROM message{where} '
+                 'UNION ALL SELECT recipient_id, sender_id, id FROM message{where}')
+
+CONVERSATIONS = [
+    'CREATE INDEX IF NOT EXISTS ix_message_sender_id_recipient_id_created_at '
+    'ON message (sender_id, recipient_id, created_at)',
+    'CREATE TABLE IF NOT EXISTS conversation ('
+    'user_id INTEGER NOT NULL REFERENCES user (id), other_id INTEGER NOT NULL REFERENCES user (id), '
+    'last_message_id INTEGER NOT NULL, PRIMARY KEY (user_id, other_id))',
+    'CREATE INDEX IF NOT EXISTS ix_conversation_user_id_last_message_id ON conversation (user_id, last_message_id)',
+    """CREATE TRIGGER IF NOT EXISTS message_conversation_insert AFTER INSERT ON message
+        BEGIN
+            INSERT INTO conversation (user_id, other_id, last_message_id)
+                VALUES (new.sender_id, new.recipient_id, new.id), (new.recipient_id, new.sender_id, new.id)
+                ON CONFLICT (user_id, other_id) DO UPDATE
+                SET last_message_id = max(last_message_id, excluded.last_message_id);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS message_conversation_delete AFTER DELETE ON message
+        BEGIN
+            DELETE FROM conversation WHERE {PAIR_LAST}
+                AND NOT EXISTS (SELECT 1 FROM message WHERE {SAME_PAIR});
+            UPDATE conversation SET last_message_id = (SELECT max(id) FROM message WHERE {SAME_PAIR})
+                WHERE {PAIR_LAST};
+        END""",
+    'DELETE FROM conversation',
+    'INSERT INTO conversation (user_id, other_id, last_message_id) '
+    f"SELECT user_id, other_id, max(id) FROM ({MESSAGE_SIDES.format(where='')}) GROUP BY user_id, other_id",
+]
+
+
+# (version, description, step): a step is a callable or a list of SQL statements
+MIGRATIONS = [
+    (1, 'create missing tables', create_tables),
+    (2, 'indexes for the list endpoints', [
+        'CREATE INDEX IF NOT EXISTS ix_post_created_at_id ON post (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_message_sender_id_created_at ON message (sender_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_message_recipient_id_created_at ON message (recipient_id, created_at)',
+        'DROP INDEX IF EXISTS ix_advertisement_is_deleted_created_at_id',
+        'CREATE INDEX IF NOT EXISTS ix_advertisement_live_created_at_id '
+        'ON advertisement (created_at, id) WHERE is_deleted = 0',
+        'CREATE INDEX IF NOT EXISTS ix_advertisement_image_advertisement_id_position '
+        'ON advertisement_image (advertisement_id, position)',
+        'CREATE INDEX IF NOT EXISTS ix_user_pending ON user (created_at) WHERE is_approved = 0 AND is_banned = 0',
+        'CREATE INDEX IF NOT EXISTS ix_public_service_category_id ON public_service (category, id)',
+    ]),
+    (3, 'store public_service.category as INTEGER', retype_public_service_category),
+    (4, 'move advertisement images out of the JSON column', backfill_ad_images),
+    (5, 'full-text search over posts and advertisements', SEARCH_INDEX),
+    (6, 'resized variants of advertisement images', create_image_variants),
+    (7, 'unread message counters', UNREAD_COUNTERS),
+    (8, 'admin user directory indexes and status counters', USER_DIRECTORY),
+    (9, 'versions of the cached feed and advertisement pages', cache_versions(CACHE_VERSION_SOURCES)),
+    (10, 'change log for delta sync', create_change_log),
+    (11, 'version of the cached public services catalog', cache_versions(CATALOG_VERSION_SOURCES)),
+    (12, 'version of the cached user auth state', cache_versions(USER_STATE_VERSION_SOURCES)),
+    (13, 'log of changed users for the cached user auth state', USER_STATE_CHANGES),
+    (14, 'newest message of each conversation', CONVERSATIONS),
+    (15, 'advertisement images by path', [
+        'CREATE INDEX IF NOT EXISTS ix_advertisement_image_path ON advertisement_image (path)',
+    ]),
+]
+
+
+def applied_versions():
+    db.session.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at DATETIME NOT NULL)'
+    ))
+    return {row[0] for row in db.session.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def upgrade():
+    """Apply pending migrations in order and return the versions applied"""
+    applied = applied_versions()
+    newly_applied = []
+    for version, description, step in MIGRATIONS:
+        if version in applied:
+            continue
+        if callable(step):
+            step()
+        else:
+            for statement in step:
+                db.session.execute(text(statement))
+        # OR IGNORE: workers started together may each apply the same (re-runnable) step
+        db.session.execute(
+            text('INSERT OR IGNORE INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+            {'v': version, 'd': description, 't': datetime.utcnow()}
+        )
+        db.session.commit()
+        newly_applied.append(version)
+    return newly_applied
+
+
+def status():
+    applied = applied_versions()
+    return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+
+def hot_queries():
+    """(name, query, expected indexes, tables it may scan) for each list endpoint"""
+    from change_log import EVERYONE, changes_query
+    from routes.admin import directory_query, pending_users_query
+    from routes.advertisements import listing_query
+    from routes.messages import conversations_query, inbox_query, thread_query
+    from routes.posts import feed_query
+    from routes.public_services import catalog_query
+    return [
+        ('post feed', feed_query(), ['ix_post_created_at_id'], ()),
+        ('post feed, next page', feed_query(before=1), ['ix_post_created_at_id'], ()),
+        ('inbox', inbox_query(1, None, 21), ['ix_message_sender_id_created_at', 'ix_message_recipient_id_created_at'], ()),
+        ('conversation', thread_query(1, 2, None, 21), ['ix_message_sender_id_recipient_id_created_at'], ()),
+        ('conversation list', conversations_query(1), ['ix_conversation_user_id_last_message_id'], ()),
+        ('advertisement list', listing_query(), ['ix_advertisement_live_created_at_id'], ()),
+        ('pending users', pending_users_query(), ['ix_user_pending'], ()),
+        ('user directory by building', directory_query(building_number='1'),
+         ['ix_user_building_number_apartment_number'], ()),
+        ('user directory search', directory_query(search='ab'),
+         ['ix_user_username_lower', 'ix_user_full_name_lower'], ()),
+        ('change log', changes_query(1, [EVERYONE, 'user_1']), ['INTEGER PRIMARY KEY'], ()),
+        # The catalog lists every category, so only the service lookup has to be indexed
+        ('public services catalog', catalog_query(), ['ix_public_service_category_id'],
+         ('public_service_category',)),
+    ]
+
+
+def explain(query):
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+# Hot queries whose plans may sort in a temp b-tree, and what bounds that sort
+BOUNDED_SORTS = {
+    'inbox': 'merges at most a page from each side',
+    'conversation': 'merges at most a page from each side',
+    'user directory by building': "one building's residents",
+    'user directory search': 'the users matching the prefix, which the total count reads anyway',
+}
+
+
+def check_plans():
+    """Return (name, ok, plan lines) for every hot query.
+
+    A plan passes when it uses one of the expected indexes and never falls
+    back to a bare table scan, other than of the tables the query may scan.
+    Reading back the rows of a subquery (a co-routine) is not a table scan.
+    Nor may it sort in a temp b-tree, which reads every matching row before
+    the first page is returned, unless the sort is listed in BOUNDED_SORTS.
+    """
+    results = []
+    for name, query, indexes, scannable in hot_queries():
+        plan = explain(query)
+        uses_index = any(index in line for index in indexes for line in plan)
+        subqueries = {line.split()[1] for line in plan if line.startswith('CO-ROUTINE ')}
+        full_scan = any(
+            line.startswith('SCAN ') and ' USING ' not in line and line.split()[1] not in (*scannable, *subqueries)
+            for line in plan
+        )
+        unbounded_sort = name not in BOUNDED_SORTS and any('TEMP B-TREE' in line for line in plan)
+        results.append((name, uses_index and not full_scan and not unbounded_sort, plan))
+    return results
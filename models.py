@@ -1,8 +1,10 @@
 from unicodedata import category
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, text
 from datetime import datetime
+from db_engine import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -21,6 +23,34 @@ class User(db.Model):
     received_messages = db.relationship('Message', foreign_keys='Message.recipient_id', backref='recipient', lazy=True, cascade="all, delete-orphan")
     advertisements = db.relationship('Advertisement', backref='author', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Only the pending-approval queue is indexed; it is small and scanned by admins
+        db.Index('ix_user_pending', 'created_at', sqlite_where=text('is_approved = 0 AND is_banned = 0')),
+        # Admin directory filters
+        db.Index('ix_user_building_number_apartment_number', 'building_number', 'apartment_number'),
+    )
+
+# Case-insensitive prefix search in the admin directory compares against these expressions
+db.Index('ix_user_username_lower', func.lower(User.username))
+db.Index('ix_user_full_name_lower', func.lower(User.full_name))
+
+class CacheVersion(db.Model):
+    # Version of a cached resource, bumped by triggers on its tables (see response_cache.VersionedCache)
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class UserStatusCount(db.Model):
+    # Number of users per combination of status flags; maintained by triggers on user (see migrations.py)
+    is_admin = db.Column(db.Boolean, primary_key=True)
+    is_approved = db.Column(db.Boolean, primary_key=True)
+    is_banned = db.Column(db.Boolean, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class UserStateChange(db.Model):
+    # A user whose cached auth state changed; appended by triggers on user (see user_cache.py)
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -29,6 +59,11 @@ class Post(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
     deletion_type = db.Column(db.String(20), nullable=True)  # 'user' or 'admin'
 
+    __table_args__ = (
+        # Backs the keyset-paginated feed: ORDER BY created_at DESC, id DESC
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+    )
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -39,6 +74,34 @@ class Message(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
     deletion_type = db.Column(db.String(20), nullable=True)  # 'user' or 'admin'
 
+    __table_args__ = (
+        # One index per side of a conversation, ordered for newest-first paging
+        db.Index('ix_message_sender_id_created_at', 'sender_id', 'created_at'),
+        db.Index('ix_message_recipient_id_created_at', 'recipient_id', 'created_at'),
+        # Both sides of one conversation, for paging a thread without reading the users' other messages
+        db.Index('ix_message_sender_id_recipient_id_created_at', 'sender_id', 'recipient_id', 'created_at'),
+        # Unread messages only, for marking a conversation read in one UPDATE
+        db.Index('ix_message_unread', 'recipient_id', 'sender_id', 'id', sqlite_where=text('is_read = 0')),
+    )
+
+class UnreadCount(db.Model):
+    # Unread, undeleted messages from sender_id to user_id; maintained by triggers on message (see migrations.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class Conversation(db.Model):
+    # Newest message exchanged between user_id and other_id, one row for each side;
+    # maintained by triggers on message (see migrations.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_message_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        # A user's conversations, most recently active first
+        db.Index('ix_conversation_user_id_last_message_id', 'user_id', 'last_message_id'),
+    )
+
 class PublicServiceCategory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -55,6 +118,11 @@ class PublicService(db.Model):
     status = db.Column(db.String(50), nullable=False)  # e.g., "Active", "Unavailable"
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Backs the catalog join from category to its services
+        db.Index('ix_public_service_category_id', 'category', 'id'),
+    )
     
 class Advertisement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -65,4 +133,59 @@ class Advertisement(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
     price=db.Column(db.Float, nullable=True)
     phone_number=db.Column(db.Text, nullable=True)
-    images = db.Column(db.Text, nullable=True)  # Store image URLs as JSON string
+    images = db.Column(db.Text, nullable=True)  # Legacy JSON list of paths, superseded by AdvertisementImage
+
+    ad_images = db.relationship('AdvertisementImage', backref='advertisement', lazy=True,
+                                order_by='AdvertisementImage.position', cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # Backs the marketplace list: WHERE is_deleted = 0 ORDER BY created_at DESC, id DESC
+        db.Index('ix_advertisement_live_created_at_id', 'created_at', 'id', sqlite_where=text('is_deleted = 0')),
+    )
+
+class AdvertisementImage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    advertisement_id = db.Column(db.Integer, db.ForeignKey('advertisement.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    path = db.Column(db.String(255), nullable=False)
+    url = db.Column(db.String(512), nullable=False)  # Built once at upload time
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    byte_size = db.Column(db.Integer, nullable=True)
+
+    variants = db.relationship('AdvertisementImageVariant', lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('ix_advertisement_image_advertisement_id_position', 'advertisement_id', 'position'),
+        # Who uploaded a file, for ads that reuse the paths of earlier uploads
+        db.Index('ix_advertisement_image_path', 'path'),
+    )
+
+class AdvertisementImageVariant(db.Model):
+    # Resized WebP copy of an AdvertisementImage, see image_variants.py
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('advertisement_image.id'), nullable=False, index=True)
+    name = db.Column(db.String(20), nullable=False)  # 'thumbnail' or 'display'
+    path = db.Column(db.String(255), nullable=False)
+    url = db.Column(db.String(512), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    byte_size = db.Column(db.Integer, nullable=False)
+
+class ChangeLog(db.Model):
+    # Append-only log of the changes pushed over Socket.IO, for clients catching up (see change_log.py)
+    seq = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(50), nullable=False)
+    entity = db.Column(db.String(50), nullable=False)  # 'post', 'message', 'user', ...
+    entity_id = db.Column(db.Integer, nullable=True)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)  # tombstone for a deletion
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # AUTOINCREMENT: sequence numbers are never handed out again once compacted away
+    __table_args__ = {'sqlite_autoincrement': True}
+
+class ChangeLogRoom(db.Model):
+    # Socket.IO room a change was sent to; change_log.EVERYONE for broadcasts
+    seq = db.Column(db.Integer, db.ForeignKey('change_log.seq'), primary_key=True)
+    room = db.Column(db.String(50), primary_key=True)
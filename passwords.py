@@ -0,0 +1,108 @@
+"""Password hashing off the eventlet hub, and login throttling that runs before it.
+
+bcrypt takes 100-300 ms of CPU per call. Called directly from a green thread it
+stalls every request and socket on the process, so hashing runs in eventlet's
+native thread pool with at most BCRYPT_MAX_CONCURRENCY calls at a time.
+"""
+import ipaddress
+import os
+import time
+from collections import OrderedDict
+import bcrypt
+from eventlet import tpool
+from eventlet.semaphore import Semaphore
+
+BCRYPT_MAX_CONCURRENCY = int(os.environ.get('BCRYPT_MAX_CONCURRENCY', 4))
+
+_hash_slots = Semaphore(BCRYPT_MAX_CONCURRENCY)
+_hash_stats = {'queued': 0, 'in_flight': 0, 'completed': 0}
+
+
+def _run_bounded(fn, *args):
+    _hash_stats['queued'] += 1
+    try:
+        _hash_slots.acquire()
+    finally:
+        _hash_stats['queued'] -= 1
+    _hash_stats['in_flight'] += 1
+    try:
+        return tpool.execute(fn, *args)
+    finally:
+        _hash_stats['in_flight'] -= 1
+        _hash_stats['completed'] += 1
+        _hash_slots.release()
+
+
+def hash_password(password):
+    """Hash a password and return it as a string ready to store"""
+    hashed = _run_bounded(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
+    return hashed.decode('utf-8')
+
+
+def check_password(password, hashed):
+    return _run_bounded(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hashing_stats():
+    """Queue depth and concurrency of the password hashing pool"""
+    return dict(_hash_stats, max_concurrency=BCRYPT_MAX_CONCURRENCY)
+
+
+class AttemptLimiter:
+    """Fixed-window attempt counter per key, holding at most max_keys keys.
+
+    Used to turn requests away before any bcrypt work is done. State is
+    per process.
+    """
+
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._windows = OrderedDict()  # key -> (window start, attempts)
+
+    def retry_after(self, key):
+        """Seconds until `key` may try again, or 0 if it is not throttled"""
+        entry = self._windows.get(key)
+        if entry is None:
+            return 0
+        started, attempts = entry
+        remaining = started + self.window - time.monotonic()
+        if remaining <= 0:
+            del self._windows[key]
+            return 0
+        return int(remaining) + 1 if attempts >= self.limit else 0
+
+    def hit(self, key):
+        now = time.monotonic()
+        started, attempts = self._windows.pop(key, (now, 0))
+        if now - started >= self.window:
+            started, attempts = now, 0
+        self._windows[key] = (started, attempts + 1)
+        while len(self._windows) > self.max_keys:
+            self._windows.popitem(last=False)
+
+    def reset(self, key):
+        self._windows.pop(key, None)
+
+
+def client_network(address):
+    """The /24 (IPv4) or /64 (IPv6) network of a client address, or the address itself if it doesn't parse"""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    return str(ipaddress.ip_network(f'{ip}/{24 if ip.version == 4 else 64}', strict=False))
+
+
+# Every login or registration attempt counts against the client IP. Failed
+# logins count against the username from the client's network only, so
+# guessing someone's password from elsewhere can't lock them out.
+ip_attempts = AttemptLimiter(
+    limit=int(os.environ.get('LOGIN_IP_LIMIT', 30)),
+    window=int(os.environ.get('LOGIN_IP_WINDOW', 60))
+)
+username_failures = AttemptLimiter(
+    limit=int(os.environ.get('LOGIN_USERNAME_LIMIT', 5)),
+    window=int(os.environ.get('LOGIN_USERNAME_WINDOW', 900))
+)
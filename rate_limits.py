@@ -0,0 +1,178 @@
+"""Token-bucket limits on the write endpoints, so no client can hog the SQLite writer.
+
+Each limit is a bucket of `count` tokens per user, refilled at `count` per
+`period` seconds; a request takes one token from every bucket it is
+limited by, or, when any of them is empty, takes none and is answered 429
+with Retry-After. Limits are configured in RATE_LIMITS as
+name -> 'count/period', for instance {'posts': '10/60', 'writes': '30/60'}.
+
+A bucket is stored as the time at which it will be full again, which is
+all a token bucket needs: with the bucket full at `full_at` and refilling
+at `rate` tokens a second, taking a token moves full_at to
+max(full_at, now) + 1 / rate, and is allowed as long as full_at stays
+within count / rate of now. A bucket whose full_at has passed is the same
+as no bucket, so idle buckets are dropped.
+
+RATE_LIMIT_STORAGE selects where buckets are kept:
+
+    unset                             in process, at most RATE_LIMIT_MAX_KEYS buckets
+    sqlite:////tmp/forum-limits.db    a SQLite file shared by every worker process
+
+With several workers (see serve.py) the shared file keeps the limits at
+their configured values rather than multiplied by the worker count.
+"""
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limit(spec):
+    """(count, period in seconds) from a 'count/period' string"""
+    count, _, period = spec.partition('/')
+    return int(count), float(period)
+
+
+def retry_after_seconds(delay):
+    return max(1, math.ceil(delay))
+
+
+class MemoryBuckets:
+    """Buckets of one process, in LRU order, holding at most max_keys of them"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._full_at = OrderedDict()  # key -> time the bucket is full again
+        self._lock = threading.Lock()
+
+    def take(self, limits, now):
+        """Take a token from every (key, interval, capacity) bucket, or from none of them
+        if one is empty; returns 0 if allowed, else the seconds until all have a token"""
+        with self._lock:
+            taken = [(key, max(self._full_at.pop(key, now), now), interval, capacity)
+                     for key, interval, capacity in limits]
+            delay = max(current + interval - now - capacity for _, current, interval, capacity in taken)
+            for key, current, interval, _ in taken:
+                self._full_at[key] = current + interval if delay <= 0 else current
+            self._evict(now)
+        return max(delay, 0)
+
+    def _evict(self, now):
+        # Least recently used first: full buckets hold no state, and past max_keys
+        # the oldest go even if they are not full yet
+        while self._full_at:
+            key, full_at = next(iter(self._full_at.items()))
+            if full_at > now and len(self._full_at) <= self.max_keys:
+                break
+            del self._full_at[key]
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file, so every worker process draws from the same ones"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._taken = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_bucket (key TEXT PRIMARY KEY, full_at REAL NOT NULL)')
+        return conn
+
+    def take(self, limits, now):
+        with self._lock:
+            try:
+                return self._take(limits, now)
+            except sqlite3.Error:
+                # Writes go on without limits rather than failing with the limiter's storage
+                self._conn = None
+                logger.exception('Rate limit storage at %s failed', self.path)
+                return 0
+
+    def _take(self, limits, now):
+        if self._conn is None:
+            self._conn = self._connect()
+        conn = self._conn
+        # IMMEDIATE: no other process can take from these buckets between the check and the update
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            taken = []
+            for key, interval, capacity in limits:
+                row = conn.execute('SELECT full_at FROM rate_bucket WHERE key = ?', (key,)).fetchone()
+                taken.append((key, max(row[0], now) if row else now, interval, capacity))
+            delay = max(current + interval - now - capacity for _, current, interval, capacity in taken)
+            if delay <= 0:
+                conn.executemany(
+                    'INSERT INTO rate_bucket (key, full_at) VALUES (?, ?) '
+                    'ON CONFLICT (key) DO UPDATE SET full_at = excluded.full_at',
+                    [(key, current + interval) for key, current, interval, _ in taken]
+                )
+            self._taken += 1
+            if self._taken % self.PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM rate_bucket WHERE full_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return max(delay, 0)
+
+
+def create_buckets(url, max_keys):
+    if not url:
+        return MemoryBuckets(max_keys)
+    if url.startswith('sqlite:///'):
+        return SQLiteBuckets(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported RATE_LIMIT_STORAGE: {url}')
+
+
+class RateLimiter:
+    def __init__(self):
+        self.limits = {}  # name -> (seconds per token, seconds to refill a whole bucket)
+        self.buckets = MemoryBuckets()
+
+    def init_app(self, app):
+        self.limits = {}
+        for name, spec in app.config['RATE_LIMITS'].items():
+            count, period = parse_limit(spec)
+            # A hair over the period, so rounding in the sum of `count` intervals can't refuse the last token
+            self.limits[name] = (period / count, period * (1 + 1e-9))
+        self.buckets = create_buckets(app.config['RATE_LIMIT_STORAGE'], app.config['RATE_LIMIT_MAX_KEYS'])
+
+    def retry_after(self, user_id, names):
+        """Take a token from each named bucket of the user, or from none if one is empty;
+        returns 0 if allowed, else Retry-After seconds"""
+        limits = [(f'{name}:{user_id}',) + self.limits[name] for name in names if name in self.limits]
+        if not limits:
+            return 0
+        delay = self.buckets.take(limits, time.time())
+        return retry_after_seconds(delay) if delay else 0
+
+    def limit(self, *names):
+        """Decorator for JWT-protected endpoints, limiting each user by the named buckets"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                retry_after = self.retry_after(get_jwt_identity(), names)
+                if retry_after:
+                    return jsonify({"error": "Too many requests, please slow down"}), 429, \
+                        {'Retry-After': str(retry_after)}
+                return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+write_limiter = RateLimiter()
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, request
+from sqlalchemy import select
+from compression import choose_encoding, compress, encoded_etag
+from models import db, CacheVersion
+
+
+class CachedBody:
+    """A rendered JSON body with its ETag, extra headers and compressed copies.
+
+    Compressed copies are made on the first response that asks for each
+    encoding and kept for the life of the body.
+    """
+
+    def __init__(self, body, etag, headers=None):
+        self.body = body
+        self.etag = etag
+        self.headers = headers or {}
+        self._encoded = {}  # encoding -> compressed body
+
+    def encoded(self, encoding):
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = compress(self.body, encoding, current_app.config)
+        return data
+
+    def response(self):
+        """Serve the body, compressed when the client accepts it, answering
+        304 Not Modified when If-None-Match matches"""
+        encoding = None
+        compressible = len(self.body) >= current_app.config['COMPRESS_MIN_SIZE']
+        if compressible:
+            encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        response = Response(self.body if encoding is None else self.encoded(encoding),
+                            mimetype='application/json', headers=self.headers)
+        if compressible:
+            response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        # Each encoding's bytes differ, so each gets its own strong ETag
+        response.set_etag(encoded_etag(self.etag, encoding))
+        return response.make_conditional(request)
+
+
+def not_modified(etag):
+    """A bare 304 response when the request's If-None-Match already holds `etag`, else None.
+
+    The client may hold the representation in the encoding it negotiates now,
+    or the identity one, which is what bodies below COMPRESS_MIN_SIZE are sent as.
+    """
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    for tag in dict.fromkeys([encoded_etag(etag, encoding), etag]):
+        if request.if_none_match.contains_weak(tag):
+            response = Response(status=304)
+            response.set_etag(tag)
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.cached = None
+
+
+class VersionedCache:
+    """Pre-rendered pages of a resource, valid while the resource's version is unchanged.
+
+    Versions live in the cache_version table and are bumped by triggers on
+    every write that changes the resource (see migrations.py), so all worker
+    processes agree on them and no write path can forget to. A request costs
+    one primary-key lookup for the version; the ETag is derived from the
+    version and page key, so a client that is up to date gets a 304 without
+    the page being built.
+
+    Concurrent misses for the same page are coalesced: one green thread builds
+    it while the others wait for its result. Until the migration creating the
+    version row has run, responses are built uncached.
+    """
+
+    def __init__(self, name, max_entries=256):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (version, key) -> CachedBody
+        self._flights = {}  # (version, key) -> _Flight
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        return db.session.execute(
+            select(CacheVersion.version).where(CacheVersion.name == self.name)
+        ).scalar()
+
+    def response(self, key, build):
+        """Serve the page identified by `key` (a tuple of request parameters).
+
+        build() returns (data, headers) for the page on a miss.
+        """
+        version = self.current_version()
+        if version is None:
+            data, headers = build()
+            return current_app.response_class(current_app.json.dumpb(data), mimetype='application/json',
+                                              headers=headers)
+
+        etag = '-'.join([self.name, str(version)] + ['' if part is None else str(part) for part in key])
+        return not_modified(etag) or self._get(version, key, etag, build).response()
+
+    def _get(self, version, key, etag, build):
+        entry_key = (version, key)
+        with self._lock:
+            cached = self._entries.get(entry_key)
+            if cached is not None:
+                self._entries.move_to_end(entry_key)
+                return cached
+            flight = self._flights.get(entry_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[entry_key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.cached is not None:
+                return flight.cached
+            # The leader failed; build this request's copy itself
+            return self._render(etag, build)
+
+        try:
+            cached = flight.cached = self._render(etag, build)
+            with self._lock:
+                if self._latest is None or version > self._latest:
+                    # Pages of older versions can no longer be served
+                    self._entries.clear()
+                    self._latest = version
+                if version == self._latest:
+                    self._entries[entry_key] = cached
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return cached
+        finally:
+            with self._lock:
+                del self._flights[entry_key]
+            flight.done.set()
+
+    @staticmethod
+    def _render(etag, build):
+        data, headers = build()
+        return CachedBody(current_app.json.dumpb(data), etag, headers)
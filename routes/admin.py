@@ -1,10 +1,31 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from models import db, User, Post, Advertisement
-from socket_instance import socketio
+from models import (db, User, Post, Message, Advertisement, AdvertisementImage, AdvertisementImageVariant,
+                    UserStatusCount)
+from sqlalchemy import and_, delete, false, func, or_, select, true, update
+from socket_instance import user_room, ADMIN_ROOM
+from change_log import record_change
+from passwords import hashing_stats
+from user_cache import user_cache
+from json_provider import streamed_json_array
+from routes.posts import serialize_post
+from utils import filter_after, get_pagination_args, keyset_page, pagination_headers
 
 admin_bp = Blueprint('admin', __name__)
 
+# Rows fetched per round trip when streaming a full table
+EXPORT_BATCH_SIZE = 1000
+# Most user ids one bulk request may list
+MAX_BULK_USER_IDS = 1000
+
+# Bulk action -> (status reported in events, users the action applies to, column changes)
+BULK_ACTIONS = {
+    'approve': ('approved', [User.is_approved == false()], {'is_approved': True}),
+    'reject': ('rejected', [User.is_approved == false()], None),
+    'ban': ('banned', [User.is_admin == false(), User.is_banned == false()], {'is_banned': True}),
+    'unban': ('unbanned', [User.is_banned == true()], {'is_banned': False}),
+}
+
 # Admin middleware to check if user is an admin
 def admin_required(fn):
     @jwt_required()
@@ -20,10 +41,71 @@ def admin_required(fn):
     wrapper.__name__ = fn.__name__
     return wrapper
 
+def pending_users_query(after=None):
+    """Oldest-first query of users waiting for approval"""
+    # Literal flags so SQLite can use the partial ix_user_pending index
+    query = User.query.filter(User.is_approved == false(), User.is_banned == false()).order_by(
+        User.created_at, User.id
+    )
+    return filter_after(query, User, after)
+
+def parse_flag(value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+def directory_query(flags=None, building_number=None, apartment_number=None, search=None, before=None):
+    """Newest-first query of users matching the admin directory filters.
+
+    `flags` maps is_admin/is_approved/is_banned to the wanted value; `search`
+    matches the start of the username or full name, ignoring case.
+    """
+    query = User.query.order_by(User.id.desc())
+    for name, value in (flags or {}).items():
+        query = query.filter(getattr(User, name) == (true() if value else false()))
+    if building_number is not None:
+        query = query.filter(User.building_number == building_number)
+    if apartment_number is not None:
+        query = query.filter(User.apartment_number == apartment_number)
+    if search:
+        # A range over lower(...) rather than LIKE, so the expression indexes are used
+        prefix = search.lower()
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        query = query.filter(or_(
+            and_(func.lower(User.username) >= prefix, func.lower(User.username) < upper),
+            and_(func.lower(User.full_name) >= prefix, func.lower(User.full_name) < upper)
+        ))
+    if before is not None:
+        query = query.filter(User.id < before)
+    return query
+
+def status_total(flags):
+    """Number of users with the given status flags, summed from the trigger-maintained counters"""
+    query = db.session.query(func.coalesce(func.sum(UserStatusCount.count), 0))
+    for name, value in flags.items():
+        query = query.filter(getattr(UserStatusCount, name) == value)
+    return query.scalar()
+
+def serialize_directory_user(user):
+    return {
+        "id": user.id,
+        "username": user.username,
+        "full_name": user.full_name,
+        "building_number": user.building_number,
+        "apartment_number": user.apartment_number,
+        "is_admin": user.is_admin,
+        "is_approved": user.is_approved,
+        "is_banned": user.is_banned,
+        "created_at": user.created_at.isoformat()
+    }
+
 @admin_bp.route('/pending-users', methods=['GET'])
 @admin_required
 def get_pending_users():
-    users = User.query.filter_by(is_approved=False, is_banned=False).all()
+    after, limit = get_pagination_args('after')
+    users, next_after = keyset_page(pending_users_query(after), limit)
     
     result = []
     for user in users:
@@ -36,7 +118,96 @@ def get_pending_users():
             "created_at": user.created_at.isoformat()
         })
     
-    return jsonify(result), 200
+    return jsonify(result), 200, pagination_headers(next_after, 'X-Next-After')
+
+def delete_users(user_ids):
+    """Delete users and everything they own with set-based DELETEs, children first"""
+    ad_ids = select(Advertisement.id).where(Advertisement.user_id.in_(user_ids))
+    image_ids = select(AdvertisementImage.id).where(AdvertisementImage.advertisement_id.in_(ad_ids))
+    for statement in (
+        delete(AdvertisementImageVariant).where(AdvertisementImageVariant.image_id.in_(image_ids)),
+        delete(AdvertisementImage).where(AdvertisementImage.advertisement_id.in_(ad_ids)),
+        delete(Advertisement).where(Advertisement.user_id.in_(user_ids)),
+        delete(Post).where(Post.user_id.in_(user_ids)),
+        delete(Message).where(or_(Message.sender_id.in_(user_ids), Message.recipient_id.in_(user_ids))),
+        delete(User).where(User.id.in_(user_ids)),
+    ):
+        db.session.execute(statement, execution_options={'synchronize_session': False})
+
+def soft_delete_content(user_ids):
+    """Mark every live post and ad of the users as deleted by an admin; returns (posts, ads) counts"""
+    posts = db.session.execute(
+        update(Post).where(Post.user_id.in_(user_ids), Post.is_deleted == false())
+        .values(is_deleted=True, deletion_type='admin'),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    advertisements = db.session.execute(
+        update(Advertisement).where(Advertisement.user_id.in_(user_ids), Advertisement.is_deleted == false())
+        .values(is_deleted=True),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    return posts, advertisements
+
+@admin_bp.route('/users/bulk', methods=['POST'])
+@admin_required
+def bulk_update_users():
+    data = request.get_json(silent=True) or {}
+    
+    action = data.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify({"error": "action must be one of: approve, reject, ban, unban"}), 400
+    status, applies_to, changes = BULK_ACTIONS[action]
+    
+    # Users are selected by id, by building, or both; one of them is required
+    user_ids = data.get('user_ids')
+    building_number = data.get('building_number')
+    if user_ids is None and building_number is None:
+        return jsonify({"error": "user_ids or building_number is required"}), 400
+    
+    conditions = list(applies_to)
+    if user_ids is not None:
+        if not isinstance(user_ids, list) or not all(isinstance(i, int) for i in user_ids):
+            return jsonify({"error": "user_ids must be a list of user ids"}), 400
+        if len(user_ids) > MAX_BULK_USER_IDS:
+            return jsonify({"error": f"At most {MAX_BULK_USER_IDS} user ids per request"}), 400
+        conditions.append(User.id.in_(user_ids))
+    if building_number is not None:
+        conditions.append(User.building_number == str(building_number))
+    
+    delete_content = bool(data.get('delete_content')) and action == 'ban'
+    
+    # Every statement runs in the same transaction, committed once
+    if changes is None:
+        affected = db.session.execute(select(User.id).where(*conditions)).scalars().all()
+        if affected:
+            delete_users(affected)
+    else:
+        affected = db.session.execute(
+            update(User).where(*conditions).values(**changes).returning(User.id),
+            execution_options={'synchronize_session': False}
+        ).scalars().all()
+    
+    posts_deleted = advertisements_deleted = 0
+    if affected and delete_content:
+        posts_deleted, advertisements_deleted = soft_delete_content(affected)
+    
+    # One event for the whole batch, to the admins and every affected user
+    if affected:
+        record_change('user_status_changed_batch', {'user_ids': affected, 'status': status},
+                      to=[ADMIN_ROOM] + [user_room(user_id) for user_id in affected],
+                      entity='user', deleted=changes is None)
+    db.session.commit()
+    
+    for user_id in affected:
+        user_cache.invalidate(user_id)
+    
+    return jsonify({
+        "status": status,
+        "user_ids": affected,
+        "count": len(affected),
+        "posts_deleted": posts_deleted,
+        "advertisements_deleted": advertisements_deleted
+    }), 200
 
 @admin_bp.route('/users/<int:user_id>/approve', methods=['POST'])
 @admin_required
@@ -50,10 +221,11 @@ def approve_user(user_id):
         return jsonify({"error": "User is already approved"}), 400
     
     user.is_approved = True
+    # Log the user approval event, emitted once committed
+    record_change('user_status_changed', {'user_id': user.id, 'status': 'approved'},
+                  to=[ADMIN_ROOM, user_room(user.id)], entity='user', entity_id=user.id)
     db.session.commit()
-    
-    # Emit WebSocket event for user approval
-    socketio.emit('user_status_changed', {'user_id': user.id, 'status': 'approved'})
+    user_cache.invalidate(user.id)
     
     return jsonify({"message": f"User {user.username} has been approved"}), 200
 
@@ -73,10 +245,11 @@ def reject_user(user_id):
     user_id = user.id
     
     db.session.delete(user)
+    # Log the user rejection as a tombstone, emitted once committed
+    record_change('user_status_changed', {'user_id': user_id, 'status': 'rejected'},
+                  to=[ADMIN_ROOM, user_room(user_id)], entity='user', entity_id=user_id, deleted=True)
     db.session.commit()
-    
-    # Emit WebSocket event for user rejection
-    socketio.emit('user_status_changed', {'user_id': user_id, 'status': 'rejected'})
+    user_cache.invalidate(user_id)
     
     return jsonify({"message": f"User {username} has been rejected and deleted"}), 200
 
@@ -95,10 +268,11 @@ def ban_user(user_id):
         return jsonify({"error": "User is already banned"}), 400
     
     user.is_banned = True
+    # Log the user ban event, emitted once committed
+    record_change('user_status_changed', {'user_id': user.id, 'status': 'banned'},
+                  to=[ADMIN_ROOM, user_room(user.id)], entity='user', entity_id=user.id)
     db.session.commit()
-    
-    # Emit WebSocket event for user ban
-    socketio.emit('user_status_changed', {'user_id': user.id, 'status': 'banned'})
+    user_cache.invalidate(user.id)
     
     return jsonify({"message": f"User {user.username} has been banned"}), 200
 
@@ -114,10 +288,11 @@ def unban_user(user_id):
         return jsonify({"error": "User is not banned"}), 400
     
     user.is_banned = False
+    # Log the user unban event, emitted once committed
+    record_change('user_status_changed', {'user_id': user.id, 'status': 'unbanned'},
+                  to=[ADMIN_ROOM, user_room(user.id)], entity='user', entity_id=user.id)
     db.session.commit()
-    
-    # Emit WebSocket event for user unban
-    socketio.emit('user_status_changed', {'user_id': user.id, 'status': 'unbanned'})
+    user_cache.invalidate(user.id)
     
     return jsonify({"message": f"User {user.username} has been unbanned"}), 200
 
@@ -133,6 +308,8 @@ def delete_post(post_id):
         return jsonify({"error": "Post is already deleted"}), 400
     
     post.is_deleted = True
+    record_change('post_update', serialize_post(post, user_cache.get(post.user_id)),
+                  entity='post', entity_id=post.id, deleted=True)
     db.session.commit()
     
     return jsonify({"message": "Post has been marked as deleted"}), 200
@@ -156,20 +333,59 @@ def delete_advertisement(ad_id):
 @admin_bp.route('/users', methods=['GET'])
 @admin_required
 def get_all_users():
-    users = User.query.all()
-    
-    result = []
-    for user in users:
-        result.append({
-            "id": user.id,
-            "username": user.username,
-            "full_name": user.full_name,
-            "building_number": user.building_number,
-            "apartment_number": user.apartment_number,
-            "is_admin": user.is_admin,
-            "is_approved": user.is_approved,
-            "is_banned": user.is_banned,
-            "created_at": user.created_at.isoformat()
-        })
-    
-    return jsonify(result), 200
+    before, limit = get_pagination_args()
+    flags = {}
+    for name in ('is_admin', 'is_approved', 'is_banned'):
+        value = request.args.get(name, type=parse_flag)
+        if value is not None:
+            flags[name] = value
+    building_number = request.args.get('building_number')
+    apartment_number = request.args.get('apartment_number')
+    search = request.args.get('q', '').strip()
+    
+    query = directory_query(flags, building_number, apartment_number, search, before)
+    users, next_before = keyset_page(query, limit)
+    
+    # Status-only filters are totalled from the counters; other filters are
+    # counted with their indexes, on the first page only
+    headers = pagination_headers(next_before)
+    if building_number is None and apartment_number is None and not search:
+        headers['X-Total-Count'] = str(status_total(flags))
+    elif before is None:
+        headers['X-Total-Count'] = str(directory_query(flags, building_number, apartment_number, search).count())
+    
+    return jsonify([serialize_directory_user(user) for user in users]), 200, headers
+
+@admin_bp.route('/export/users', methods=['GET'])
+@admin_required
+def export_users():
+    # Streamed from a batched cursor, so memory doesn't grow with the user count
+    users = db.session.query(
+        User.id, User.username, User.full_name, User.building_number, User.apartment_number,
+        User.is_admin, User.is_approved, User.is_banned, User.created_at
+    ).order_by(User.id).yield_per(EXPORT_BATCH_SIZE)
+    return streamed_json_array(users)
+
+@admin_bp.route('/export/posts', methods=['GET'])
+@admin_required
+def export_posts():
+    posts = db.session.query(
+        Post.id, Post.content, Post.user_id, Post.created_at, Post.is_deleted, Post.deletion_type
+    ).order_by(Post.id).yield_per(EXPORT_BATCH_SIZE)
+    return streamed_json_array(posts)
+
+@admin_bp.route('/export/advertisements', methods=['GET'])
+@admin_required
+def export_advertisements():
+    advertisements = db.session.query(
+        Advertisement.id, Advertisement.title, Advertisement.content, Advertisement.price,
+        Advertisement.phone_number, Advertisement.user_id, Advertisement.created_at, Advertisement.is_deleted
+    ).order_by(Advertisement.id).yield_per(EXPORT_BATCH_SIZE)
+    return streamed_json_array(advertisements)
+
+@admin_bp.route('/metrics', methods=['GET'])
+@admin_required
+def get_metrics():
+    return jsonify({
+        "password_hashing": hashing_stats()
+    }), 200
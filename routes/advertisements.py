@@ -1,35 +1,118 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Advertisement
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from models import db, User, Advertisement, AdvertisementImage, AdvertisementImageVariant
+from sqlalchemy import false
+from sqlalchemy.orm import joinedload, selectinload
 import json
-from utils import save_multiple_files, get_image_urls
+import os
+from image_variants import process_image
+from response_cache import VersionedCache
+from rate_limits import write_limiter
+from user_cache import get_current_user_state
+from utils import (save_multiple_files, uploaded_image_paths, get_image_urls, get_image_size, filter_before,
+                   get_pagination_args, keyset_page, pagination_headers)
 
 advertisements_bp = Blueprint('advertisements', __name__)
 
-@advertisements_bp.route('', methods=['GET'])
-@jwt_required()
-def get_advertisements():
-    advertisements = Advertisement.query.filter_by(is_deleted=False).order_by(Advertisement.created_at.desc()).all()
+# Rendered listing pages, keyed by (before, limit)
+listing_cache = VersionedCache('advertisements')
+
+def build_variants(image_path):
+    """Strip the stored file's metadata and create AdvertisementImageVariant rows for its resized copies"""
+    variants = process_image(image_path)
+    urls = get_image_urls([variant['path'] for variant in variants])
+    return [AdvertisementImageVariant(url=url, **variant) for variant, url in zip(variants, urls)]
+
+def build_ad_images(image_paths, start_position=0):
+    """Create AdvertisementImage rows for stored files, with URL, size and variants resolved up front"""
+    images = []
+    for offset, (path, url) in enumerate(zip(image_paths, get_image_urls(image_paths))):
+        # Variants first: the original may be rewritten without its EXIF
+        variants = build_variants(path)
+        width, height = get_image_size(path)
+        images.append(AdvertisementImage(
+            position=start_position + offset,
+            path=path,
+            url=url,
+            width=width,
+            height=height,
+            byte_size=os.path.getsize(path) if os.path.isfile(path) else None,
+            variants=variants
+        ))
+    return images
+
+def uploaded_by(image_paths, user_id):
+    """Whether every path is a file saved for one of the user's own ads.
+
+    Saved files are recorded as the images of the uploader's ad in the same
+    request, so another user's file can't be attached, or rewritten in place.
+    """
+    if not image_paths:
+        return True
+    owned = db.session.query(AdvertisementImage.path).join(Advertisement).filter(
+        AdvertisementImage.path.in_(set(image_paths)),
+        Advertisement.user_id == user_id
+    ).distinct()
+    return {path for path, in owned} == set(image_paths)
+
+def image_variant_urls(ad):
+    """Per image, the URL of the original and of each resized variant"""
+    return [
+        dict({variant.name: variant.url for variant in image.variants}, original=image.url)
+        for image in ad.ad_images
+    ]
+
+def listing_query(before=None):
+    """Newest-first query of live ads, with authors joined and images and their variants IN-loaded"""
+    # A literal `is_deleted = 0` lets SQLite use the partial index on live ads
+    query = Advertisement.query.options(
+        joinedload(Advertisement.author),
+        selectinload(Advertisement.ad_images).selectinload(AdvertisementImage.variants)
+    ).filter(Advertisement.is_deleted == false()).order_by(
+        Advertisement.created_at.desc(), Advertisement.id.desc()
+    )
+    return filter_before(query, Advertisement, before)
+
+def backfill_ad_images():
+    """Move image paths from the legacy Advertisement.images JSON column into AdvertisementImage rows"""
+    migrated = 0
+    ads = Advertisement.query.filter(Advertisement.images.isnot(None), ~Advertisement.ad_images.any()).all()
+    for ad in ads:
+        try:
+            image_paths = json.loads(ad.images)
+        except json.JSONDecodeError:
+            continue
+        ad.ad_images = build_ad_images(image_paths)
+        ad.images = None
+        migrated += 1
+    return migrated
+
+def backfill_image_variants():
+    """Create variants for stored images that have none"""
+    images = AdvertisementImage.query.filter(~AdvertisementImage.variants.any()).all()
+    for image in images:
+        image.variants = build_variants(image.path)
+        image.width, image.height = get_image_size(image.path)
+        if os.path.isfile(image.path):
+            image.byte_size = os.path.getsize(image.path)
+    return len(images)
+
+def build_listing_page(before, limit):
+    """(advertisements, headers) for one page of the listing"""
+    # Authors are joined, images and variants IN-loaded, so a page costs three queries
+    advertisements, next_before = keyset_page(listing_query(before), limit)
     
     result = []
     for ad in advertisements:
-        author = User.query.get(ad.user_id)
-        
-        # Parse image URLs if they exist
-        image_urls = []
-        if ad.images:
-            try:
-                image_paths = json.loads(ad.images)
-                image_urls = get_image_urls(image_paths)
-            except json.JSONDecodeError:
-                pass
+        author = ad.author
         
         ad_data = {
             "id": ad.id,
             "title": ad.title,
             "content": ad.content,
             "created_at": ad.created_at.isoformat(),
-            "images": image_urls,
+            "images": [image.url for image in ad.ad_images],
+            "image_variants": image_variant_urls(ad),
             "price": ad.price,
             "phone_number": ad.phone_number,
             "author": {
@@ -42,13 +125,20 @@ def get_advertisements():
         }
         result.append(ad_data)
     
-    return jsonify(result), 200
+    return result, pagination_headers(next_before)
+
+@advertisements_bp.route('', methods=['GET'])
+@jwt_required()
+def get_advertisements():
+    before, limit = get_pagination_args()
+    return listing_cache.response((before, limit), lambda: build_listing_page(before, limit))
 
 @advertisements_bp.route('', methods=['POST'])
 @jwt_required()
+@write_limiter.limit('advertisements', 'writes')
 def create_advertisement():
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = get_current_user_state()
     
     if not user.is_approved and not user.is_admin:
         return jsonify({"error": "You need to be approved to create advertisements"}), 403
@@ -56,6 +146,9 @@ def create_advertisement():
     if user.is_banned:
         return jsonify({"error": "You are banned and cannot create advertisements"}), 403
     
+    # Hold no connection while images are processed below
+    db.session.close()
+    
     # Check if the request contains form data or JSON
     if request.content_type and 'multipart/form-data' in request.content_type:
         # Handle form data with files
@@ -88,7 +181,7 @@ def create_advertisement():
             user_id=current_user_id,
             price=price,
             phone_number=phone_number,
-            images=json.dumps(image_paths) if image_paths else None
+            ad_images=build_ad_images(image_paths)
         )
     else:
         # Handle JSON data (no files)
@@ -106,6 +199,12 @@ def create_advertisement():
         
         if 'phone_number' not in data or not data['phone_number'].strip():
             return jsonify({"error": "Advertisement phone number is required"}), 400
+        
+        image_paths = uploaded_image_paths(data.get('images') or [])
+        if image_paths is None or not uploaded_by(image_paths, current_user_id):
+            return jsonify({"error": "images must be paths of image files you uploaded"}), 400
+        # Let go of the connection the check used before the images are processed
+        db.session.close()
 
         # Create new advertisement
         new_ad = Advertisement(
@@ -114,43 +213,39 @@ def create_advertisement():
             user_id=current_user_id,
             price=data.get('price'),
             phone_number=data.get('phone_number'),
-            images=json.dumps(data.get('images', [])) if data.get('images') else None
+            ad_images=build_ad_images(image_paths)
         )
     
     db.session.add(new_ad)
-    db.session.commit()
+    db.session.flush()
     
-    # Get image URLs for response
-    image_urls = []
-    if new_ad.images:
-        try:
-            image_paths = json.loads(new_ad.images)
-            image_urls = get_image_urls(image_paths)
-        except json.JSONDecodeError:
-            pass
+    # Serialized before the commit, which expires the new rows
+    advertisement = {
+        "id": new_ad.id,
+        "title": new_ad.title,
+        "content": new_ad.content,
+        "created_at": new_ad.created_at.isoformat(),
+        "images": [image.url for image in new_ad.ad_images],
+        "image_variants": image_variant_urls(new_ad),
+        "price": new_ad.price,
+        "phone_number": new_ad.phone_number,
+        "author": {
+            "id": user.id,
+            "username": user.username
+        }
+    }
+    db.session.commit()
     
     return jsonify({
         "message": "Advertisement created successfully",
-        "advertisement": {
-            "id": new_ad.id,
-            "title": new_ad.title,
-            "content": new_ad.content,
-            "created_at": new_ad.created_at.isoformat(),
-            "images": image_urls,
-            "price": new_ad.price,
-            "phone_number": new_ad.phone_number,
-            "author": {
-                "id": user.id,
-                "username": user.username
-            }
-        }
+        "advertisement": advertisement
     }), 201
 
 @advertisements_bp.route('/<int:ad_id>', methods=['DELETE'])
 @jwt_required()
 def delete_advertisement(ad_id):
     current_user_id = int(get_jwt_identity())
-    is_admin = User.query.get(current_user_id).is_admin
+    is_admin = get_jwt().get('is_admin', False)
     
     ad = Advertisement.query.get(ad_id)
     
@@ -176,6 +271,7 @@ def delete_advertisement(ad_id):
 
 @advertisements_bp.route('/<int:ad_id>', methods=['PUT'])
 @jwt_required()
+@write_limiter.limit('advertisements', 'writes')
 def update_advertisement(ad_id):
     current_user_id = int(get_jwt_identity())
     
@@ -200,6 +296,17 @@ def update_advertisement(ad_id):
         keep_existing_images = request.form.get('keepExistingImages') == 'true'
         price = request.form.get('price')
         phone_number = request.form.get('phone_number')
+        
+        new_images = None
+        if files:
+            # Save new uploaded files, numbered after the existing ones if those are kept
+            start_position = len(ad.ad_images) if keep_existing_images else 0
+            new_image_paths = save_multiple_files(files)
+            # Hold no connection while they are processed; the ad is re-attached after
+            db.session.close()
+            new_images = build_ad_images(new_image_paths, start_position=start_position)
+            db.session.add(ad)
+        
         # Update fields if provided
         if title and title.strip():
             ad.title = title
@@ -208,27 +315,29 @@ def update_advertisement(ad_id):
             ad.content = content
         
         # Handle images
-        if files:
-            # Save new uploaded files
-            new_image_paths = save_multiple_files(files)
-            
-            # If keeping existing images, merge with existing ones
-            if keep_existing_images and ad.images:
-                try:
-                    existing_paths = json.loads(ad.images)
-                    all_paths = existing_paths + new_image_paths
-                    ad.images = json.dumps(all_paths)
-                except json.JSONDecodeError:
-                    ad.images = json.dumps(new_image_paths)
+        if new_images is not None:
+            # If keeping existing images, append after the existing ones
+            if keep_existing_images:
+                ad.ad_images.extend(new_images)
             else:
-                ad.images = json.dumps(new_image_paths)
+                ad.ad_images = new_images
         elif not keep_existing_images:
             # If not keeping existing images and no new ones uploaded, clear images
-            ad.images = None
+            ad.ad_images = []
     else:
         # Handle JSON data
         data = request.get_json()
         
+        new_images = None
+        if 'images' in data:
+            image_paths = uploaded_image_paths(data['images'] or [])
+            if image_paths is None or not uploaded_by(image_paths, current_user_id):
+                return jsonify({"error": "images must be paths of image files you uploaded"}), 400
+            # Hold no connection while they are processed; the ad is re-attached after
+            db.session.close()
+            new_images = build_ad_images(image_paths)
+            db.session.add(ad)
+        
         # Update fields if provided
         if 'title' in data and data['title'].strip():
             ad.title = data['title']
@@ -237,27 +346,19 @@ def update_advertisement(ad_id):
             ad.content = data['content']
         
         # Update images if provided
-        if 'images' in data:
-            ad.images = json.dumps(data['images']) if data['images'] else None
+        if new_images is not None:
+            ad.ad_images = new_images
     
     db.session.commit()
     
-    # Get image URLs for response
-    image_urls = []
-    if ad.images:
-        try:
-            image_paths = json.loads(ad.images)
-            image_urls = get_image_urls(image_paths)
-        except json.JSONDecodeError:
-            pass
-    
     return jsonify({
         "message": "Advertisement updated successfully",
         "advertisement": {
             "id": ad.id,
             "title": ad.title,
             "content": ad.content,
-            "images": image_urls,
+            "images": [image.url for image in ad.ad_images],
+            "image_variants": image_variant_urls(ad),
             "created_at": ad.created_at.isoformat(),
             "price": ad.price,
             "phone_number": ad.phone_number,
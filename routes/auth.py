@@ -1,15 +1,28 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from models import db, User
-import bcrypt
-from socket_instance import socketio
+from passwords import hash_password, check_password, client_network, ip_attempts, username_failures
+from socket_instance import ADMIN_ROOM
+from change_log import record_change
 
 auth_bp = Blueprint('auth', __name__)
 
+def throttled(*checks):
+    """Return a 429 response if any (limiter, key) pair is over its limit, else None"""
+    retry_after = max(limiter.retry_after(key) for limiter, key in checks)
+    if retry_after:
+        return jsonify({"error": "Too many attempts, please try again later"}), 429, {'Retry-After': str(retry_after)}
+    return None
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     
+    throttle_response = throttled((ip_attempts, request.remote_addr))
+    if throttle_response:
+        return throttle_response
+    ip_attempts.hit(request.remote_addr)
+    
     # Check if required fields are provided
     required_fields = ['username', 'password', 'full_name', 'building_number', 'apartment_number']
     for field in required_fields:
@@ -20,13 +33,16 @@ def register():
     if User.query.filter_by(username=data['username']).first():
         return jsonify({"error": "Username already exists"}), 400
     
+    # Hold no connection while bcrypt runs, which may queue behind other hashes
+    db.session.close()
+    
     # Hash the password
-    hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
+    hashed_password = hash_password(data['password'])
     
     # Create new user
     new_user = User(
         username=data['username'],
-        password=hashed_password.decode('utf-8'),
+        password=hashed_password,
         full_name=data['full_name'],
         building_number=data['building_number'],
         apartment_number=data['apartment_number'],
@@ -35,7 +51,7 @@ def register():
     )
     
     db.session.add(new_user)
-    db.session.commit()
+    db.session.flush()
     
     # Prepare user data for WebSocket event
     user_data = {
@@ -47,8 +63,9 @@ def register():
         "created_at": new_user.created_at.isoformat()
     }
     
-    # Emit WebSocket event for new user registration
-    socketio.emit('user_registered', user_data)
+    # Notify the admins of the new registration awaiting approval once committed
+    record_change('user_registered', user_data, to=ADMIN_ROOM, entity='user', entity_id=new_user.id)
+    db.session.commit()
     
     return jsonify({
         "message": "Registration successful. Your account is pending approval by an admin.",
@@ -62,13 +79,23 @@ def login():
     if 'username' not in data or 'password' not in data:
         return jsonify({"error": "Username and password are required"}), 400
     
+    # Throttle before any bcrypt work so a credential-stuffing burst stays cheap
+    failures_key = (data['username'], client_network(request.remote_addr))
+    throttle_response = throttled((ip_attempts, request.remote_addr), (username_failures, failures_key))
+    if throttle_response:
+        return throttle_response
+    ip_attempts.hit(request.remote_addr)
+    
     user = User.query.filter_by(username=data['username']).first()
+    # Hold no connection while bcrypt runs, which may queue behind other hashes;
+    # the user's columns stay loaded
+    db.session.close()
     
-    if not user:
+    if not user or not check_password(data['password'], user.password):
+        username_failures.hit(failures_key)
         return jsonify({"error": "Invalid username or password"}), 401
     
-    if not bcrypt.checkpw(data['password'].encode('utf-8'), user.password.encode('utf-8')):
-        return jsonify({"error": "Invalid username or password"}), 401
+    username_failures.reset(failures_key)
     
     if user.is_banned:
         return jsonify({"error": "Your account has been banned"}), 403
@@ -0,0 +1,33 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from change_log import changes_since, latest_seq, serialize_change, visible_rooms
+from user_cache import get_current_user_state
+from utils import get_pagination_args
+
+changes_bp = Blueprint('changes', __name__)
+
+@changes_bp.route('', methods=['GET'])
+@jwt_required()
+def get_changes():
+    user = get_current_user_state()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    
+    # Without ?since= only the current seq is returned, to start syncing from
+    since, limit = get_pagination_args('since')
+    if since is None:
+        return jsonify({"changes": [], "seq": latest_seq(), "has_more": False}), 200
+    
+    changes, next_since, has_more, gone = changes_since(since, visible_rooms(user), limit)
+    
+    if gone:
+        return jsonify({
+            "error": "Changes since this sequence number are no longer available, reload",
+            "seq": next_since
+        }), 410
+    
+    return jsonify({
+        "changes": [serialize_change(change) for change in changes],
+        "seq": next_since,
+        "has_more": has_more
+    }), 200
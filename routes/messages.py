@@ -1,16 +1,109 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from models import db, User, Message
-from sqlalchemy import or_
-from socket_instance import socketio
+from models import db, User, Message, UnreadCount, Conversation
+from sqlalchemy import false, select, union_all
+from socket_instance import user_room, ADMIN_ROOM
+from change_log import record_change
+from rate_limits import write_limiter
+from user_cache import get_current_user_state
+from utils import filter_before, get_pagination_args, keyset_page, pagination_headers
 
 messages_bp = Blueprint('messages', __name__)
 
+def serialize_user(user):
+    return {
+        "id": user.id,
+        "username": user.username,
+        "is_admin": user.is_admin
+    }
+
+def serialize_message(message, users):
+    """Serialize a message, resolving sender/recipient from a preloaded {id: User} map"""
+    if message.is_deleted:
+        if message.deletion_type == 'admin':
+            content = "This message was deleted by an admin"
+        else:  # user deleted
+            content = "This message was deleted"
+    else:
+        content = message.content
+    return {
+        "id": message.id,
+        "content": content,
+        "created_at": message.created_at.isoformat(),
+        "is_read": message.is_read,
+        "is_deleted": message.is_deleted,
+        "deletion_type": message.deletion_type if message.is_deleted else None,
+        "sender": serialize_user(users[message.sender_id]),
+        "recipient": serialize_user(users[message.recipient_id])
+    }
+
+def load_users(messages):
+    """Batch-load every sender and recipient of a page of messages in one query"""
+    user_ids = {m.sender_id for m in messages} | {m.recipient_id for m in messages}
+    if not user_ids:
+        return {}
+    return {u.id: u for u in User.query.filter(User.id.in_(user_ids))}
+
+def newest_first(query):
+    return query.order_by(Message.created_at.desc(), Message.id.desc())
+
+def merged_sides(sides, before, limit):
+    """Newest-first query of the messages matching any of `sides` (lists of filters).
+
+    Each side is paged from its own (..., created_at) index and reads at most
+    `limit` rows, so only those few are merged and sorted, however many
+    messages the users have.
+    """
+    side_ids = [
+        select(newest_first(filter_before(db.session.query(Message.id).filter(*side), Message, before))
+               .limit(limit).subquery().c.id)
+        for side in sides
+    ]
+    return newest_first(Message.query.filter(Message.id.in_(union_all(*side_ids))))
+
+def inbox_query(user_id, before, limit):
+    """Newest-first query of the newest `limit` messages the user sent or received"""
+    return merged_sides([
+        [Message.recipient_id == user_id],
+        # Messages to oneself are on the received side
+        [Message.sender_id == user_id, Message.recipient_id != user_id],
+    ], before, limit)
+
+def thread_query(user_id, other_id, before, limit):
+    """Newest-first query of the newest `limit` messages between two users"""
+    sides = [[Message.sender_id == user_id, Message.recipient_id == other_id]]
+    if other_id != user_id:
+        sides.append([Message.sender_id == other_id, Message.recipient_id == user_id])
+    return merged_sides(sides, before, limit)
+
+def conversations_query(user_id, before=None):
+    """(other user id, newest message id) of each of the user's conversations, most recent first.
+
+    The cursor is the id of that newest message.
+    """
+    query = db.session.query(Conversation.other_id, Conversation.last_message_id.label('id')).filter(
+        Conversation.user_id == user_id
+    )
+    if before is not None:
+        query = query.filter(Conversation.last_message_id < before)
+    return query.order_by(Conversation.last_message_id.desc())
+
+def unread_counts(user_id):
+    """{sender id: unread message count} for the user, read from the trigger-maintained counters"""
+    rows = db.session.query(UnreadCount.sender_id, UnreadCount.count).filter(
+        UnreadCount.user_id == user_id, UnreadCount.count > 0
+    )
+    return dict(rows.all())
+
 @messages_bp.route('/admin', methods=['POST'])
 @jwt_required()
+@write_limiter.limit('messages', 'writes')
 def message_admin():
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = get_current_user_state()
+    
+    if not user:
+        return jsonify({"error": "User not found"}), 404
     
     if user.is_banned:
         return jsonify({"error": "You are banned and cannot send messages"}), 403
@@ -33,7 +126,7 @@ def message_admin():
     )
     
     db.session.add(new_message)
-    db.session.commit()
+    db.session.flush()
     
     # Prepare message data for real-time update
     message_data = {
@@ -53,59 +146,73 @@ def message_admin():
         }
     }
     
-    # Emit the new message to all connected clients
-    socketio.emit('message_update', message_data)
+    # Deliver the new message to the sender's devices and to the admins once committed
+    record_change('message_update', message_data, to=[user_room(user.id), ADMIN_ROOM],
+                  entity='message', entity_id=new_message.id)
+    db.session.commit()
     
+    # From message_data: the committed message is expired, and reading it would reload it
     return jsonify({
         "message": "Message sent to admin successfully",
-        "message_id": new_message.id
+        "message_id": message_data["id"]
     }), 201
 
 @messages_bp.route('', methods=['GET'])
 @jwt_required()
 def get_messages():
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    before, limit = get_pagination_args()
+    
+    # Messages where the current user is either the sender or recipient, newest first
+    messages, next_before = keyset_page(inbox_query(current_user_id, before, limit + 1), limit)
+    
+    users = load_users(messages)
+    result = [serialize_message(message, users) for message in messages]
+    
+    return jsonify(result), 200, pagination_headers(next_before)
+
+@messages_bp.route('/conversations', methods=['GET'])
+@jwt_required()
+def get_conversations():
+    current_user_id = int(get_jwt_identity())
+    before, limit = get_pagination_args()
     
-    # Get all messages where the current user is either the sender or recipient
-    messages = Message.query.filter(
-        or_(
-            Message.sender_id == current_user_id,
-            Message.recipient_id == current_user_id
-        )
-    ).order_by(Message.created_at.asc()).all()
+    # One row per counterpart, ordered by the newest message exchanged with them
+    threads, next_before = keyset_page(conversations_query(current_user_id, before), limit)
+    
+    last_messages = {}
+    if threads:
+        last_messages = {
+            m.id: m for m in Message.query.filter(Message.id.in_([t.id for t in threads]))
+        }
+    users = load_users(last_messages.values())
+    unread = unread_counts(current_user_id) if threads else {}
     
     result = []
-    for message in messages:
-        sender = User.query.get(message.sender_id)
-        recipient = User.query.get(message.recipient_id)
-        if message.is_deleted:
-            if message.deletion_type == 'admin':
-                content = "This message was deleted by an admin"
-            else:  # user deleted
-                content = "This message was deleted"
-        else:
-            content = message.content
+    for thread in threads:
         result.append({
-            "id": message.id,
-            "content": content,
-            "created_at": message.created_at.isoformat(),
-            "is_read": message.is_read,
-            "is_deleted": message.is_deleted,
-            "deletion_type": message.deletion_type if message.is_deleted else None,
-            "sender": {
-                "id": sender.id,
-                "username": sender.username,
-                "is_admin": sender.is_admin
-            },
-            "recipient": {
-                "id": recipient.id,
-                "username": recipient.username,
-                "is_admin": recipient.is_admin
-            }
+            "user": serialize_user(users[thread.other_id]),
+            "last_message": serialize_message(last_messages[thread.id], users),
+            "unread_count": unread.get(thread.other_id, 0)
         })
     
-    return jsonify(result), 200
+    return jsonify(result), 200, pagination_headers(next_before)
+
+@messages_bp.route('/conversations/<int:user_id>', methods=['GET'])
+@jwt_required()
+def get_conversation(user_id):
+    current_user_id = int(get_jwt_identity())
+    before, limit = get_pagination_args()
+    
+    users = {u.id: u for u in User.query.filter(User.id.in_({current_user_id, user_id}))}
+    if user_id not in users:
+        return jsonify({"error": "User not found"}), 404
+    
+    messages, next_before = keyset_page(thread_query(current_user_id, user_id, before, limit + 1), limit)
+    
+    result = [serialize_message(message, users) for message in messages]
+    
+    return jsonify(result), 200, pagination_headers(next_before)
 
 @messages_bp.route('/<int:message_id>/read', methods=['POST'])
 @jwt_required()
@@ -126,11 +233,55 @@ def mark_as_read(message_id):
     
     return jsonify({"message": "Message marked as read"}), 200
 
+@messages_bp.route('/unread', methods=['GET'])
+@jwt_required()
+def get_unread():
+    current_user_id = int(get_jwt_identity())
+    
+    counts = unread_counts(current_user_id)
+    
+    return jsonify({
+        "total": sum(counts.values()),
+        "conversations": [{"user_id": sender_id, "count": count} for sender_id, count in counts.items()]
+    }), 200
+
+@messages_bp.route('/conversations/<int:user_id>/read', methods=['POST'])
+@jwt_required()
+def mark_conversation_read(user_id):
+    current_user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    
+    up_to_id = data.get('up_to_id')
+    if up_to_id is not None and not isinstance(up_to_id, int):
+        return jsonify({"error": "up_to_id must be a message id"}), 400
+    
+    # A single UPDATE over the unread messages from user_id, up to and including up_to_id;
+    # the literal `is_read = 0` lets SQLite use the partial ix_message_unread index
+    query = Message.query.filter(
+        Message.recipient_id == current_user_id,
+        Message.sender_id == user_id,
+        Message.is_read == false()
+    )
+    if up_to_id is not None:
+        query = query.filter(Message.id <= up_to_id)
+    marked = query.update({Message.is_read: True}, synchronize_session=False)
+    
+    # The counters were updated by triggers in this transaction
+    counts = unread_counts(current_user_id)
+    unread = {"total": sum(counts.values()), "user_id": user_id, "count": counts.get(user_id, 0)}
+    
+    # Keep the badge in step on the user's other devices
+    record_change('unread_update', unread, to=user_room(current_user_id), entity='unread', entity_id=user_id)
+    db.session.commit()
+    
+    return jsonify({"marked": marked, "unread": unread}), 200
+
 @messages_bp.route('/reply/<int:user_id>', methods=['POST'])
 @jwt_required()
+@write_limiter.limit('messages', 'writes')
 def reply_to_user(user_id):
     current_user_id = int(get_jwt_identity())
-    current_user = User.query.get(current_user_id)
+    current_user = get_current_user_state()
     
     # Only admins can reply to any user
     if not current_user.is_admin:
@@ -153,7 +304,7 @@ def reply_to_user(user_id):
     )
     
     db.session.add(new_message)
-    db.session.commit()
+    db.session.flush()
     
     # Prepare message data for real-time update
     message_data = {
@@ -173,12 +324,15 @@ def reply_to_user(user_id):
         }
     }
     
-    # Emit the new message to all connected clients
-    socketio.emit('message_update', message_data)
+    # Deliver the reply to both sides of the conversation once committed
+    record_change('message_update', message_data, to=[user_room(current_user.id), user_room(recipient.id)],
+                  entity='message', entity_id=new_message.id)
+    db.session.commit()
     
+    # From message_data: the committed rows are expired, and reading them would reload them
     return jsonify({
-        "message": f"Reply sent to {recipient.username} successfully",
-        "message_id": new_message.id
+        "message": f"Reply sent to {message_data['recipient']['username']} successfully",
+        "message_id": message_data["id"]
     }), 201
 
 @messages_bp.route('/<int:sender_id>/<int:recipient_id>/<int:message_id>', methods=['DELETE'])
@@ -191,7 +345,7 @@ def delete_message(sender_id, recipient_id, message_id):
         claims = get_jwt()
         is_admin = claims.get('is_admin', False)
         
-        user = User.query.get(current_user_id)
+        user = get_current_user_state()
         if not user:
             return jsonify({"error": "User not found"}), 404
     except Exception as e:
@@ -215,6 +369,10 @@ def delete_message(sender_id, recipient_id, message_id):
     else:
         message.deletion_type = "admin_deleted"
     
+    # Log a tombstone for both sides of the conversation, emitted once committed
+    record_change('message_update', serialize_message(message, load_users([message])),
+                  to=[user_room(message.sender_id), user_room(message.recipient_id)],
+                  entity='message', entity_id=message.id, deleted=True)
     db.session.commit()
     
     return jsonify({"message": "Message deleted successfully"}), 200
\ No newline at end of file
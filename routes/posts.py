@@ -1,17 +1,68 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models import db, Post, User
-from socket_instance import socketio
+from response_cache import VersionedCache
+from change_log import record_change
+from rate_limits import write_limiter
+from sqlalchemy.orm import joinedload
+from user_cache import get_current_user_state, user_cache
+from utils import filter_before, get_pagination_args, keyset_page, pagination_headers
 
 posts_bp = Blueprint('posts', __name__)
 
+# Rendered feed pages, keyed by (before, limit)
+feed_cache = VersionedCache('posts')
+
+def feed_query(before=None):
+    """Newest-first feed query, with authors joined into the same statement"""
+    query = Post.query.options(joinedload(Post.author)).order_by(
+        Post.created_at.desc(), Post.id.desc()
+    )
+    return filter_before(query, Post, before)
+
+def serialize_post(post, author):
+    """Serialize a post as the feed shows it; `author` is a User or UserState, or None"""
+    # Determine the content based on deletion status and type
+    content = post.content
+    if post.is_deleted:
+        if post.deletion_type == 'admin':
+            content = "This message was deleted by an admin"
+        else:  # user deleted
+            content = "This message was deleted"
+    
+    return {
+        "id": post.id,
+        "content": content,
+        "created_at": post.created_at.isoformat(),
+        "is_deleted": post.is_deleted,
+        "deletion_type": post.deletion_type if post.is_deleted else None,
+        "author": {
+            "id": author.id,
+            "username": author.username,
+            "is_banned": author.is_banned
+        } if author and not author.is_banned else {
+            "id": None,
+            "username": "Deleted User",
+            "is_banned": True
+        }
+    }
+
+def build_feed_page(before, limit):
+    """(posts, headers) for one page of the feed"""
+    # Authors are joined into the same statement so a page costs one query
+    posts, next_before = keyset_page(feed_query(before), limit)
+    
+    result = [serialize_post(post, post.author) for post in posts]
+    
+    return result, pagination_headers(next_before)
+
 @posts_bp.route('', methods=['GET'])
 @jwt_required()
 def get_posts():
     try:
         # Get user ID from JWT identity (now a string)
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user_state()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -21,46 +72,17 @@ def get_posts():
     if not user.is_approved and not user.is_admin:
         return jsonify({"error": "You need to be approved to view posts"}), 403
     
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    
-    result = []
-    for post in posts:
-        author = User.query.get(post.user_id)
-        # Determine the content based on deletion status and type
-        content = post.content
-        if post.is_deleted:
-            if post.deletion_type == 'admin':
-                content = "This message was deleted by an admin"
-            else:  # user deleted
-                content = "This message was deleted"
-                
-        post_data = {
-            "id": post.id,
-            "content": content,
-            "created_at": post.created_at.isoformat(),
-            "is_deleted": post.is_deleted,
-            "deletion_type": post.deletion_type if post.is_deleted else None,
-            "author": {
-                "id": author.id,
-                "username": author.username,
-                "is_banned": author.is_banned
-            } if author and not author.is_banned else {
-                "id": None,
-                "username": "Deleted User",
-                "is_banned": True
-            }
-        }
-        result.append(post_data)
-    
-    return jsonify(result), 200
+    before, limit = get_pagination_args()
+    return feed_cache.response((before, limit), lambda: build_feed_page(before, limit))
 
 @posts_bp.route('', methods=['POST'])
 @jwt_required()
+@write_limiter.limit('posts', 'writes')
 def create_post():
     try:
         # Get user ID from JWT identity (now a string)
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user_state()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -84,7 +106,7 @@ def create_post():
     )
     
     db.session.add(new_post)
-    db.session.commit()
+    db.session.flush()
     
     # Prepare post data for real-time update
     post_data = {
@@ -97,20 +119,14 @@ def create_post():
         }
     }
     
-    # Emit the new post to all connected clients
-    socketio.emit('post_update', post_data)
+    # Log the new post; it is emitted to all connected clients once committed
+    record_change('post_update', post_data, entity='post', entity_id=new_post.id)
+    db.session.commit()
     
+    # The response reuses post_data: the committed post is expired, and reading it would reload it
     return jsonify({
         "message": "Post created successfully",
-        "post": {
-            "id": new_post.id,
-            "content": new_post.content,
-            "created_at": new_post.created_at.isoformat(),
-            "author": {
-                "id": user.id,
-                "username": user.username
-            }
-        }
+        "post": post_data
     }), 201
 
 @posts_bp.route('/<int:post_id>', methods=['DELETE'])
@@ -123,7 +139,7 @@ def delete_post(post_id):
         claims = get_jwt()
         is_admin = claims.get('is_admin', False)
         
-        user = User.query.get(current_user_id)
+        user = get_current_user_state()
         if not user:
             return jsonify({"error": "User not found"}), 404
     except Exception as e:
@@ -142,58 +158,15 @@ def delete_post(post_id):
     post.is_deleted = True
     
     # If admin is deleting someone else's post
-    if is_admin and post.user_id != int(current_user_id):
-        post.deletion_type = 'admin'
-        db.session.commit()
-        
-        # Get author info for the response
-        author = User.query.get(post.user_id)
-        
-        # Emit socket event for post update with complete post data
-        post_data = {
-            "id": post.id,
-            "content": "This message was deleted by an admin",
-            "created_at": post.created_at.isoformat(),
-            "is_deleted": True,
-            "deletion_type": 'admin',
-            "author": {
-                "id": author.id,
-                "username": author.username,
-                "is_banned": author.is_banned
-            } if author and not author.is_banned else {
-                "id": None,
-                "username": "Deleted User",
-                "is_banned": True
-            }
-        }
-        socketio.emit('post_update', post_data)
-        
-        return jsonify({"message": "Post marked as deleted by admin"}), 200
+    deleted_by_admin = is_admin and post.user_id != int(current_user_id)
+    post.deletion_type = 'admin' if deleted_by_admin else 'user'
     
-    # If it's the author deleting their own post
-    post.deletion_type = 'user'
+    # Log a tombstone with the post as the feed now shows it, emitted once committed
+    record_change('post_update', serialize_post(post, user_cache.get(post.user_id)),
+                  entity='post', entity_id=post.id, deleted=True)
     db.session.commit()
     
-    # Get author info for the response
-    author = User.query.get(post.user_id)
-    
-    # Emit socket event for post update with complete post data
-    post_data = {
-        "id": post.id,
-        "content": "This message was deleted",
-        "created_at": post.created_at.isoformat(),
-        "is_deleted": True,
-        "deletion_type": 'user',
-        "author": {
-            "id": author.id,
-            "username": author.username,
-            "is_banned": author.is_banned
-        } if author and not author.is_banned else {
-            "id": None,
-            "username": "Deleted User",
-            "is_banned": True
-        }
-    }
-    socketio.emit('post_update', post_data)
+    if deleted_by_admin:
+        return jsonify({"message": "Post marked as deleted by admin"}), 200
     
     return jsonify({"message": "Post deleted successfully"}), 200
@@ -2,37 +2,51 @@ from unicodedata import category
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models import PublicServiceCategory, db, User, PublicService
+from response_cache import VersionedCache
 
 public_services_bp = Blueprint('public_services', __name__)
 
+# Rendered catalog, rebuilt only after a service or category changes (the
+# cache_version triggers bump it for every worker)
+catalog_cache = VersionedCache('public_services', max_entries=1)
+
+def catalog_query():
+    return db.session.query(PublicServiceCategory, PublicService).outerjoin(
+        PublicService, PublicService.category == PublicServiceCategory.id
+    ).order_by(PublicServiceCategory.id, PublicService.id)
+
+def build_catalog():
+    """Build the categories-with-services catalog from a single joined query"""
+    rows = catalog_query().all()
+    
+    result = []
+    categories = {}
+    for category, service in rows:
+        if category.id not in categories:
+            categories[category.id] = {
+                "name": category.name,
+                "description": category.description,
+                "id":category.id,
+                "services": []
+            }
+            result.append(categories[category.id])
+        if service is not None:
+            categories[category.id]["services"].append({
+                "id": service.id,
+                "name": service.name,
+                "phone_number": service.phone_number,
+                "category":service.category,
+                "status": service.status,
+                "created_at": service.created_at.isoformat(),
+                "updated_at": service.updated_at.isoformat()
+            })
+    
+    return result
+
 @public_services_bp.route('', methods=['GET'])
 @jwt_required()
 def get_public_services():
-    public_service_categories = PublicServiceCategory.query.all()
-    
-    result = []
-    for category in public_service_categories:
-        services = PublicService.query.filter_by(category=category.id).all()
-        result.append({
-            "name": category.name,
-            "description": category.description,
-            "id":category.id,
-            "services": [
-                {
-                    "id": service.id,
-                    "name": service.name,
-                    "phone_number": service.phone_number,
-                    "category":service.category,
-                    "status": service.status,
-                    "created_at": service.created_at.isoformat(),
-                    "updated_at": service.updated_at.isoformat()
-                }
-                for service in services
-            ]
-        })
-   
-    
-    return jsonify(result), 200
+    return catalog_cache.response((), lambda: (build_catalog(), None))
 
 @public_services_bp.route('', methods=['POST'])
 @jwt_required()
@@ -228,7 +242,7 @@ def update_public_service(service_id):
         "service": {
             "id": service.id,
             "name": service.name,
-            "category": category.id,
+            "category": service.category,
             "phone_number": service.phone_number,
             "status": service.status,
             "created_at": service.created_at.isoformat(),
@@ -0,0 +1,92 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from sqlalchemy import text
+from models import db
+from user_cache import get_current_user_state
+from utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+import re
+
+search_bp = Blueprint('search', __name__)
+
+MAX_SEARCH_TERMS = 10
+
+# post_fts and advertisement_fts only hold live rows by authors who aren't
+# banned (see migrations.py), so matches need no further filtering.
+# Ad titles weigh more than their descriptions in the ranking.
+POST_MATCHES = """
+    SELECT 'post' AS type, post.id AS id, NULL AS title, post.content AS content,
+           post.created_at AS created_at, user.id AS author_id, user.username AS author_username,
+           bm25(post_fts) AS rank
+    FROM post_fts
+    JOIN post ON post.id = post_fts.rowid
+    JOIN user ON user.id = post.user_id
+    WHERE post_fts MATCH :query
+"""
+ADVERTISEMENT_MATCHES = """
+    SELECT 'advertisement' AS type, advertisement.id AS id, advertisement.title AS title,
+           advertisement.content AS content, advertisement.created_at AS created_at,
+           user.id AS author_id, user.username AS author_username,
+           bm25(advertisement_fts, 4.0, 1.0) AS rank
+    FROM advertisement_fts
+    JOIN advertisement ON advertisement.id = advertisement_fts.rowid
+    JOIN user ON user.id = advertisement.user_id
+    WHERE advertisement_fts MATCH :query
+"""
+SEARCH_TYPES = {
+    'posts': [POST_MATCHES],
+    'advertisements': [ADVERTISEMENT_MATCHES],
+    'all': [POST_MATCHES, ADVERTISEMENT_MATCHES],
+}
+
+def fts_query(q):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix"""
+    terms = re.findall(r'\w+', q)[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+@search_bp.route('', methods=['GET'])
+@jwt_required()
+def search():
+    user = get_current_user_state()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    if not user.is_approved and not user.is_admin:
+        return jsonify({"error": "You need to be approved to search"}), 403
+
+    query = fts_query(request.args.get('q', ''))
+    if query is None:
+        return jsonify({"error": "Search query is required"}), 400
+
+    search_type = request.args.get('type', 'all')
+    if search_type not in SEARCH_TYPES:
+        return jsonify({"error": "type must be one of: posts, advertisements, all"}), 400
+
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    # One extra row tells whether another page exists
+    statement = text(
+        ' UNION ALL '.join(SEARCH_TYPES[search_type])
+        + ' ORDER BY rank, created_at DESC LIMIT :limit OFFSET :offset'
+    ).columns(created_at=db.DateTime)
+    rows = db.session.execute(
+        statement, {'query': query, 'limit': limit + 1, 'offset': offset}
+    ).mappings().all()
+
+    result = []
+    for row in rows[:limit]:
+        result.append({
+            "type": row['type'],
+            "id": row['id'],
+            "title": row['title'],
+            "content": row['content'],
+            "created_at": row['created_at'].isoformat() if row['created_at'] else None,
+            "author": {
+                "id": row['author_id'],
+                "username": row['author_username']
+            }
+        })
+
+    headers = {'X-Next-Offset': str(offset + limit)} if len(rows) > limit else {}
+    return jsonify(result), 200, headers
@@ -0,0 +1,270 @@
+"""Synthetic data for load testing, at production scale or beyond.
+
+    flask seed --users 20000 --posts-per-user 40 --messages-per-user 8 --random-seed 42
+
+Adds residents spread over buildings and apartments, their posts, messages
+with the admins, advertisements with images, and public services, on top
+of whatever the database already holds. The same options and random seed
+give the same rows from run to run, with timestamps ending at the time of
+seeding.
+
+Rows are inserted with executemany, one transaction per table. The
+per-row AFTER INSERT triggers that maintain derived data (the search
+index, unread and user status counters, cache versions) are dropped for
+that transaction. Their work is then done once, set-based, for all the new
+rows, and the triggers are restored before the commit. The drops are part
+of the transaction too, so a failure rolls them back along with the rows.
+
+Every seeded user shares one bcrypt hash of --password: hashing a million
+passwords would take hours.
+"""
+import itertools
+import random
+from datetime import datetime, timedelta
+import bcrypt
+from sqlalchemy import text
+from models import db
+from migrations import MESSAGE_SIDES, VISIBLE_ROW, UNREAD_MESSAGE, USER_FLAGS
+from utils import get_image_urls
+
+BATCH_SIZE = 50000
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # as SQLAlchemy stores DateTime in SQLite
+TEXT_POOL_SIZE = 4096
+
+FIRST_NAMES = ('Ahmed', 'Mohamed', 'Mahmoud', 'Omar', 'Youssef', 'Mostafa', 'Karim', 'Hassan', 'Tarek', 'Amr',
+               'Fatma', 'Mariam', 'Nour', 'Salma', 'Aya', 'Hana', 'Yasmin', 'Laila', 'Dina', 'Rana')
+LAST_NAMES = ('Hassan', 'Ibrahim', 'Mahmoud', 'Ali', 'Saleh', 'Fawzy', 'Nasser', 'Kamal', 'Adel', 'Fathy',
+              'Samir', 'Mansour', 'Shafik', 'Ezzat', 'Gamal')
+WORDS = (
+    'the building water meter parking elevator gate keys lost found cat dog sale apartment floor roof garden '
+    'maintenance tomorrow morning evening please contact neighbors meeting security guard electricity bill '
+    'internet noise cleaning garbage delivery package furniture repair plumber painter fee monthly '
+    'صيانة المصعد العمارة الدور شقة للبيع للايجار مفتاح مياه كهرباء بكرة الصبح جيران حارس اجتماع فاتورة '
+    'الجراج السطح نظافة زبالة سباك نقاش عفش'
+).split()
+PUBLIC_SERVICE_CATEGORIES = (
+    ('Maintenance', 'Plumbers, electricians and painters'),
+    ('Health', 'Pharmacies, clinics and labs'),
+    ('Food', 'Restaurants, bakeries and supermarkets'),
+    ('Transport', 'Taxis, movers and car services'),
+    ('Education', 'Schools, nurseries and tutors'),
+    ('Cleaning', 'Home cleaning and laundry'),
+    ('Emergency', 'Police, ambulance and fire brigade'),
+    ('Other', 'Everything else'),
+)
+SERVICE_STATUSES = ('Active', 'Active', 'Active', 'Unavailable')
+# Share of the messages written by the resident rather than the admin
+TO_ADMIN_FRACTION = 0.6
+
+# Per table, the AFTER INSERT triggers dropped while its rows go in, and the
+# statements that do their work for every row with id > :after afterwards
+CATCH_UP = {
+    'user': (['user_status_insert'], [
+        'INSERT INTO user_status_count (is_admin, is_approved, is_banned, count) '
+        f"SELECT {USER_FLAGS.format(row='user')}, count(*) FROM user WHERE id > :after GROUP BY 1, 2, 3 "
+        'ON CONFLICT (is_admin, is_approved, is_banned) DO UPDATE SET count = count + excluded.count',
+    ]),
+    'post': (['post_fts_insert', 'post_insert_bumps_posts'], [
+        'INSERT INTO post_fts (rowid, content) SELECT id, content FROM post '
+        f"WHERE id > :after AND {VISIBLE_ROW.format(row='post')}",
+        "UPDATE cache_version SET version = version + 1 WHERE name = 'posts'",
+    ]),
+    'message': (['message_unread_insert', 'message_conversation_insert'], [
+        'INSERT INTO unread_count (user_id, sender_id, count) '
+        f"SELECT recipient_id, sender_id, count(*) FROM message WHERE id > :after AND {UNREAD_MESSAGE.format(row='message')} "
+        'GROUP BY recipient_id, sender_id '
+        'ON CONFLICT (user_id, sender_id) DO UPDATE SET count = count + excluded.count',
+        'INSERT INTO conversation (user_id, other_id, last_message_id) '
+        f"SELECT user_id, other_id, max(id) FROM ({MESSAGE_SIDES.format(where=' WHERE id > :after')}) "
+        'GROUP BY user_id, other_id '
+        'ON CONFLICT (user_id, other_id) DO UPDATE SET last_message_id = max(last_message_id, excluded.last_message_id)',
+    ]),
+    'advertisement': (['advertisement_fts_insert', 'advertisement_insert_bumps_advertisements'], [
+        'INSERT INTO advertisement_fts (rowid, title, content) SELECT id, title, content FROM advertisement '
+        f"WHERE id > :after AND {VISIBLE_ROW.format(row='advertisement')}",
+        "UPDATE cache_version SET version = version + 1 WHERE name = 'advertisements'",
+    ]),
+    'advertisement_image': (['advertisement_image_insert_bumps_advertisements'], [
+        "UPDATE cache_version SET version = version + 1 WHERE name = 'advertisements'",
+    ]),
+}
+
+
+def last_id(table):
+    return db.session.execute(text(f'SELECT coalesce(max(id), 0) FROM "{table}"')).scalar()
+
+
+def insert_rows(table, columns, rows):
+    """Insert the tuples from `rows` (with explicit ids) in one transaction; returns the row count"""
+    triggers, catch_up = CATCH_UP.get(table, ([], []))
+    connection = db.session.connection()
+    try:
+        # pysqlite only opens transactions for DML, so without an explicit BEGIN each
+        # DROP TRIGGER below would commit on its own, whatever happens to the rows
+        if not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        after = last_id(table)
+        saved = db.session.execute(
+            text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :table"),
+            {'table': table}
+        ).all()
+        saved = [sql for name, sql in saved if name in triggers]
+
+        for name in triggers:
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+        statement = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))})')
+        count = 0
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, BATCH_SIZE)):
+            connection.exec_driver_sql(statement, batch)
+            count += len(batch)
+        for sql in catch_up:
+            db.session.execute(text(sql), {'after': after})
+        for sql in saved:
+            connection.exec_driver_sql(sql)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
+
+
+def weighted_picker(rng, values, skew):
+    """Draws from `values`, the n-th (in a random order) weighted 1 / n ** skew; 0 is uniform"""
+    values = list(values)
+    rng.shuffle(values)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(values))))
+    return lambda: rng.choices(values, cum_weights=cum_weights)[0]
+
+
+def spread(start, span, count):
+    """`count` timestamps from `start` over `span`, oldest first, so ids follow created_at"""
+    step = span / max(count, 1)
+    return ((start + step * i).strftime(DATETIME_FORMAT) for i in range(count))
+
+
+def seed_database(users=20000, buildings=40, apartments=30, pending_fraction=0.02, banned_fraction=0.01,
+                  posts_per_user=40, author_skew=1.0, messages_per_user=8, read_fraction=0.8,
+                  ads_per_user=0.5, max_images=3, services_per_category=10, deleted_fraction=0.02,
+                  days=365, password='password123', random_seed=42):
+    """Insert the synthetic rows; returns the number added to each table.
+
+    Posts, messages and advertisements total the per-user rate times
+    `users`, with authors drawn so that the n-th most active resident
+    writes about 1 / n ** author_skew as much as the first. Of the
+    posts, messages and advertisements, `deleted_fraction` is soft-deleted.
+    """
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    span = now - start
+    pool = [' '.join(rng.choices(WORDS, k=rng.randint(3, 25))) for _ in range(TEXT_POOL_SIZE)]
+
+    def sentence():
+        return f'{pool[rng.randrange(TEXT_POOL_SIZE)]} {pool[rng.randrange(TEXT_POOL_SIZE)]}'
+
+    def phone_number():
+        return f'01{rng.choice("0125")}{rng.randrange(10 ** 8):08d}'
+
+    counts = {}
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    admins = db.session.execute(text('SELECT id FROM user WHERE is_admin = 1')).scalars().all()
+
+    # Users: an admin first when the database has none, for the messages to go to
+    first = last_id('user') + 1
+    if not admins:
+        admins = [first]
+    statuses = []
+
+    def user_rows():
+        for user_id, created_at in zip(range(first, first + users), spread(start, span, users)):
+            is_admin = user_id in admins
+            roll = rng.random()
+            is_approved = is_admin or roll >= pending_fraction
+            is_banned = not is_admin and is_approved and roll < pending_fraction + banned_fraction
+            statuses.append((user_id, is_admin, is_approved))
+            yield (user_id, f"{'admin' if is_admin else 'resident'}{user_id}", password_hash,
+                   f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                   str(rng.randint(1, buildings)), str(rng.randint(1, apartments)),
+                   is_admin, is_approved, is_banned, created_at)
+
+    counts['user'] = insert_rows('user', ('id', 'username', 'password', 'full_name', 'building_number',
+                                          'apartment_number', 'is_admin', 'is_approved', 'is_banned',
+                                          'created_at'), user_rows())
+    residents = [user_id for user_id, is_admin, is_approved in statuses if is_approved and not is_admin]
+    if not residents:
+        return counts
+    author = weighted_picker(rng, residents, author_skew)
+
+    def deletion():
+        deleted = rng.random() < deleted_fraction
+        return deleted, (rng.choice(('user', 'admin')) if deleted else None)
+
+    posts = round(users * posts_per_user)
+    first = last_id('post') + 1
+
+    def post_rows():
+        for post_id, created_at in zip(range(first, first + posts), spread(start, span, posts)):
+            yield (post_id, sentence(), author(), created_at, *deletion())
+
+    counts['post'] = insert_rows('post', ('id', 'content', 'user_id', 'created_at', 'is_deleted', 'deletion_type'),
+                                 post_rows())
+
+    messages = round(users * messages_per_user)
+    first = last_id('message') + 1
+
+    def message_rows():
+        for message_id, created_at in zip(range(first, first + messages), spread(start, span, messages)):
+            resident, admin = author(), rng.choice(admins)
+            sender, recipient = (resident, admin) if rng.random() < TO_ADMIN_FRACTION else (admin, resident)
+            yield (message_id, sentence(), sender, recipient, created_at, rng.random() < read_fraction,
+                   *deletion())
+
+    counts['message'] = insert_rows('message', ('id', 'content', 'sender_id', 'recipient_id', 'created_at',
+                                                'is_read', 'is_deleted', 'deletion_type'), message_rows())
+
+    advertisements = round(users * ads_per_user)
+    first = last_id('advertisement') + 1
+    images = []
+
+    def advertisement_rows():
+        for ad_id, created_at in zip(range(first, first + advertisements), spread(start, span, advertisements)):
+            images.extend((ad_id, position) for position in range(rng.randint(0, max_images)))
+            yield (ad_id, sentence()[:100], sentence(), author(), created_at, deletion()[0],
+                   round(rng.uniform(50, 50000), 2), phone_number())
+
+    counts['advertisement'] = insert_rows('advertisement', ('id', 'title', 'content', 'user_id', 'created_at',
+                                                            'is_deleted', 'price', 'phone_number'),
+                                          advertisement_rows())
+
+    first = last_id('advertisement_image') + 1
+
+    def image_rows():
+        for image_id, (ad_id, position) in enumerate(images, first):
+            path = f'uploads/seed_{ad_id}_{position}.jpg'
+            width = rng.choice((640, 1024, 1280, 1600))
+            yield (image_id, ad_id, position, path, get_image_urls([path])[0], width, width * 3 // 4,
+                   rng.randint(50000, 800000))
+
+    counts['advertisement_image'] = insert_rows('advertisement_image', ('id', 'advertisement_id', 'position', 'path',
+                                                                        'url', 'width', 'height', 'byte_size'),
+                                                image_rows())
+
+    first = last_id('public_service_category') + 1
+    now_text = now.strftime(DATETIME_FORMAT)
+    categories = [(category_id, name, description, now_text, now_text) for category_id, (name, description)
+                  in enumerate(PUBLIC_SERVICE_CATEGORIES, first)]
+    counts['public_service_category'] = insert_rows('public_service_category', ('id', 'name', 'description',
+                                                                                'created_at', 'updated_at'),
+                                                    categories)
+
+    first = last_id('public_service') + 1
+    services = ((category_id, name) for category_id, name, *_ in categories for _ in range(services_per_category))
+    counts['public_service'] = insert_rows('public_service', ('id', 'name', 'category', 'phone_number', 'status',
+                                                              'created_at', 'updated_at'), (
+        (service_id, f'{rng.choice(LAST_NAMES)} {name}', category_id, phone_number(), rng.choice(SERVICE_STATUSES),
+         now_text, now_text)
+        for service_id, (category_id, name) in enumerate(services, first)
+    ))
+    return counts
@@ -0,0 +1,101 @@
+"""Serve the API from one or more eventlet worker processes sharing a single port.
+
+    WEB_CONCURRENCY=4 python serve.py
+
+With more than one worker, Socket.IO emits are relayed between processes
+through SOCKETIO_MESSAGE_QUEUE (see socket_bus.py). When it is not set, a
+UNIX-socket broker is started alongside the workers. Clients must use the
+websocket transport in this mode, since long-polling requests would be
+spread across workers.
+
+Pending schema migrations are applied once before any worker starts.
+"""
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+
+def fork(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            target(*args)
+            code = 0
+        finally:
+            os._exit(code)
+    return pid
+
+
+def run_broker(path):
+    from socket_bus import UnixSocketBroker
+    UnixSocketBroker(path).serve_forever()
+
+
+def prepare_database():
+    # Apply pending migrations once, before any worker starts
+    from app import app
+    import migrations
+    with app.app_context():
+        migrations.upgrade()
+
+
+def run_worker(listener):
+    import eventlet
+    eventlet.monkey_patch()
+    from eventlet import wsgi
+    from app import app
+    wsgi.server(eventlet.greenio.GreenSocket(listener), app, log_output=False)
+
+
+def main():
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    port = int(os.environ.get('PORT', 5000))
+
+    if workers > 1 and not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        bus_path = os.path.join(tempfile.gettempdir(), f'forum-socketio-{port}.sock')
+        os.environ['SOCKETIO_MESSAGE_QUEUE'] = f'unix://{bus_path}'
+    queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or ''
+
+    _, status = os.waitpid(fork(prepare_database), 0)
+    if status != 0:
+        sys.exit('Failed to prepare the database')
+
+    children = []
+    if workers > 1 and queue.startswith('unix://'):
+        children.append(fork(run_broker, queue[len('unix://'):]))
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('0.0.0.0', port))
+    listener.listen(2048)
+
+    if workers == 1:
+        run_worker(listener)
+        return
+
+    children.extend(fork(run_worker, listener) for _ in range(workers))
+    print(f'Serving on port {port} with {workers} workers, Socket.IO bus {queue}')
+
+    def shutdown(code):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(code)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown(0))
+    signal.signal(signal.SIGINT, lambda signum, frame: shutdown(0))
+
+    # A dead worker or broker takes the whole service down so the platform restarts it cleanly
+    pid, _ = os.wait()
+    children.remove(pid)
+    print(f'Process {pid} exited, shutting down')
+    shutdown(1)
+
+
+if __name__ == '__main__':
+    main()
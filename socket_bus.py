@@ -0,0 +1,251 @@
+"""Cross-process Socket.IO broadcast backends for multi-worker deployments.
+
+SOCKETIO_MESSAGE_QUEUE selects how emits are relayed between workers:
+
+    redis://host:6379/0           socketio.RedisManager (needs the redis package)
+    unix:///tmp/forum-bus.sock    fan-out through the broker started by serve.py
+    sqlite:////tmp/forum-bus.db   a polled SQLite table, for tests and single-host setups
+
+Unset means a single process with no relaying, which is the default.
+"""
+import logging
+import os
+import pickle
+import queue
+import socket
+import socketserver
+import sqlite3
+import struct
+import threading
+import time
+from socketio import PubSubManager
+
+FRAME_HEADER = struct.Struct('>I')
+# First frame of a listening connection; pickled messages start with b'\x80'
+SUBSCRIBE = b'\x00subscribe'
+
+logger = logging.getLogger(__name__)
+
+
+def send_frame(sock, payload):
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Bus connection closed')
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    size = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))[0]
+    return recv_exactly(sock, size)
+
+
+class UnixSocketManager(PubSubManager):
+    """Publish through a UNIX-socket broker that fans every frame out to all workers"""
+    name = 'unix'
+
+    def __init__(self, path, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def _publish(self, data):
+        payload = pickle.dumps(data)
+        with self._publish_lock:
+            # One reconnect attempt covers a broker restart
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect()
+                    send_frame(self._publisher, payload)
+                    return
+                except OSError:
+                    self._publisher = None
+            self._get_logger().error('Cannot publish to the Socket.IO bus at %s', self.path)
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect()
+                send_frame(sock, SUBSCRIBE)
+            except OSError:
+                time.sleep(1)
+                continue
+            try:
+                while True:
+                    yield recv_frame(sock)
+            except (OSError, ConnectionError):
+                self._get_logger().error('Lost the Socket.IO bus at %s, reconnecting', self.path)
+            finally:
+                sock.close()
+
+
+class SQLiteManager(PubSubManager):
+    """Relay messages through an append-only SQLite table that every worker polls.
+
+    Slower than the other backends, but needs nothing beyond the standard
+    library, which makes it convenient for tests.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, channel='flask-socketio', write_only=False, logger=None,
+                 poll_interval=0.05, retention=60):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._published = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS socketio_bus ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+            'payload BLOB NOT NULL, created_at REAL NOT NULL)'
+        )
+        return conn
+
+    def _publish(self, data):
+        with self._publish_lock:
+            if self._publisher is None:
+                self._publisher = self._connect()
+            now = time.time()
+            self._publisher.execute(
+                'INSERT INTO socketio_bus (channel, payload, created_at) VALUES (?, ?, ?)',
+                (self.channel, pickle.dumps(data), now)
+            )
+            self._published += 1
+            if self._published % 100 == 0:
+                self._publisher.execute('DELETE FROM socketio_bus WHERE created_at < ?',
+                                        (now - self.retention,))
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_bus').fetchone()[0]
+        while True:
+            rows = conn.execute(
+                'SELECT id, payload FROM socketio_bus WHERE id > ? AND channel = ? ORDER BY id',
+                (last_id, self.channel)
+            ).fetchall()
+            for last_id, payload in rows:
+                yield payload
+            if not rows:
+                time.sleep(self.poll_interval)
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            first = recv_frame(self.request)
+            if first == SUBSCRIBE:
+                self.server.serve_subscriber(self.request)
+                return
+            # Any other connection publishes, and is never written to
+            self.server.broadcast(first)
+            while True:
+                self.server.broadcast(recv_frame(self.request))
+        except (OSError, ConnectionError):
+            pass
+
+
+class _Subscriber:
+    def __init__(self, sock, max_pending):
+        self.sock = sock
+        self.pending = queue.Queue(max_pending)
+
+
+class UnixSocketBroker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Fan-out broker: every frame published is sent to all subscribed connections.
+
+    Each subscriber is written to from its own thread, out of a queue of at
+    most `max_pending` frames. A subscriber that falls that far behind is
+    disconnected (its worker reconnects), so a stuck reader never holds up
+    the publishers or the other subscribers.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, max_pending=10000):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _BrokerHandler)
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def serve_subscriber(self, sock):
+        subscriber = _Subscriber(sock, self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            while True:
+                send_frame(sock, subscriber.pending.get())
+        except OSError:
+            pass
+        finally:
+            self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.discard(subscriber)
+        try:
+            # Unblocks the subscriber's thread if it is stuck in sendall
+            subscriber.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def broadcast(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.pending.put_nowait(payload)
+            except queue.Full:
+                logger.warning('Dropping a Socket.IO bus subscriber %d frames behind', self.max_pending)
+                self._drop(subscriber)
+
+
+def create_client_manager(url, channel='flask-socketio'):
+    """Return a client manager for the unix:// and sqlite:// backends, or None.
+
+    Other URLs (redis://, amqp://, ...) are left to Flask-SocketIO's own
+    message_queue support.
+    """
+    if not url:
+        return None
+    if url.startswith('unix://'):
+        return UnixSocketManager(url[len('unix://'):], channel=channel)
+    if url.startswith('sqlite:///'):
+        return SQLiteManager(url[len('sqlite:///'):], channel=channel)
+    return None
+
+
+def socketio_options(message_queue, workers):
+    """Keyword arguments for SocketIO.init_app() in the configured serving mode"""
+    options = {}
+    client_manager = create_client_manager(message_queue)
+    if client_manager is not None:
+        options['client_manager'] = client_manager
+    elif message_queue:
+        options['message_queue'] = message_queue
+    if workers > 1:
+        # Long-polling needs sticky sessions, which a shared listening socket
+        # cannot provide; websocket connections stay on the worker that accepted them
+        options['transports'] = ['websocket']
+    return options
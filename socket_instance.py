@@ -1,6 +1,16 @@
 from flask_socketio import SocketIO
+from emit_batcher import EmitBatcher
 
 # Create a socketio instance without initializing it
 socketio = SocketIO()
 
 # This will be initialized later in app.py
+
+# Coalesces bursts of change events, see emit_batcher.py
+emit_batcher = EmitBatcher(socketio)
+
+# Every authenticated connection joins its user's room; admins also join ADMIN_ROOM
+ADMIN_ROOM = 'admins'
+
+def user_room(user_id):
+    return f'user_{user_id}'
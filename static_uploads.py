@@ -0,0 +1,154 @@
+"""Serve /uploads/ ahead of Flask.
+
+Uploaded files are stored under a UUID-prefixed name and never change, so
+they are sent with a year-long immutable Cache-Control and a strong ETag.
+Conditional (If-None-Match, If-Modified-Since) and single Range requests are
+answered here, without building a Flask request. File bodies go through the
+server's wsgi.file_wrapper where it has one (gunicorn and uWSGI use sendfile);
+eventlet's server has none, and files are then streamed in chunks.
+
+With UPLOADS_SENDFILE_HEADER set to X-Accel-Redirect (nginx) or X-Sendfile
+(Apache, lighttpd), only headers are sent and the front proxy reads the file
+itself.
+"""
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from werkzeug.security import safe_join
+
+CHUNK_SIZE = 256 * 1024
+SENDFILE_HEADERS = ('X-Accel-Redirect', 'X-Sendfile')
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """(start, end) of a single `bytes=` range, inclusive, or None to send the whole file.
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        start = int(start) if start else None
+        end = int(end) if end else None
+    except ValueError:
+        return None
+    if start is None:
+        # Suffix range: the last `end` bytes
+        if not end:
+            raise ValueError('range not satisfiable')
+        return max(0, size - end), size - 1
+    end = size - 1 if end is None else min(end, size - 1)
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class UploadsMiddleware:
+    def __init__(self, app, directory, url_prefix='/uploads/', max_age=31536000,
+                 sendfile_header=None, accel_prefix='/protected-uploads/'):
+        if sendfile_header and sendfile_header not in SENDFILE_HEADERS:
+            raise ValueError(f'sendfile_header must be one of {SENDFILE_HEADERS}')
+        self.app = app
+        self.directory = os.path.abspath(directory)
+        self.url_prefix = url_prefix
+        self.cache_control = f'public, max-age={max_age}, immutable'
+        self.sendfile_header = sendfile_header
+        self.accel_prefix = accel_prefix
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD')
+        if not path.startswith(self.url_prefix) or method not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+
+        filename = path[len(self.url_prefix):]
+        file_path = safe_join(self.directory, filename)
+        try:
+            stat = os.stat(file_path) if file_path else None
+        except OSError:
+            stat = None
+        if stat is None or not os.path.isfile(file_path):
+            return self.respond(start_response, '404 NOT FOUND', [], b'Not Found')
+
+        etag = file_etag(stat)
+        headers = [
+            ('Cache-Control', self.cache_control),
+            ('ETag', etag),
+            ('Last-Modified', formatdate(stat.st_mtime, usegmt=True)),
+            ('Accept-Ranges', 'bytes'),
+            ('Access-Control-Allow-Origin', '*'),
+        ]
+        if self.not_modified(environ, etag, stat):
+            return self.respond(start_response, '304 NOT MODIFIED', headers)
+
+        headers.append(('Content-Type', mimetypes.guess_type(filename)[0] or 'application/octet-stream'))
+        if self.sendfile_header:
+            if self.sendfile_header == 'X-Accel-Redirect':
+                headers.append((self.sendfile_header, self.accel_prefix + filename))
+            else:
+                headers.append((self.sendfile_header, file_path))
+            return self.respond(start_response, '200 OK', headers)
+
+        size = stat.st_size
+        byte_range = None
+        if environ.get('HTTP_IF_RANGE', etag) == etag:
+            try:
+                byte_range = parse_range(environ.get('HTTP_RANGE'), size)
+            except ValueError:
+                headers.append(('Content-Range', f'bytes */{size}'))
+                return self.respond(start_response, '416 RANGE NOT SATISFIABLE', headers)
+
+        if byte_range is None:
+            status, start, length = '200 OK', 0, size
+        else:
+            start, end = byte_range
+            status, length = '206 PARTIAL CONTENT', end - start + 1
+            headers.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+        headers.append(('Content-Length', str(length)))
+        start_response(status, headers)
+        if method == 'HEAD':
+            return []
+
+        f = open(file_path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and byte_range is None:
+            return file_wrapper(f, CHUNK_SIZE)
+        return read_range(f, start, length)
+
+    @staticmethod
+    def not_modified(environ, etag, stat):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            try:
+                return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def respond(start_response, status, headers, body=b''):
+        if not status.startswith('304'):
+            headers = headers + [('Content-Length', str(len(body)))]
+        start_response(status, headers)
+        return [body]
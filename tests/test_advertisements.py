@@ -0,0 +1,74 @@
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+import migrations
+import routes.advertisements
+from models import db, Advertisement, AdvertisementImage, User
+from rate_limits import write_limiter
+from routes.advertisements import advertisements_bp
+from user_cache import user_cache
+
+ALICES_IMAGE = 'uploads/alice_photo.png'
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "forum.db"}',
+        JWT_SECRET_KEY='test',
+        RATE_LIMITS={'advertisements': '100/1', 'writes': '100/1'},
+        RATE_LIMIT_STORAGE='',
+        RATE_LIMIT_MAX_KEYS=1000,
+    )
+    JWTManager(app)
+    db.init_app(app)
+    write_limiter.init_app(app)
+    app.register_blueprint(advertisements_bp, url_prefix='/api/advertisements')
+    user_cache.clear()
+
+    (tmp_path / 'uploads').mkdir()
+    (tmp_path / ALICES_IMAGE).write_bytes(b'\x89PNG\r\n\x1a\n original')
+    with app.app_context():
+        migrations.upgrade()
+        db.session.add_all([
+            User(id=id, username=name, password='x', full_name=name, building_number='1',
+                 apartment_number=str(id), is_approved=True)
+            for id, name in [(1, 'alice'), (2, 'bob')]
+        ])
+        # Alice uploaded the file with her first ad; Bob has an ad of his own
+        db.session.add_all([
+            Advertisement(id=1, title='Bike', content='Red bike', user_id=1, price='10', phone_number='1',
+                          ad_images=[AdvertisementImage(path=ALICES_IMAGE, url=f'http://localhost:5000/{ALICES_IMAGE}')]),
+            Advertisement(id=2, title='Lamp', content='Desk lamp', user_id=2, price='5', phone_number='2'),
+        ])
+        db.session.commit()
+        yield app
+    user_cache.clear()
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    # The image code rewrites originals in place; record which files reach it
+    paths = []
+    monkeypatch.setattr(routes.advertisements, 'process_image', lambda path: paths.append(path) or [])
+    return paths
+
+
+def request(app, method, url, user_id, body):
+    headers = {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+    return getattr(app.test_client(), method)(url, json=body, headers=headers)
+
+
+NEW_AD = {'title': 'Chair', 'content': 'Oak chair', 'price': '20', 'phone_number': '3', 'images': [ALICES_IMAGE]}
+
+
+def test_only_the_uploader_can_attach_a_file(app, processed):
+    assert request(app, 'post', '/api/advertisements', 2, NEW_AD).status_code == 400
+    assert request(app, 'put', '/api/advertisements/2', 2, {'images': [ALICES_IMAGE]}).status_code == 400
+    assert processed == []
+    assert AdvertisementImage.query.filter_by(path=ALICES_IMAGE).count() == 1
+
+    assert request(app, 'post', '/api/advertisements', 1, NEW_AD).status_code == 201
+    assert processed == [ALICES_IMAGE]
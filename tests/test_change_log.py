@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+import pytest
+from flask import Flask
+from sqlalchemy import update
+import change_log
+import migrations
+from change_log import EVERYONE, changes_since, compact, record_change, replay, visible_rooms
+from models import db, ChangeLog
+from socket_instance import ADMIN_ROOM, user_room
+from user_cache import UserState
+
+RESIDENT = UserState(id=1, username='alice', is_admin=False, is_approved=True, is_banned=False)
+NEIGHBOUR = UserState(id=2, username='bob', is_admin=False, is_approved=True, is_banned=False)
+PENDING = UserState(id=3, username='carl', is_admin=False, is_approved=False, is_banned=False)
+ADMIN = UserState(id=4, username='admin', is_admin=True, is_approved=True, is_banned=False)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "forum.db"}'
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        yield app
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """(event, payload, to) of every live emit and replayed socket emit"""
+    emits = []
+    record = lambda event, data, to=None, key=None: emits.append((event, data, to))
+    monkeypatch.setattr(change_log.emit_batcher, 'emit', record)
+    monkeypatch.setattr(change_log.socketio, 'emit', record)
+    return emits
+
+
+def record(event, entity_id, to=EVERYONE, deleted=False):
+    seq = record_change(event, {'id': entity_id}, entity='post', to=to, entity_id=entity_id, deleted=deleted)
+    db.session.commit()
+    return seq
+
+
+def seqs(user, since=0, limit=100):
+    changes, _, _, gone = changes_since(since, visible_rooms(user), limit)
+    assert not gone
+    return [change.seq for change in changes]
+
+
+def test_seq_follows_commit_order_and_rollbacks_leave_no_trace(app, emitted):
+    first = record('post_update', 1)
+    record_change('post_update', {'id': 2}, entity='post', entity_id=2)
+    db.session.rollback()
+    second = record('post_update', 3)
+
+    assert first < second
+    assert seqs(RESIDENT) == [first, second]
+    # Emitted after commit, with their seq; the rolled back change never is
+    assert emitted == [('post_update', {'id': 1, 'seq': first}, None),
+                       ('post_update', {'id': 3, 'seq': second}, None)]
+
+
+def test_changes_are_read_only_from_the_rooms_a_user_is_in(app, emitted):
+    public = record('post_update', 1)
+    own = record('message_update', 2, to=[user_room(RESIDENT.id), ADMIN_ROOM])
+    neighbours = record('message_update', 3, to=user_room(NEIGHBOUR.id))
+    admins = record('user_registered', 4, to=ADMIN_ROOM)
+
+    assert seqs(RESIDENT) == [public, own]
+    assert seqs(NEIGHBOUR) == [public, neighbours]
+    assert seqs(PENDING) == []
+    assert seqs(ADMIN) == [public, own, admins]
+
+
+def test_compaction_keeps_recent_tombstones_and_sends_older_cursors_to_reload(app, emitted):
+    old = [record('post_update', id) for id in (1, 2, 3)]
+    db.session.execute(update(ChangeLog).where(ChangeLog.seq.in_(old))
+                       .values(created_at=datetime.utcnow() - timedelta(days=30)))
+    tombstone = record('post_update', 2, deleted=True)
+
+    assert compact(retention=24 * 3600) == 3
+    db.session.commit()
+
+    changes, _, _, gone = changes_since(old[-1], visible_rooms(RESIDENT), 100)
+    assert not gone
+    assert [(change.seq, change.entity_id, change.deleted) for change in changes] == [(tombstone, 2, True)]
+    # A cursor from before the compacted entries can't be caught up
+    changes, next_since, _, gone = changes_since(old[0], visible_rooms(RESIDENT), 100)
+    assert gone and changes == [] and next_since == tombstone
+
+
+def test_reconnect_replays_only_visible_changes_after_since(app, emitted):
+    seen = record('post_update', 1)
+    theirs = record('message_update', 2, to=user_room(NEIGHBOUR.id))
+    missed = record('post_update', 3)
+    record('user_registered', 4, to=ADMIN_ROOM)
+    emitted.clear()
+
+    replay(seen, visible_rooms(RESIDENT), 'sid-alice')
+    assert emitted == [('post_update', {'id': 3, 'seq': missed}, 'sid-alice')]
+
+    emitted.clear()
+    replay(seen, visible_rooms(NEIGHBOUR), 'sid-bob')
+    assert [payload['seq'] for _, payload, _ in emitted] == [theirs, missed]
+
+
+def test_replay_asks_for_a_resync_when_too_far_behind(app, emitted, monkeypatch):
+    monkeypatch.setattr(change_log, 'CHANGE_LOG_REPLAY_LIMIT', 2)
+    seqs_recorded = [record('post_update', id) for id in range(1, 5)]
+    emitted.clear()
+
+    replay(0, visible_rooms(RESIDENT), 'sid')
+    assert emitted == [('resync_required', {'seq': seqs_recorded[-1]}, 'sid')]
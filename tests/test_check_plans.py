@@ -0,0 +1,32 @@
+import pytest
+from flask import Flask
+from sqlalchemy import or_
+import migrations
+from models import db, Message
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "forum.db"}'
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        yield app
+
+
+def test_hot_queries_use_their_indexes(app):
+    assert [(name, plan) for name, ok, plan in migrations.check_plans() if not ok] == []
+
+
+def test_sorting_every_matching_row_fails(app, monkeypatch):
+    # The inbox as one OR query: both indexes are used, then all of the user's messages are sorted
+    sorted_inbox = Message.query.filter(or_(Message.sender_id == 1, Message.recipient_id == 1)).order_by(
+        Message.created_at.desc(), Message.id.desc()
+    )
+    monkeypatch.setattr(migrations, 'hot_queries', lambda: [
+        ('sorted inbox', sorted_inbox, ['ix_message_sender_id_created_at'], ()),
+    ])
+    [(name, ok, plan)] = migrations.check_plans()
+    assert any('TEMP B-TREE' in line for line in plan)
+    assert not ok
@@ -0,0 +1,88 @@
+import threading
+import time
+import bcrypt
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager
+import routes.auth
+from db_engine import configure_sqlite, install_pragmas
+from models import db, PublicServiceCategory, User
+from routes.auth import auth_bp
+from socket_instance import socketio
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "forum.db"}',
+        SQLITE_PROFILE='production',
+        SQLITE_SYNCHRONOUS='NORMAL',
+        SQLITE_BUSY_TIMEOUT=5000,
+        SQLITE_CACHE_SIZE=-2000,
+        SQLITE_MMAP_SIZE=0,
+        SQLITE_READ_POOL_SIZE=4,
+        # A write stuck behind the writer connection fails after a second
+        SQLITE_WRITER_TIMEOUT=1,
+        JWT_SECRET_KEY='test',
+    )
+    JWTManager(app)
+    configure_sqlite(app)
+    db.init_app(app)
+    install_pragmas(app, db)
+    socketio.init_app(app, async_mode='threading')
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+
+    @app.route('/write', methods=['POST'])
+    def write():
+        db.session.add(PublicServiceCategory(name='Health', description='Clinics'))
+        db.session.commit()
+        return '', 204
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='alice', password=bcrypt.hashpw(b'secret', bcrypt.gensalt(4)).decode(),
+                            full_name='Alice', building_number='1', apartment_number='2', is_approved=True))
+        db.session.commit()
+    return app
+
+
+# bcrypt called directly: eventlet's tpool, which the real functions use, needs
+# the monkey-patched server and hangs when reused from another native thread
+HASHERS = {
+    'check_password': lambda password, hashed: bcrypt.checkpw(password.encode(), hashed.encode()),
+    'hash_password': lambda password: bcrypt.hashpw(password.encode(), bcrypt.gensalt(4)).decode(),
+}
+
+
+@pytest.mark.parametrize('endpoint, hasher, body', [
+    ('/api/auth/login', 'check_password', {'username': 'alice', 'password': 'secret'}),
+    ('/api/auth/register', 'hash_password', {'username': 'bob', 'password': 'secret', 'full_name': 'Bob',
+                                             'building_number': '1', 'apartment_number': '3'}),
+])
+def test_write_does_not_wait_for_password_hashing(app, monkeypatch, endpoint, hasher, body):
+    hashing, release = threading.Event(), threading.Event()
+
+    def held_hasher(*args):
+        # Keep the request inside the hash until the concurrent write is done
+        hashing.set()
+        release.wait(10)
+        return HASHERS[hasher](*args)
+
+    monkeypatch.setattr(routes.auth, hasher, held_hasher)
+    responses = []
+    hashing_request = threading.Thread(target=lambda: responses.append(app.test_client().post(endpoint, json=body)))
+    hashing_request.start()
+    try:
+        assert hashing.wait(5)
+        started = time.monotonic()
+        response = app.test_client().post('/write')
+        elapsed = time.monotonic() - started
+    finally:
+        release.set()
+        hashing_request.join(10)
+
+    assert response.status_code == 204
+    assert elapsed < 0.5
+    assert responses[0].status_code in (200, 201)
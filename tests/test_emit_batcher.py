@@ -0,0 +1,48 @@
+from emit_batcher import EmitBatcher
+
+
+class RecordingSocketIO:
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, data, to=None):
+        self.emitted.append((event, data, to))
+
+    def start_background_task(self, target, *args):
+        self.tasks.append((target, args))
+
+    def sleep(self, seconds):
+        pass
+
+    def run_tasks(self):
+        while self.tasks:
+            target, args = self.tasks.pop(0)
+            target(*args)
+
+
+def test_batched_frames_do_not_clash_with_batch_events():
+    socketio = RecordingSocketIO()
+    batcher = EmitBatcher(socketio, window=0.05)
+    batcher.emit('user_status_changed', {'user_id': 1}, to='admins', key=1)
+    batcher.emit('user_status_changed', {'user_id': 2}, to='admins', key=2)
+    # The bulk endpoint's own event, whose payload is a dict
+    batcher.emit('user_status_changed_batch', {'user_ids': [3, 4], 'status': 'approved'}, to='admins')
+    socketio.run_tasks()
+
+    assert socketio.emitted == [
+        ('user_status_changed_many', [{'user_id': 1}, {'user_id': 2}], 'admins'),
+        ('user_status_changed_batch', {'user_ids': [3, 4], 'status': 'approved'}, 'admins'),
+    ]
+
+
+def test_updates_to_one_entity_merge_and_full_buffers_flush_early():
+    socketio = RecordingSocketIO()
+    batcher = EmitBatcher(socketio, window=0.05, max_size=2)
+    batcher.emit('post_update', {'id': 1, 'v': 1}, to=['a', 'b'], key=1)
+    batcher.emit('post_update', {'id': 1, 'v': 2}, to=['a', 'b'], key=1)
+    assert socketio.emitted == []
+    batcher.emit('post_update', {'id': 2, 'v': 1}, to=['a', 'b'], key=2)
+    assert socketio.emitted == [('post_update_many', [{'id': 1, 'v': 2}, {'id': 2, 'v': 1}], ['a', 'b'])]
+    socketio.run_tasks()
+    assert len(socketio.emitted) == 1
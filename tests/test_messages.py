@@ -0,0 +1,85 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from flask import Flask
+from sqlalchemy import text
+import migrations
+from models import db, Message, User
+from routes.messages import conversations_query, inbox_query, thread_query
+from utils import keyset_page
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "forum.db"}'
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        db.session.add_all([
+            User(id=id, username=f'user{id}', password='x', full_name=f'User {id}', building_number='1',
+                 apartment_number=str(id), is_approved=True)
+            for id in range(1, 6)
+        ])
+        rng = random.Random(7)
+        start = datetime(2024, 1, 1)
+        # Shuffled timestamps, some shared, so created_at and id orders disagree
+        db.session.add_all([
+            Message(content=f'message {i}', sender_id=rng.randint(1, 5), recipient_id=rng.randint(1, 5),
+                    created_at=start + timedelta(minutes=rng.randint(0, 60)))
+            for i in range(300)
+        ])
+        db.session.commit()
+        yield app
+
+
+def newest_first(messages):
+    return [m.id for m in sorted(messages, key=lambda m: (m.created_at, m.id), reverse=True)]
+
+
+def pages(page_query, limit=7):
+    """Every id of a paged query, following the cursor to the end"""
+    ids, before = [], None
+    while True:
+        rows, before = keyset_page(page_query(before, limit + 1), limit)
+        ids += [m.id for m in rows]
+        if before is None:
+            return ids
+
+
+def test_inbox_and_thread_pages_match_a_full_sort(app):
+    messages = Message.query.all()
+    for user_id in range(1, 6):
+        assert pages(lambda before, limit: inbox_query(user_id, before, limit)) == newest_first(
+            m for m in messages if user_id in (m.sender_id, m.recipient_id)
+        )
+        for other_id in range(1, 6):
+            assert pages(lambda before, limit: thread_query(user_id, other_id, before, limit)) == newest_first(
+                m for m in messages if {m.sender_id, m.recipient_id} == {user_id, other_id}
+            )
+
+
+def recount():
+    return db.session.execute(text(
+        f"SELECT user_id, other_id, max(id) FROM ({migrations.MESSAGE_SIDES.format(where='')}) "
+        'GROUP BY user_id, other_id ORDER BY user_id, other_id'
+    )).all()
+
+
+def test_conversations_follow_inserts_and_deletes(app):
+    assert db.session.execute(text('SELECT user_id, other_id, last_message_id FROM conversation '
+                                   'ORDER BY user_id, other_id')).all() == recount()
+
+    # Delete the newest message of some conversations, and every message of others
+    db.session.execute(text('DELETE FROM message WHERE id % 4 = 0 OR (sender_id = 1 AND recipient_id = 2) '
+                            'OR (sender_id = 2 AND recipient_id = 1)'))
+    db.session.add(Message(content='hello', sender_id=3, recipient_id=4))
+    db.session.commit()
+    assert db.session.execute(text('SELECT user_id, other_id, last_message_id FROM conversation '
+                                   'ORDER BY user_id, other_id')).all() == recount()
+
+    for user_id in range(1, 6):
+        expected = sorted(((other, last) for user, other, last in recount() if user == user_id),
+                          key=lambda row: row[1], reverse=True)
+        assert [tuple(row) for row in conversations_query(user_id)] == expected
+        assert [tuple(row) for row in conversations_query(user_id, before=expected[1][1])] == expected[2:]
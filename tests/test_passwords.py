@@ -0,0 +1,65 @@
+import bcrypt
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager
+import migrations
+import routes.auth
+from models import db, User
+from passwords import AttemptLimiter, client_network
+from routes.auth import auth_bp
+
+ATTACKER = '203.0.113.7'
+ATTACKER_NEIGHBOUR = '203.0.113.200'
+OWNER = '198.51.100.4'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "forum.db"}', JWT_SECRET_KEY='test')
+    JWTManager(app)
+    db.init_app(app)
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    # bcrypt called directly, off eventlet's tpool
+    monkeypatch.setattr(routes.auth, 'check_password',
+                        lambda password, hashed: bcrypt.checkpw(password.encode(), hashed.encode()))
+    monkeypatch.setattr(routes.auth, 'ip_attempts', AttemptLimiter(limit=100, window=60))
+    monkeypatch.setattr(routes.auth, 'username_failures', AttemptLimiter(limit=5, window=900))
+    with app.app_context():
+        migrations.upgrade()
+        db.session.add(User(username='alice', password=bcrypt.hashpw(b'secret', bcrypt.gensalt(4)).decode(),
+                            full_name='Alice', building_number='1', apartment_number='2', is_approved=True))
+        db.session.commit()
+    return app.test_client()
+
+
+def login(client, address, password):
+    return client.post('/api/auth/login', json={'username': 'alice', 'password': password},
+                       environ_base={'REMOTE_ADDR': address}).status_code
+
+
+def test_client_network():
+    assert client_network('203.0.113.7') == '203.0.113.0/24'
+    assert client_network('2001:db8::1') == '2001:db8::/64'
+    assert client_network('unix-socket') == 'unix-socket'
+
+
+def test_failures_elsewhere_do_not_lock_the_owner_out(client):
+    for _ in range(5):
+        assert login(client, ATTACKER, 'guess') == 401
+    # Locked out for the attacker's whole /24, before any bcrypt work
+    assert login(client, ATTACKER, 'secret') == 429
+    assert login(client, ATTACKER_NEIGHBOUR, 'guess') == 429
+    # The owner, on another network, still logs in
+    assert login(client, OWNER, 'secret') == 200
+
+
+def test_a_successful_login_clears_its_own_network_only(client):
+    for _ in range(4):
+        assert login(client, OWNER, 'typo') == 401
+        assert login(client, ATTACKER, 'guess') == 401
+    assert login(client, OWNER, 'secret') == 200
+    for _ in range(4):
+        assert login(client, OWNER, 'typo') == 401
+    assert login(client, ATTACKER, 'guess') == 401
+    assert login(client, ATTACKER, 'guess') == 429
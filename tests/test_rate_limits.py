@@ -0,0 +1,40 @@
+import pytest
+from flask import Flask
+from rate_limits import RateLimiter
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def limiter(request, tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        RATE_LIMITS={'posts': '3/60', 'writes': '5/60'},
+        RATE_LIMIT_STORAGE='' if request.param == 'memory' else f'sqlite:///{tmp_path / "limits.db"}',
+        RATE_LIMIT_MAX_KEYS=1000,
+    )
+    limiter = RateLimiter()
+    limiter.init_app(app)
+    return limiter
+
+
+def test_refused_request_takes_no_tokens(limiter):
+    # Exhaust 'writes' through another endpoint; 'posts' is still full
+    for _ in range(5):
+        assert limiter.retry_after(1, ('writes',)) == 0
+    assert limiter.retry_after(1, ('writes',)) > 0
+
+    # Refused by 'writes', so these must not drain 'posts'
+    for _ in range(10):
+        assert limiter.retry_after(1, ('posts', 'writes')) > 0
+
+    for _ in range(3):
+        assert limiter.retry_after(1, ('posts',)) == 0
+    assert limiter.retry_after(1, ('posts',)) > 0
+
+
+def test_retry_after_waits_for_every_bucket(limiter):
+    for _ in range(3):
+        assert limiter.retry_after(2, ('posts', 'writes')) == 0
+    # 'posts' refills a token every 20 s, 'writes' still has two
+    assert limiter.retry_after(2, ('posts', 'writes')) == 20
+    assert limiter.retry_after(2, ('writes',)) == 0
+    assert limiter.retry_after(3, ('posts', 'writes')) == 0
@@ -0,0 +1,62 @@
+import gzip
+import pytest
+from flask import Flask
+import migrations
+from compression import init_compression
+from json_provider import FastJSONProvider
+from models import db
+from response_cache import VersionedCache
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "forum.db"}',
+        COMPRESS_MIN_SIZE=500,
+        COMPRESS_GZIP_LEVEL=6,
+        COMPRESS_BROTLI_LEVEL=4,
+    )
+    db.init_app(app)
+    init_compression(app)
+    cache = VersionedCache('posts')
+
+    @app.route('/posts')
+    def posts():
+        return cache.response(('feed',), lambda: ([{'id': i, 'content': 'post'} for i in range(100)], {}))
+
+    with app.app_context():
+        migrations.upgrade()
+    return app.test_client()
+
+
+def get(client, encoding=None, etag=None):
+    headers = {'Accept-Encoding': encoding or 'identity'}
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get('/posts', headers=headers)
+
+
+def test_each_encoding_has_its_own_strong_etag(client):
+    identity = get(client)
+    gzipped = get(client, 'gzip')
+
+    assert identity.get_etag() == ('posts-0-feed', False)
+    assert gzipped.get_etag() == ('posts-0-feed-gzip', False)
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data) == identity.data
+    assert 'Accept-Encoding' in gzipped.vary and 'Accept-Encoding' in identity.vary
+
+
+def test_revalidation_matches_the_representation_held(client):
+    gzip_etag = get(client, 'gzip').headers['ETag']
+    identity_etag = get(client).headers['ETag']
+
+    not_modified = get(client, 'gzip', gzip_etag)
+    assert not_modified.status_code == 304
+    assert not_modified.headers['ETag'] == gzip_etag
+    assert 'Accept-Encoding' in not_modified.vary
+    # A client now refusing gzip can't reuse its gzip copy
+    assert get(client, etag=gzip_etag).status_code == 200
+    assert get(client, etag=identity_etag).status_code == 304
@@ -0,0 +1,57 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+import migrations
+import seed
+from models import db
+
+POST_COLUMNS = ('id', 'content', 'user_id', 'created_at', 'is_deleted')
+POST_TRIGGERS = {'post_fts_insert', 'post_insert_bumps_posts'}
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "forum.db"}'
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        yield app
+
+
+def post_rows(count, fail_after=None):
+    for i in range(1, count + 1):
+        if i == fail_after:
+            raise RuntimeError('generator failed')
+        yield (i, f'post {i}', 1, '2024-01-01 00:00:00.000000', False)
+
+
+def triggers():
+    return {name for name, in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+
+
+def scalar(sql):
+    return db.session.execute(text(sql)).scalar()
+
+
+def test_insert_rows_catches_up_and_restores_triggers(app):
+    version = scalar("SELECT version FROM cache_version WHERE name = 'posts'")
+    assert seed.insert_rows('post', POST_COLUMNS, post_rows(5)) == 5
+    assert POST_TRIGGERS <= triggers()
+    assert scalar("SELECT count(*) FROM post_fts WHERE post_fts MATCH 'post'") == 5
+    assert scalar("SELECT version FROM cache_version WHERE name = 'posts'") == version + 1
+
+
+def test_failure_mid_seed_leaves_triggers_in_place(app, monkeypatch):
+    # Small batches, so some rows are inserted before the generator fails
+    monkeypatch.setattr(seed, 'BATCH_SIZE', 2)
+    with pytest.raises(RuntimeError):
+        seed.insert_rows('post', POST_COLUMNS, post_rows(10, fail_after=4))
+
+    assert POST_TRIGGERS <= triggers()
+    assert scalar('SELECT count(*) FROM post') == 0
+    # The restored triggers still index new posts
+    db.session.execute(text("INSERT INTO post (content, user_id, created_at, is_deleted) "
+                            "VALUES ('hello', 1, '2024-01-01 00:00:00.000000', 0)"))
+    db.session.commit()
+    assert scalar("SELECT count(*) FROM post_fts WHERE post_fts MATCH 'hello'") == 1
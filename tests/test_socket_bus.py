@@ -0,0 +1,88 @@
+import socket
+import threading
+import time
+import pytest
+import socketio
+from flask import Flask
+from flask_socketio import SocketIO
+from werkzeug.serving import make_server
+from socket_bus import SUBSCRIBE, UnixSocketBroker, UnixSocketManager, recv_frame, send_frame
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def broker(tmp_path):
+    server = UnixSocketBroker(str(tmp_path / 'bus.sock'), max_pending=1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def worker(path):
+    app = Flask(__name__)
+    return app, SocketIO(app, async_mode='threading', client_manager=UnixSocketManager(path))
+
+
+def test_emit_on_one_worker_reaches_client_on_another(broker):
+    app_a, socketio_a = worker(broker.server_address)
+    app_b, socketio_b = worker(broker.server_address)
+    server_b = make_server('127.0.0.1', 0, app_b, threaded=True)
+    threading.Thread(target=server_b.serve_forever, daemon=True).start()
+
+    received = []
+    client = socketio.Client()
+    client.on('post_update', received.append)
+    client.connect(f'http://127.0.0.1:{server_b.port}', transports=['polling'])
+    try:
+        # Worker B subscribes to the bus once its first client connects
+        assert wait_for(lambda: len(broker._subscribers) == 1)
+        socketio_a.emit('post_update', {'id': 1})
+        assert wait_for(lambda: received)
+        assert received == [{'id': 1}]
+    finally:
+        client.disconnect()
+        server_b.shutdown()
+
+
+def test_stuck_subscriber_does_not_block_publishers(broker):
+    def subscribe():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(broker.server_address)
+        send_frame(sock, SUBSCRIBE)
+        return sock
+
+    stuck = subscribe()  # never reads
+    reader = subscribe()
+    assert wait_for(lambda: len(broker._subscribers) == 2)
+
+    emits = 5000
+    delivered = []
+
+    def read():
+        while len(delivered) < emits:
+            delivered.append(recv_frame(reader))
+
+    reading = threading.Thread(target=read, daemon=True)
+    reading.start()
+    manager = UnixSocketManager(broker.server_address)
+    publishing = threading.Thread(target=lambda: [manager._publish({'method': 'emit', 'data': 'x' * 1000})
+                                                  for _ in range(emits)], daemon=True)
+    publishing.start()
+
+    publishing.join(timeout=10)
+    reading.join(timeout=10)
+    assert not publishing.is_alive()
+    assert len(delivered) == emits
+    # The subscriber that stopped reading was dropped; the publisher never was a subscriber
+    assert len(broker._subscribers) == 1
+    stuck.close()
+    reader.close()
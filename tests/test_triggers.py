@@ -0,0 +1,128 @@
+import random
+import pytest
+from flask import Flask
+from sqlalchemy import text
+import migrations
+from migrations import UNREAD_MESSAGE, USER_FLAGS, VISIBLE_ROW
+from models import db, Advertisement, Message, Post, PublicService, PublicServiceCategory, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "forum.db"}'
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        yield app
+
+
+def rows(sql):
+    return sorted(tuple(row) for row in db.session.execute(text(sql)))
+
+
+def versions():
+    return dict(rows('SELECT name, version FROM cache_version'))
+
+
+def assert_counters_match_a_recount():
+    assert rows('SELECT user_id, sender_id, count FROM unread_count WHERE count != 0') == rows(
+        f"SELECT recipient_id, sender_id, count(*) FROM message WHERE {UNREAD_MESSAGE.format(row='message')} "
+        'GROUP BY recipient_id, sender_id'
+    )
+    assert rows('SELECT is_admin, is_approved, is_banned, count FROM user_status_count WHERE count != 0') == rows(
+        f"SELECT {USER_FLAGS.format(row='user')}, count(*) FROM user GROUP BY 1, 2, 3"
+    )
+    assert rows('SELECT rowid, content FROM post_fts') == rows(
+        f"SELECT id, content FROM post WHERE {VISIBLE_ROW.format(row='post')}"
+    )
+    assert rows('SELECT rowid, title, content FROM advertisement_fts') == rows(
+        f"SELECT id, title, content FROM advertisement WHERE {VISIBLE_ROW.format(row='advertisement')}"
+    )
+
+
+def test_counters_and_search_index_follow_every_write(app):
+    rng = random.Random(3)
+    users = [User(username=f'user{i}', password='x', full_name=f'User {i}', building_number='1',
+                  apartment_number=str(i), is_admin=i == 0, is_approved=i % 4 != 1) for i in range(12)]
+    db.session.add_all(users)
+    db.session.flush()
+    ids = [user.id for user in users]
+    db.session.add_all([Post(content=f'post {i} word{i % 5}', user_id=rng.choice(ids)) for i in range(60)])
+    db.session.add_all([Advertisement(title=f'ad {i}', content=f'selling thing{i % 3}', user_id=rng.choice(ids),
+                                      price=1, phone_number='1') for i in range(30)])
+    db.session.add_all([Message(content=f'message {i}', sender_id=rng.choice(ids), recipient_id=rng.choice(ids))
+                        for i in range(150)])
+    db.session.commit()
+    assert_counters_match_a_recount()
+
+    # Updates: read some messages one by one and a conversation in bulk, edit posts and ads
+    for message in rng.sample(Message.query.all(), 40):
+        message.is_read = True
+    db.session.execute(text('UPDATE message SET is_read = 1 WHERE recipient_id = :r AND sender_id = :s'),
+                       {'r': ids[2], 's': ids[3]})
+    for post in rng.sample(Post.query.all(), 10):
+        post.content = post.content + ' edited'
+    for ad in rng.sample(Advertisement.query.all(), 5):
+        ad.title = ad.title + ' (reduced)'
+    # Status changes
+    for user in users[5:8]:
+        user.is_approved = not user.is_approved
+    users[8].is_admin = True
+    db.session.commit()
+    assert_counters_match_a_recount()
+
+    # Soft deletes, including of read and already deleted rows
+    for model in (Post, Advertisement, Message):
+        for row in rng.sample(model.query.all(), 12):
+            row.is_deleted = True
+    db.session.commit()
+    assert_counters_match_a_recount()
+
+    # Bans hide everything the user wrote; unbans bring back what isn't deleted
+    for user in users[3:6]:
+        user.is_banned = True
+    db.session.commit()
+    assert_counters_match_a_recount()
+    users[4].is_banned = False
+    db.session.commit()
+    assert_counters_match_a_recount()
+
+    # Hard deletes: a rejected user goes with their posts, ads and messages
+    db.session.delete(users[9])
+    db.session.delete(Message.query.first())
+    db.session.commit()
+    assert_counters_match_a_recount()
+
+
+def test_cache_versions_bump_on_the_writes_they_cover(app):
+    author = User(username='alice', password='x', full_name='Alice', building_number='1', apartment_number='1',
+                  is_approved=True)
+    other = User(username='bob', password='x', full_name='Bob', building_number='1', apartment_number='2',
+                 is_approved=True)
+    db.session.add_all([author, other])
+    db.session.commit()
+
+    def bumped(write):
+        before = versions()
+        write()
+        db.session.commit()
+        after = versions()
+        return {name for name in after if after[name] != before.get(name)}
+
+    assert bumped(lambda: db.session.add(Post(content='hello', user_id=author.id))) == {'posts'}
+    assert bumped(lambda: db.session.add(
+        Advertisement(title='Bike', content='Red', user_id=author.id, price=1, phone_number='1')
+    )) == {'advertisements'}
+    category = PublicServiceCategory(name='Health', description='Clinics')
+    assert bumped(lambda: db.session.add(category)) == {'public_services'}
+    assert bumped(lambda: db.session.add(
+        PublicService(name='Clinic', category=category.id, phone_number='1', status='Active')
+    )) == {'public_services'}
+    # Messages and unrendered user columns leave the cached pages alone
+    assert bumped(lambda: db.session.add(Message(content='hi', sender_id=author.id, recipient_id=other.id))) == set()
+    assert bumped(lambda: setattr(author, 'full_name', 'Alice Smith')) == set()
+    # A rename or ban changes what the feed and listings render
+    assert bumped(lambda: setattr(author, 'is_banned', True)) == {'posts', 'advertisements'}
+    assert bumped(lambda: setattr(author, 'username', 'alice2')) == {'posts', 'advertisements'}
+    assert bumped(lambda: setattr(Post.query.first(), 'is_deleted', True)) == {'posts'}
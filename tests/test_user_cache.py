@@ -0,0 +1,81 @@
+import sqlite3
+import pytest
+from flask import Flask
+from sqlalchemy import event
+import migrations
+from models import db, User
+from user_cache import UserStateCache
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "forum.db"}'
+    app.config['SQLITE_PROFILE'] = 'default'
+    db.init_app(app)
+    with app.app_context():
+        migrations.upgrade()
+        db.session.add_all([
+            User(id=id, username=name, password='x', full_name=name, building_number='1',
+                 apartment_number=str(id), is_approved=True)
+            for id, name in [(1, 'alice'), (2, 'bob'), (3, 'carl'), (4, 'dave')]
+        ])
+        db.session.commit()
+        yield app
+
+
+@pytest.fixture
+def statements(app):
+    executed = []
+    listener = lambda conn, cursor, statement, *args: executed.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def other_worker(app, sql):
+    # A change committed by another process, which this one never sees happen
+    conn = sqlite3.connect(db.engine.url.database)
+    conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def test_hits_run_no_sql_between_syncs(app, statements):
+    cache = UserStateCache(100, ttl=30, sync_interval=60)
+    assert cache.get(1).username == 'alice'
+    statements.clear()
+    for _ in range(10):
+        assert cache.get(1).username == 'alice'
+    assert statements == []
+
+
+def test_changes_from_other_workers_drop_only_those_users(app, statements):
+    cache = UserStateCache(100, ttl=30, sync_interval=0)
+    assert not cache.get(1).is_banned
+    assert not cache.get(2).is_banned
+
+    other_worker(app, 'UPDATE user SET is_banned = 1 WHERE id = 1')
+    other_worker(app, "UPDATE user SET full_name = 'Bobby' WHERE id = 2")  # not part of the cached state
+    statements.clear()
+    assert cache.get(2).is_banned is False
+    assert len(statements) == 1  # the sync; bob is still cached
+    assert cache.get(1).is_banned
+
+    other_worker(app, 'DELETE FROM user WHERE id = 1')
+    assert cache.get(1) is None
+
+
+def test_pruned_changes_clear_the_cache(app, statements):
+    cache = UserStateCache(100, ttl=30, sync_interval=0)
+    cache.get(1)
+    cache.get(2)
+
+    other_worker(app, 'UPDATE user SET is_approved = 0 WHERE id = 3')
+    other_worker(app, 'UPDATE user SET is_approved = 0 WHERE id = 4')
+    # Carl's change was pruned before this process read it, so any entry may be stale
+    other_worker(app, 'DELETE FROM user_state_change WHERE user_id = 3')
+    cache.get(1)
+    statements.clear()
+    cache.get(2)
+    assert any('FROM user ' in statement for statement in statements)
@@ -0,0 +1,110 @@
+"""Cache of users' auth state so authenticated requests skip the per-request user lookup.
+
+Entries live in a process-wide LRU. Triggers append the id of every user whose
+name, role or status changes, or who is deleted, to user_state_change (see
+migrations.py). Each process reads the new rows at most every
+USER_CACHE_SYNC_INTERVAL seconds and drops just those users, so a ban or
+approval made in any worker process is seen by all of them within that
+interval, without a query per lookup. The worker making the change drops its
+entry at once. Entries also expire after USER_CACHE_TTL seconds.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import g
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import func, select
+from models import db, User, UserStateChange
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_SYNC_INTERVAL = float(os.environ.get('USER_CACHE_SYNC_INTERVAL', 1))
+
+UserState = namedtuple('UserState', ['id', 'username', 'is_admin', 'is_approved', 'is_banned'])
+
+
+class UserStateCache:
+    def __init__(self, max_size, ttl, sync_interval):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._entries = OrderedDict()  # user id -> (expires at, UserState)
+        self._synced_at = None
+        self._seen = None  # last user_state_change seq applied
+        self._generation = 0  # bumped whenever entries are dropped
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the UserState for user_id, loading it on a miss, or None if the user doesn't exist"""
+        now = time.monotonic()
+        self._sync(now)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            generation = self._generation
+
+        row = db.session.query(
+            User.id, User.username, User.is_admin, User.is_approved, User.is_banned
+        ).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        state = UserState(*row)
+
+        with self._lock:
+            # Only keep the row if no change was applied while it was being loaded
+            if self._generation == generation:
+                self._entries[user_id] = (now + self.ttl, state)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return state
+
+    def _sync(self, now):
+        """Drop the entries of users changed since the last sync, at most every sync_interval seconds"""
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        seen = self._seen
+        if seen is None:
+            # Nothing is cached yet; only changes from here on matter
+            self._seen = db.session.execute(select(func.max(UserStateChange.seq))).scalar() or 0
+            return
+
+        changes = db.session.execute(
+            select(UserStateChange.seq, UserStateChange.user_id)
+            .where(UserStateChange.seq > seen).order_by(UserStateChange.seq)
+        ).all()
+        if not changes:
+            return
+        with self._lock:
+            if changes[0].seq > seen + 1:
+                # The log was pruned past changes this process never read
+                self._entries.clear()
+            else:
+                for change in changes:
+                    self._entries.pop(change.user_id, None)
+            self._seen = max(self._seen, changes[-1].seq)
+            self._generation += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+user_cache = UserStateCache(USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_SYNC_INTERVAL)
+
+
+def get_current_user_state():
+    """UserState of the JWT identity, memoized on the request"""
+    if 'user_state' not in g:
+        g.user_state = user_cache.get(int(get_jwt_identity()))
+    return g.user_state
@@ -1,11 +1,15 @@
 import os
 import json
+import struct
 import uuid
-from werkzeug.utils import secure_filename
-from flask import current_app
+from werkzeug.utils import safe_join, secure_filename
+from flask import current_app, request
+from sqlalchemy import select, tuple_
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# JPEG start-of-frame markers (SOF0-SOF15 minus DHT, JPG and DAC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -32,6 +36,27 @@ def save_multiple_files(files):
             paths.append(path)
     return paths
 
+def uploaded_image_paths(paths):
+    """Validate client-supplied image paths (as returned for earlier uploads).
+
+    Returns the stored paths, or None unless every one names an existing
+    image file inside UPLOAD_FOLDER; nothing else may reach the image code,
+    which rewrites files in place. Callers also check that the files are the
+    user's own uploads.
+    """
+    if not isinstance(paths, list):
+        return None
+    resolved = []
+    for path in paths:
+        if not isinstance(path, str) or not allowed_file(path):
+            return None
+        prefix = UPLOAD_FOLDER + '/'
+        path = safe_join(UPLOAD_FOLDER, path[len(prefix):] if path.startswith(prefix) else path)
+        if path is None or not os.path.isfile(path):
+            return None
+        resolved.append(path)
+    return resolved
+
 def get_image_urls(image_paths):
     """Convert image paths to URLs that can be accessed from the frontend"""
     if not image_paths:
@@ -46,3 +71,86 @@ def get_image_urls(image_paths):
     
     base_url = current_app.config.get('BASE_URL', 'http://localhost:5000')
     return [f"{base_url}/{path}" for path in image_paths]
+
+def get_image_size(path):
+    """Read (width, height) from a PNG, GIF, WebP or JPEG header without decoding the image.
+
+    Returns (None, None) when the file is missing or the format is not recognised.
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(30)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                return struct.unpack('>II', head[16:24])
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', head[6:10])
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                chunk = head[12:16]
+                if chunk == b'VP8X':
+                    return (int.from_bytes(head[24:27], 'little') + 1,
+                            int.from_bytes(head[27:30], 'little') + 1)
+                if chunk == b'VP8 ':
+                    width, height = struct.unpack('<HH', head[26:30])
+                    return width & 0x3FFF, height & 0x3FFF
+                if chunk == b'VP8L':
+                    bits = int.from_bytes(head[21:25], 'little')
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if head.startswith(b'\xff\xd8'):
+                # Walk the JPEG segments until a start-of-frame marker
+                f.seek(2)
+                while True:
+                    marker = f.read(2)
+                    if len(marker) < 2 or marker[0] != 0xFF:
+                        break
+                    segment_length = struct.unpack('>H', f.read(2))[0]
+                    if marker[1] in SOF_MARKERS:
+                        height, width = struct.unpack('>xHH', f.read(5))
+                        return width, height
+                    f.seek(segment_length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        pass
+    return None, None
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def get_pagination_args(cursor='before'):
+    """Read the keyset pagination arguments (?before=<id>&limit=) from the request.
+
+    Oldest-first lists pass cursor='after' to read ?after=<id> instead.
+    """
+    position = request.args.get(cursor, type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return position, max(1, min(limit, MAX_PAGE_SIZE))
+
+def filter_before(query, model, before):
+    """Restrict a newest-first (created_at DESC, id DESC) query to rows older than `before`"""
+    if before is None:
+        return query
+    cursor_created_at = select(model.created_at).where(model.id == before).scalar_subquery()
+    return query.filter(tuple_(model.created_at, model.id) < tuple_(cursor_created_at, before))
+
+def filter_after(query, model, after):
+    """Restrict an oldest-first (created_at, id) query to rows newer than `after`"""
+    if after is None:
+        return query
+    cursor_created_at = select(model.created_at).where(model.id == after).scalar_subquery()
+    return query.filter(tuple_(model.created_at, model.id) > tuple_(cursor_created_at, after))
+
+def keyset_page(query, limit, key='id'):
+    """Fetch one page from an ordered query and return (rows, next_before).
+
+    One extra row is fetched to know whether another page exists; next_before
+    is the `key` of the last row, to pass as ?before= for the following page,
+    or None at the end.
+    """
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], getattr(rows[limit - 1], key)
+    return rows, None
+
+def pagination_headers(next_cursor, header='X-Next-Before'):
+    """Response headers advertising the cursor of the next page"""
+    if next_cursor is None:
+        return {}
+    return {header: str(next_cursor)}